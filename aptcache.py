@@ -0,0 +1,66 @@
+from remotebatch import CommandBatch, apt_command, apt_install
+from starcluster.logger import log
+
+DEFAULT_PROXY_PORT = 3142
+DEFAULT_UPDATE_WINDOW = 60
+PROXY_CONFIG_PATH = '/etc/apt/apt.conf.d/01myria-proxy'
+PROXY_SERVER_CONFIG_PATH = '/etc/apt-cacher-ng/acng.conf'
+UPDATE_STAMP_PATH = '/var/lib/apt/myria-ec2-update.stamp'
+# What the package lists depend on: the sources and the proxy they come via
+SOURCES_PATHS = '/etc/apt/sources.list /etc/apt/sources.list.d/* {}'.format(
+    PROXY_CONFIG_PATH)
+
+
+def update_once_command(window=DEFAULT_UPDATE_WINDOW):
+    """
+    `apt-get update`, skipped when another installer on this node already
+    ran it within the last `window` minutes against the same sources.  The
+    stamp holds a hash of the sources and proxy configuration, so adding a
+    repository forces a fresh update however recent the last one was.
+    """
+    return ('key=$(cat {sources} 2>/dev/null | md5sum); '
+            '{{ [ "$(cat {stamp} 2>/dev/null)" = "$key" ] && '
+            '[ -n "$(find {stamp} -mmin -{window} 2>/dev/null)" ]; }} || '
+            '({update} && echo "$key" > {stamp})'.format(
+                sources=SOURCES_PATHS, stamp=UPDATE_STAMP_PATH,
+                window=window, update=apt_command('update')))
+
+
+class PackageCache(object):
+    """
+    A caching package proxy (apt-cacher-ng) hosted on the master.
+
+    Every node, the master included, is pointed at the proxy before its
+    package installation steps, so each .deb is fetched from the upstream
+    mirror once per cluster rather than once per node.
+    """
+
+    def __init__(self, port=DEFAULT_PROXY_PORT):
+        self.port = int(port)
+
+    def server_commands(self):
+        return [
+            update_once_command(),
+            apt_install('apt-cacher-ng'),
+            r'sed -i "s/^\s*#\?\s*Port\s*:.*/Port: {port}/" {path}'.format(
+                port=self.port, path=PROXY_SERVER_CONFIG_PATH),
+            'sudo service apt-cacher-ng restart',
+            "bash -c 'for i in $(seq 30); do "
+            "exec 3<>/dev/tcp/localhost/{} && exit 0; sleep 1; done; "
+            "exit 1'".format(self.port)]
+
+    def client_command(self, host):
+        return ('echo \'Acquire::http::Proxy "http://{host}:{port}";\' '
+                '> {path}'.format(host=host, port=self.port,
+                                  path=PROXY_CONFIG_PATH))
+
+    def set_up_master(self, master):
+        log.info('Begin package cache setup on {}'.format(master.alias))
+        batch = CommandBatch(master)
+        batch.extend('Install package proxy', self.server_commands())
+        batch.add('Use package proxy', self.client_command('127.0.0.1'))
+        batch.run()
+
+    def configure_client(self, batch, master_address):
+        host = '127.0.0.1' if batch.node.is_master() else master_address
+        batch.add('Use package proxy', self.client_command(host))
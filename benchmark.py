@@ -0,0 +1,242 @@
+#!/usr/bin/python
+"""
+Benchmarks for the provisioning plugins against simulated nodes.
+
+    python benchmark.py batch --nodes 16 --latency 0.05
+    python benchmark.py scale --sizes 2 32 500 --jitter 0.02 \\
+        --results ~/.starcluster/myria-benchmarks.jsonl
+    python benchmark.py distribution --sizes 8 64 256 --transfer-time 0.1
+    python benchmark.py engine --sizes 100 500 1000 --hung 2 --hang 5 \
+        --node-timeout 2
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import clustersim
+import distribution
+import engine
+import getresturl
+import remotebatch
+import postgresplugin
+import myriaplugin
+
+
+class UnbatchedCommands(remotebatch.CommandBatch):
+    """ Issues every step as its own round trip, as before batching """
+
+    def run(self):
+        for _, command in self.steps:
+            self.node.ssh.execute(command)
+        return []
+
+
+class ScratchUrlCache(getresturl.UrlCache):
+    """ Keeps MyriaInstaller.run away from the user's REST URL cache """
+
+    def __init__(self, path=None, ttl=getresturl.DEFAULT_TTL):
+        super(ScratchUrlCache, self).__init__(
+            path or os.path.join(tempfile.gettempdir(),
+                                 'myria-benchmark-rest-urls.json'), ttl)
+
+
+def set_up_nodes(nodes):
+    postgres = postgresplugin.PostgresInstaller()
+    myria = myriaplugin.MyriaInstaller()
+    pool = clustersim.FakePool()
+    for installer in [postgres, myria]:
+        for node in nodes:
+            pool.simple_job(installer._set_up_node, node, jobid=node.alias)
+        pool.wait(len(nodes))
+
+
+def benchmark_batch(arguments):
+    results = {}
+    for mode in ['unbatched', 'batched']:
+        factory = UnbatchedCommands if mode == 'unbatched' \
+            else remotebatch.CommandBatch
+        postgresplugin.CommandBatch = myriaplugin.CommandBatch = factory
+
+        nodes, counters = clustersim.make_cluster(
+            arguments.nodes, latency=arguments.latency)
+        start = time.time()
+        set_up_nodes(nodes)
+        results[mode] = {'round_trips': counters.round_trips,
+                         'wall_time': time.time() - start}
+
+    postgresplugin.CommandBatch = myriaplugin.CommandBatch = \
+        remotebatch.CommandBatch
+    return results
+
+
+def provision(nodes):
+    """ The real PostgresInstaller and MyriaInstaller run() methods """
+    postgres = postgresplugin.PostgresInstaller()
+    postgres.run(nodes, nodes[0], 'root', 'bash', {})
+    myria = myriaplugin.MyriaInstaller()
+    cache, getresturl.UrlCache = getresturl.UrlCache, ScratchUrlCache
+    try:
+        myria.run(nodes, nodes[0], 'root', 'bash', {})
+    finally:
+        getresturl.UrlCache = cache
+    return len(set(postgres.engine.quarantined) |
+               set(myria.engine.quarantined))
+
+
+def benchmark_scale(arguments):
+    results = {}
+    for size in arguments.sizes:
+        nodes, counters = clustersim.make_cluster(
+            size, latency=arguments.latency, jitter=arguments.jitter,
+            failure_rate=arguments.failure_rate, seed=arguments.seed)
+        start = time.time()
+        error = quarantined = None
+        try:
+            quarantined = provision(nodes)
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+        results['{} nodes'.format(size)] = {
+            'nodes': size,
+            'wall_time': time.time() - start,
+            'round_trips': counters.round_trips,
+            'peak_concurrency': counters.peak,
+            'injected_failures': counters.failures,
+            'quarantined': quarantined,
+            'error': error}
+    return results
+
+
+def benchmark_engine(arguments):
+    """
+    PostgresInstaller's node setup on StarCluster's thread-per-job pool
+    versus the bounded engine, with `hung` nodes whose every round trip
+    takes `hang` seconds.
+    """
+    results = {}
+    for size in arguments.sizes:
+        for mode in ['pool', 'engine']:
+            nodes, counters = clustersim.make_cluster(
+                size, latency=arguments.latency, jitter=arguments.jitter,
+                failure_rate=arguments.failure_rate, seed=arguments.seed)
+            for node in nodes[1:arguments.hung + 1]:
+                node.ssh.latency = arguments.hang
+            postgres = postgresplugin.PostgresInstaller()
+
+            start = time.time()
+            if mode == 'pool':
+                pool = clustersim.FakePool()
+                for node in nodes:
+                    pool.simple_job(postgres._set_up_node, node,
+                                    jobid=node.alias)
+                pool.wait(len(nodes))
+                failed = len(pool.errors)
+            else:
+                runner = engine.Engine(arguments.concurrency,
+                                       arguments.node_timeout,
+                                       arguments.command_timeout)
+                runner.run(postgres._set_up_node, nodes)
+                failed = len(runner.quarantined)
+            results['{} {} nodes'.format(mode, size)] = {
+                'nodes': size,
+                'wall_time': time.time() - start,
+                'round_trips': counters.round_trips,
+                'peak_concurrency': counters.peak,
+                'failed': failed}
+    return results
+
+
+def benchmark_distribution(arguments):
+    results = {}
+    for size in arguments.sizes:
+        for mode in ['push', 'tree']:
+            nodes, counters = clustersim.make_cluster(
+                size, latency=arguments.latency, jitter=arguments.jitter,
+                transfer_time=arguments.transfer_time, seed=arguments.seed)
+            nodes[0].ssh.respond(r'sha256sum \S+/bundle.partial',
+                                 ['0' * 64])
+            start = time.time()
+            bundle = distribution.Bundle.create(nodes[0], '~/myria')
+            distribution.distribute(nodes[0], nodes[1:], bundle, '~/myria',
+                                    tree=mode == 'tree')
+            results['{} {} nodes'.format(mode, size)] = {
+                'nodes': size,
+                'wall_time': time.time() - start,
+                'round_trips': counters.round_trips,
+                'peak_concurrency': counters.peak}
+    return results
+
+
+SCENARIOS = {'batch': benchmark_batch,
+             'distribution': benchmark_distribution,
+             'engine': benchmark_engine,
+             'scale': benchmark_scale}
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def store(path, scenario, arguments, results):
+    """ Append results to a JSON lines history for later comparison """
+    parameters = dict((key, value) for key, value in vars(arguments).items()
+                      if key not in ('scenario', 'results'))
+    with open(os.path.expanduser(path), 'a') as descriptor:
+        for mode, result in sorted(results.items()):
+            descriptor.write(json.dumps(
+                {'time': time.time(), 'revision': revision(),
+                 'scenario': scenario, 'mode': mode,
+                 'parameters': parameters, 'result': result},
+                sort_keys=True) + '\n')
+
+
+def report(scenario, results):
+    for mode, result in sorted(results.items()):
+        print '{:<10} {:<12} {}'.format(
+            scenario, mode,
+            ' '.join('{}={:.3f}'.format(key, value)
+                     if isinstance(value, float)
+                     else '{}={}'.format(key, value)
+                     for key, value in sorted(result.items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--nodes', type=int, default=8)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[2, 8, 32, 128, 500],
+                        help='Cluster sizes for the scale scenario')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Injected seconds per SSH round trip')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Maximum extra seconds per SSH round trip')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Probability that a remote command fails')
+    parser.add_argument('--transfer-time', type=float, default=0.05,
+                        help='Seconds an scp holds the sender\'s uplink')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--hung', type=int, default=0,
+                        help='Nodes that respond slowly in the engine '
+                             'scenario')
+    parser.add_argument('--hang', type=float, default=5.0,
+                        help='Seconds per round trip on a hung node')
+    parser.add_argument('--concurrency', type=int,
+                        default=engine.DEFAULT_CONCURRENCY)
+    parser.add_argument('--node-timeout', type=float, default=None)
+    parser.add_argument('--command-timeout', type=float, default=None)
+    parser.add_argument('--results',
+                        help='JSON lines file to append results to')
+    arguments = parser.parse_args()
+
+    results = SCENARIOS[arguments.scenario](arguments)
+    report(arguments.scenario, results)
+    if arguments.results:
+        store(arguments.results, arguments.scenario, arguments, results)
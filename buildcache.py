@@ -0,0 +1,88 @@
+import re
+import json
+import hashlib
+from starcluster.logger import log
+
+DEFAULT_CACHE_DIRECTORY = '/mnt/myria_build_cache'
+DEFAULT_CACHE_ENTRIES = 4
+ARCHIVE_EXCLUDES = ['.git', '.gradle']
+
+COMMIT_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
+
+class BuildCache(object):
+    """
+    Cache of built Myria source trees on a node, keyed by commit and options.
+
+    Each entry is a compressed archive of the working tree after a build
+    (jars, libraries and the myriadeploy tree), named by a hash of the
+    resolved commit SHA and the build options.  Entries are evicted in
+    least-recently-used order once more than `capacity` exist; a hit
+    refreshes the entry's modification time.  Point `directory` at a
+    persistent volume to share entries across cluster launches.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY,
+                 capacity=DEFAULT_CACHE_ENTRIES):
+        self.directory = directory
+        self.capacity = int(capacity)
+
+    @staticmethod
+    def key(commit, options):
+        if not commit:
+            return None
+        payload = json.dumps({'commit': commit, 'options': options},
+                             sort_keys=True)
+        return hashlib.sha1(payload).hexdigest()
+
+    def archive_path(self, key):
+        return '{}/{}.tar.gz'.format(self.directory, key)
+
+    def contains(self, node, key):
+        return key is not None and node.ssh.isfile(self.archive_path(key))
+
+    def restore(self, node, key, target):
+        log.info('Restoring cached build %s to %s on %s',
+                 key, target, node.alias)
+        node.ssh.execute(
+            'touch {archive} && rm -rf {target} && mkdir -p {target} && '
+            'tar xzf {archive} -C {target}'.format(
+                archive=self.archive_path(key), target=target))
+
+    def store(self, node, key, source):
+        log.info('Caching build %s from %s on %s', key, source, node.alias)
+        archive = self.archive_path(key)
+        excludes = ' '.join("--exclude='./{}'".format(pattern)
+                            for pattern in ARCHIVE_EXCLUDES)
+        node.ssh.execute(
+            'mkdir -p {directory} && '
+            'tar czf {archive}.partial {excludes} -C {source} . && '
+            'mv {archive}.partial {archive}'.format(
+                directory=self.directory, archive=archive,
+                excludes=excludes, source=source))
+        self.evict(node)
+
+    def evict(self, node):
+        node.ssh.execute(
+            'cd {directory} && ls -1t *.tar.gz 2>/dev/null | '
+            'tail -n +{first} | xargs -r rm -f'.format(
+                directory=self.directory, first=self.capacity + 1))
+
+    @staticmethod
+    def resolve_remote_commit(node, repository, reference=None):
+        """ Resolve a branch, tag or full SHA without cloning """
+        if reference and COMMIT_PATTERN.match(reference):
+            return reference
+
+        lines = node.ssh.execute(
+            'git ls-remote {} {}'.format(repository, reference or 'HEAD'),
+            ignore_exit_status=True)
+        commits = [line.split()[0] for line in lines
+                   if line.strip() and COMMIT_PATTERN.match(line.split()[0])]
+        return commits[0] if commits else None
+
+    @staticmethod
+    def resolve_local_commit(node, directory):
+        lines = node.ssh.execute(
+            'cd {} && git rev-parse HEAD'.format(directory))
+        return lines[0].strip() if lines else None
@@ -0,0 +1,115 @@
+"""
+A bulk-load window for Postgres-backed Myria workers.
+
+Load-optimised settings live in an include file that is empty outside the
+window, so opening and closing the window is a rewrite of that file and a
+configuration reload; no server restart is needed and closing it always
+restores whatever postgresql.conf and the tuning profile specify.
+"""
+import re
+from collections import OrderedDict
+from scheduler import map_nodes
+from starcluster.logger import log
+
+BULKLOAD_FILENAME = 'myria-bulkload.conf'
+CONFIG_DIRECTORY_FORMAT = '/etc/postgresql/{version}/main'
+PATH_FORMAT = '/usr/lib/postgresql/{version}/bin'
+
+BULKLOAD_SETTINGS = OrderedDict([
+    ('synchronous_commit', 'off'),
+    ('checkpoint_segments', 64),
+    ('checkpoint_timeout', '30min'),
+    ('checkpoint_completion_target', 0.9),
+    ('autovacuum', 'off')])
+# Postgres 9.5 replaced checkpoint_segments with max_wal_size
+MAX_WAL_SIZE = '4GB'
+
+_entry = re.compile(r'^\s*(\d+)\s*=\s*([^:\s]+):(\d+)(?::([^:]*))?(?::(\S+))?')
+
+
+def bulkload_settings(version):
+    settings = OrderedDict(BULKLOAD_SETTINGS)
+    if tuple(int(part) for part in str(version).split('.')[:2]) >= (9, 5):
+        del settings['checkpoint_segments']
+        settings['max_wal_size'] = MAX_WAL_SIZE
+    return settings
+
+
+def databases_by_host(entries, default_database):
+    """
+    Host -> [database] from deployment [workers] entries of the form
+    id = host:port[:path[:database]].
+    """
+    databases = OrderedDict()
+    for line in entries:
+        match = _entry.match(line)
+        if match:
+            databases.setdefault(match.group(2), []).append(
+                match.group(5) or default_database)
+    return databases
+
+
+def table_name(qualified_name):
+    """ The Postgres table Myria stores a relation in """
+    return '"{userName}:{programName}:{relationName}"'.format(
+        **qualified_name)
+
+
+class BulkLoad(object):
+    def __init__(self, version, port, settings=None):
+        self.version = version
+        self.port = port
+        self.settings = settings or bulkload_settings(version)
+        self.config_directory = CONFIG_DIRECTORY_FORMAT.format(
+            version=version)
+        self.path = PATH_FORMAT.format(version=version)
+
+    def _psql(self, command, database='postgres'):
+        return "sudo -u postgres {}/psql -p {} -d {} -c '{}'".format(
+            self.path, self.port, database, command)
+
+    def window_command(self, settings):
+        """ Write the include file (empty to close the window) and reload """
+        include = "include '{}'".format(BULKLOAD_FILENAME)
+        config = '{}/postgresql.conf'.format(self.config_directory)
+        body = ''.join('{} = {}\n'.format(key, value)
+                       for key, value in settings.items())
+        return (
+            "cat > {directory}/{filename} <<'__MYRIA_BULKLOAD__'\n"
+            "{body}__MYRIA_BULKLOAD__\n"
+            'grep -qxF "{include}" {config} || echo "{include}" >> {config}\n'
+            '{reload}').format(
+                directory=self.config_directory, filename=BULKLOAD_FILENAME,
+                body=body, include=include, config=config,
+                reload=self._psql('SELECT pg_reload_conf()'))
+
+    def _apply(self, nodes, settings):
+        map_nodes(lambda node: node.ssh.execute(
+            self.window_command(settings)), nodes)
+
+    def begin(self, nodes):
+        log.info('Opening bulk-load window on {} nodes ({})'.format(
+            len(nodes), ', '.join('{}={}'.format(key, value)
+                                  for key, value in self.settings.items())))
+        self._apply(nodes, self.settings)
+
+    def end(self, nodes):
+        log.info('Closing bulk-load window on {} nodes'.format(len(nodes)))
+        self._apply(nodes, {})
+
+    def vacuum_analyze(self, nodes, databases, table):
+        """ VACUUM ANALYZE `table` in every database on every node at once """
+        def run(node):
+            commands = [self._psql('VACUUM ANALYZE {}'.format(
+                table.replace("'", "'\\''")), database)
+                for database in databases.get(node.dns_name, [])]
+            if commands:
+                # A bare `wait` succeeds whatever its children exit with
+                node.ssh.execute(
+                    'pids=""; {}; status=0; for pid in $pids; do '
+                    'wait $pid || status=1; done; exit $status'.format(
+                        '; '.join('{} & pids="$pids $!"'.format(command)
+                                  for command in commands)))
+
+        log.info('Running VACUUM ANALYZE on {}'.format(table))
+        map_nodes(run, nodes)
@@ -0,0 +1,280 @@
+"""
+Simulated StarCluster nodes for benchmarking the provisioning plugins.
+
+FakeNode, FakeSSH and FakePool stand in for the objects StarCluster hands to
+a plugin's run() method.  Every remote call sleeps for an injected latency
+plus jitter, may fail at an injected rate, and is counted, so orchestration
+changes can be measured without EC2.
+"""
+import re
+import json
+import time
+import random
+import threading
+from remotebatch import STEP_MARKER
+from readiness import READY_TOKEN
+
+DEFAULT_MEMORY_MB = 15360
+DEFAULT_CORES = 4
+DEFAULT_DISKS = 2
+
+_step_begin = re.compile(r'^echo "{} begin (\d+)"$'.format(STEP_MARKER),
+                         re.MULTILINE)
+
+
+class SimulatedCommandFailed(Exception):
+    pass
+
+
+class Counters(object):
+    """ Thread-safe round trip counters shared by every simulated node """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.active = 0
+        self.peak = 0
+        self.failures = 0
+
+    def fail(self):
+        with self.lock:
+            self.failures += 1
+
+    def enter(self):
+        with self.lock:
+            self.round_trips += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def exit(self):
+        with self.lock:
+            self.active -= 1
+
+
+class FakeRemoteFile(object):
+    def __init__(self, ssh, path, mode):
+        self.ssh = ssh
+        self.path = path
+        self.mode = mode
+        self.buffer = [] if 'a' in mode or 'w' in mode else \
+            ssh.files.get(path, '').splitlines(True)
+
+    def write(self, data):
+        self.buffer.append(data)
+
+    def read(self):
+        return ''.join(self.buffer)
+
+    def __iter__(self):
+        return iter(self.buffer)
+
+    def __enter__(self):
+        self.ssh._round_trip()
+        return self
+
+    def __exit__(self, *args):
+        if 'a' in self.mode:
+            self.ssh.files[self.path] = \
+                self.ssh.files.get(self.path, '') + ''.join(self.buffer)
+        elif 'w' in self.mode:
+            self.ssh.files[self.path] = ''.join(self.buffer)
+
+
+class FakeSSH(object):
+    """
+    Each round trip sleeps `latency` plus up to `jitter` seconds, and
+    `step_time` per batched step.  A command fails with probability
+    `failure_rate`: a batch reports a non-zero status for one of its steps,
+    and a command whose exit status is not ignored raises.  Each scp sent
+    from a node holds that node's uplink for `transfer_time`, so concurrent
+    copies from one node are serialised.
+    """
+
+    def __init__(self, counters, latency=0.0, step_time=0.0, jitter=0.0,
+                 failure_rate=0.0, seed=None, transfer_time=0.0):
+        self.counters = counters
+        self.latency = latency
+        self.step_time = step_time
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.transfer_time = transfer_time
+        self.uplink = threading.Lock()
+        self.random = random.Random(seed)
+        self.commands = []
+        self.files = {}
+        self.responses = []
+
+    def respond(self, pattern, lines):
+        """ Reply with `lines` to commands matching the regex `pattern` """
+        self.responses.append((re.compile(pattern), lines))
+
+    def _round_trip(self, steps=1):
+        self.counters.enter()
+        try:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter) +
+                       self.step_time * steps)
+        finally:
+            self.counters.exit()
+
+    def execute(self, command, silent=True, ignore_exit_status=False,
+                **kwargs):
+        steps = [int(index) for index in _step_begin.findall(command)]
+        self._round_trip(max(len(steps), 1))
+        self.commands.append(command)
+        if self.transfer_time and 'scp ' in command:
+            with self.uplink:
+                time.sleep(self.transfer_time)
+
+        failed = None
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.counters.fail()
+            if steps:
+                failed = self.random.choice(steps)
+            elif not ignore_exit_status:
+                raise SimulatedCommandFailed(command)
+
+        output = []
+        for pattern, lines in self.responses:
+            if pattern.search(command):
+                output.extend(lines)
+        if READY_TOKEN in command:
+            output.append(READY_TOKEN)
+        for index in steps:
+            output.append('{} begin {}'.format(STEP_MARKER, index))
+            output.append('{} end {} {}'.format(STEP_MARKER, index,
+                                                1 if index == failed else 0))
+            if index == failed:
+                break
+        return output
+
+    def isfile(self, path):
+        self._round_trip()
+        return path in self.files
+
+    def get_remote_file_lines(self, path, regex=None):
+        self._round_trip()
+        lines = self.files.get(path, '').splitlines()
+        return [line for line in lines
+                if regex is None or re.search(regex, line)]
+
+    def remote_file(self, path, mode='r'):
+        return FakeRemoteFile(self, path, mode)
+
+
+class FakeImage(object):
+    def __init__(self, image_id, tags=None):
+        self.id = image_id
+        self.tags = tags or {}
+
+
+class FakeEC2(object):
+    """ The image calls made by imagebake; no image is ever prebaked """
+
+    def __init__(self):
+        self.images = {}
+        self.conn = self
+
+    def get_image(self, image_id):
+        return self.images.setdefault(image_id, FakeImage(image_id))
+
+    def get_images(self, filters=None):
+        return []
+
+    def create_image(self, instance_id, name, **kwargs):
+        return self.get_image('ami-{}'.format(name)).id
+
+    def create_tags(self, ids, tags):
+        for image_id in ids:
+            self.get_image(image_id).tags.update(tags)
+
+
+class FakeInstance(object):
+    def __init__(self):
+        self.tags = {}
+
+    def add_tag(self, key, value):
+        self.tags[key] = value
+
+
+class FakeGroup(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeNode(object):
+    def __init__(self, alias, counters, master=False, ec2=None,
+                 cluster='simulated', **ssh_options):
+        self.alias = alias
+        self.id = 'i-{}'.format(alias)
+        self.dns_name = '{}.simulated.internal'.format(alias)
+        self.private_ip_address = alias
+        self.master = master
+        self.ssh = FakeSSH(counters, **ssh_options)
+        self.ec2 = ec2 or FakeEC2()
+        self.image_id = 'ami-simulated'
+        self.instance = FakeInstance()
+        self.parent_cluster = FakeGroup('@sc-{}'.format(cluster))
+
+    def is_master(self):
+        return self.master
+
+    def apt_command(self, command):
+        self.ssh.execute('apt-get -y {}'.format(command))
+
+    def apt_install(self, packages):
+        self.apt_command('install {}'.format(packages))
+
+    def package_install(self, packages):
+        self.apt_install(packages)
+
+
+class FakePool(object):
+    """ One thread per job, mirroring StarCluster's ThreadPool usage """
+
+    def __init__(self):
+        self.threads = []
+        self.errors = []
+
+    def simple_job(self, method, args=None, jobid=None):
+        arguments = args if isinstance(args, tuple) else (args,)
+
+        def target():
+            try:
+                method(*arguments)
+            except Exception as e:
+                self.errors.append((jobid, e))
+
+        thread = threading.Thread(target=target, name=str(jobid))
+        thread.start()
+        self.threads.append(thread)
+
+    def wait(self, numtasks=None):
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+def make_cluster(size, memory_mb=DEFAULT_MEMORY_MB, cores=DEFAULT_CORES,
+                 disks=DEFAULT_DISKS, seed=None, **ssh_options):
+    """
+    A master and `size - 1` workers sharing one EC2 stub and one set of
+    counters.  Nodes report the given hardware to tuning and sizing probes;
+    `seed` makes injected jitter and failures reproducible.
+    """
+    counters = Counters()
+    ec2 = FakeEC2()
+    seeds = random.Random(seed)
+    nodes = [FakeNode('master' if index == 0
+                      else 'node{:03d}'.format(index),
+                      counters, master=index == 0, ec2=ec2,
+                      seed=seeds.random(), **ssh_options)
+             for index in range(size)]
+    for node in nodes:
+        node.ssh.respond(r'/proc/meminfo',
+                         ['memory_kb={}'.format(memory_mb * 1024),
+                          'cores={}'.format(cores),
+                          'disks={}'.format(disks),
+                          'rotational=0'])
+    nodes[0].ssh.respond(r'/workers/alive',
+                         [json.dumps(range(1, size))])
+    return nodes, counters
@@ -0,0 +1,158 @@
+"""
+Fan-out distribution of a checksummed bundle from the master to workers.
+
+The master packs a directory into a reproducible tar.gz named by its
+SHA-256.  Transfers then proceed in rounds: every node holding a verified
+copy forwards it to one node still lacking it, so the number of holders
+doubles each round and distribution time grows with the logarithm of the
+cluster size rather than with the master's uplink.  Nodes whose installed
+copy already carries the same hash are skipped.
+"""
+from functools import partial
+from scheduler import TaskGraph, TaskFailed, map_nodes
+from starcluster.logger import log
+
+DEFAULT_BUNDLE_DIRECTORY = '/mnt/myria_bundles'
+DEFAULT_EXCLUDES = ['.git', '.gradle']
+DEFAULT_ATTEMPTS = 3
+MARKER_FILENAME = '.myria-bundle.sha256'
+SSH_OPTIONS = '-o StrictHostKeyChecking=no -o BatchMode=yes'
+
+
+class DistributionFailed(Exception):
+    def __init__(self, aliases):
+        super(DistributionFailed, self).__init__(
+            'Unable to distribute bundle to {}'.format(', '.join(aliases)))
+        self.aliases = aliases
+
+
+class Bundle(object):
+    def __init__(self, source, checksum,
+                 directory=DEFAULT_BUNDLE_DIRECTORY):
+        self.source = source
+        self.checksum = checksum
+        self.directory = directory
+
+    @property
+    def path(self):
+        return '{}/{}.tar.gz'.format(self.directory, self.checksum)
+
+    @classmethod
+    def create(cls, node, source, directory=DEFAULT_BUNDLE_DIRECTORY,
+               excludes=DEFAULT_EXCLUDES):
+        """
+        Pack `source` on `node` with fixed ordering, ownership and times so
+        that identical trees yield identical checksums.
+        """
+        prunes = ' '.join("-path './{}' -prune -o".format(pattern)
+                          for pattern in excludes)
+        lines = node.ssh.execute(
+            'mkdir -p {directory} && cd {source} && '
+            'find . {prunes} -print | LC_ALL=C sort | '
+            'tar cf - --no-recursion --mtime=@0 --owner=0 --group=0 '
+            '--numeric-owner -T - | gzip -n > {directory}/bundle.partial && '
+            'sum=$(sha256sum {directory}/bundle.partial | cut -d" " -f1) && '
+            'mv {directory}/bundle.partial {directory}/$sum.tar.gz && '
+            'echo $sum'.format(directory=directory, source=source,
+                               prunes=prunes))
+        checksum = lines[-1].strip() if lines else None
+        if not checksum:
+            raise ValueError('Unable to bundle {} on {}'.format(
+                source, node.alias))
+        log.info('Bundled {} on {} as {}'.format(source, node.alias,
+                                                 checksum[:12]))
+        return cls(source, checksum, directory)
+
+    def marker(self, target):
+        return '{}/{}'.format(target, MARKER_FILENAME)
+
+    def installed_command(self, target):
+        return 'cat {} 2>/dev/null; true'.format(self.marker(target))
+
+    def transfer_command(self, host):
+        """ Run on a holder: copy the bundle to `host` """
+        return ('ssh {options} {host} mkdir -p {directory} && '
+                'scp -q {options} {path} {host}:{path}.partial'.format(
+                    options=SSH_OPTIONS, host=host,
+                    directory=self.directory, path=self.path))
+
+    def install_command(self, target):
+        """ Run on the receiver: verify, then unpack into `target` """
+        return ('echo "{checksum}  {path}.partial" | sha256sum -c --quiet && '
+                'mv {path}.partial {path} && mkdir -p {target} && '
+                'tar xzf {path} -C {target} && '
+                'echo {checksum} > {marker}'.format(
+                    checksum=self.checksum, path=self.path, target=target,
+                    marker=self.marker(target)))
+
+
+def installed(nodes, bundle, target):
+    """ Aliases of nodes whose `target` already holds the bundle """
+    markers = map_nodes(
+        lambda node: node.ssh.execute(bundle.installed_command(target),
+                                      ignore_exit_status=True),
+        nodes)
+    return set(alias for alias, lines in markers.items()
+               if bundle.checksum in [line.strip() for line in lines])
+
+
+def rounds(holders, targets):
+    """
+    Transfer pairs for one round: each holder serves at most one target.
+    Returns [(holder, target)] and the targets left for later rounds.
+    """
+    pairs = zip(holders, targets)
+    return pairs, targets[len(pairs):]
+
+
+def transfer(holder, target, bundle, directory):
+    holder.ssh.execute(bundle.transfer_command(target.dns_name))
+    target.ssh.execute(bundle.install_command(directory))
+
+
+def distribute(source, nodes, bundle, target, tree=True,
+               attempts=DEFAULT_ATTEMPTS):
+    """
+    Install `bundle` (held by `source`) into `target` on every node in
+    `nodes`.  With `tree`, every node that has received a copy forwards it
+    in later rounds; otherwise `source` pushes to every node itself.
+    """
+    present = installed(nodes, bundle, target)
+    pending = [node for node in nodes if node.alias not in present]
+    if present:
+        log.info('{} of {} nodes already hold bundle {}'.format(
+            len(present), len(nodes), bundle.checksum[:12]))
+
+    holders = [source] + [node for node in nodes if node.alias in present
+                          and node.alias != source.alias] if tree \
+        else [source]
+    failures = dict((node.alias, 0) for node in pending)
+    round_number = 0
+    while pending:
+        round_number += 1
+        if tree:
+            pairs, pending = rounds(holders, pending)
+        else:
+            pairs, pending = [(source, node) for node in pending], []
+
+        graph = TaskGraph(concurrency=len(pairs))
+        for holder, node in pairs:
+            graph.add(node.alias, partial(transfer, holder, node, bundle,
+                                          target))
+        try:
+            graph.run()
+        except TaskFailed:
+            pass
+
+        for holder, node in pairs:
+            if graph.tasks[node.alias].error is None:
+                if tree:
+                    holders.append(node)
+                continue
+            failures[node.alias] += 1
+            if failures[node.alias] >= attempts:
+                raise DistributionFailed([node.alias])
+            log.warn('Retrying transfer to {}'.format(node.alias))
+            pending.append(node)
+        log.info('Distribution round {}: {} transfers, {} holders'.format(
+            round_number, len(pairs), len(holders)))
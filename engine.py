@@ -0,0 +1,230 @@
+"""
+Bounded, deadline-aware execution of per-node work.
+
+StarCluster's pool starts a thread per job and waits for all of them
+without a timeout, so one hung node stalls a whole deployment.  The Engine
+keeps at most `concurrency` node jobs running, bounds every remote command
+and every node's job by a deadline, and quarantines nodes whose job fails,
+times out or is cancelled while the remaining nodes carry on.
+
+Python 2 has no asyncio and StarCluster's SSH calls block, so jobs run on
+threads; a job past its deadline is abandoned and its node's guarded SSH
+refuses further commands, so an abandoned thread stops at its next command.
+"""
+import time
+import Queue
+import threading
+from collections import OrderedDict
+from starcluster.logger import log
+
+DEFAULT_CONCURRENCY = 50
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CommandTimeout(Exception):
+    def __init__(self, alias, command, timeout):
+        super(CommandTimeout, self).__init__(
+            'Command on {} exceeded {:.0f}s: {}'.format(
+                alias, timeout, command.strip().splitlines()[0][:60]))
+
+
+class NodeTimeout(Exception):
+    def __init__(self, alias, timeout):
+        super(NodeTimeout, self).__init__(
+            '{} did not finish within {:.0f}s'.format(alias, timeout))
+
+
+class Job(object):
+    def __init__(self, node, deadline):
+        self.node = node
+        self.deadline = deadline
+        self.abandoned = False
+        self.result = None
+        self.error = None
+
+
+def _call_with_timeout(function, timeout, *args, **kwargs):
+    """ (finished, result, error) of `function` given at most `timeout` """
+    box = {}
+
+    def target():
+        try:
+            box['result'] = function(*args, **kwargs)
+        except Exception as e:
+            box['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        return False, None, None
+    return True, box.get('result'), box.get('error')
+
+
+class GuardedSSH(object):
+    def __init__(self, engine, job, ssh):
+        self._engine = engine
+        self._job = job
+        self._ssh = ssh
+
+    def __getattr__(self, name):
+        return getattr(self._ssh, name)
+
+    def execute(self, command, *args, **kwargs):
+        if self._job.abandoned or self._engine.cancelled:
+            raise Cancelled(self._job.node.alias)
+
+        timeouts = [self._engine.command_timeout]
+        if self._job.deadline is not None:
+            timeouts.append(max(self._job.deadline - time.time(), 0))
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        if not timeouts:
+            return self._ssh.execute(command, *args, **kwargs)
+
+        timeout = min(timeouts)
+        finished, result, error = _call_with_timeout(
+            self._ssh.execute, timeout, command, *args, **kwargs)
+        if not finished:
+            raise CommandTimeout(self._job.node.alias, command, timeout)
+        if error is not None:
+            raise error
+        return result
+
+
+class GuardedNode(object):
+    """ Delegates to a node, enforcing the engine's deadlines over SSH """
+
+    def __init__(self, engine, job, node):
+        self._node = node
+        self.ssh = GuardedSSH(engine, job, node.ssh)
+
+    def __getattr__(self, name):
+        return getattr(self._node, name)
+
+    def __eq__(self, other):
+        return self._node == getattr(other, '_node', other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._node)
+
+
+class Engine(object):
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, node_timeout=None,
+                 command_timeout=None):
+        self.concurrency = max(int(concurrency), 1)
+        self.node_timeout = float(node_timeout) if node_timeout else None
+        self.command_timeout = float(command_timeout) \
+            if command_timeout else None
+        self.quarantined = OrderedDict()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """ Stop starting jobs; running jobs stop at their next command """
+        self._cancelled.set()
+
+    def quarantine(self, node, error):
+        with self._lock:
+            self.quarantined[node.alias] = error
+        log.error('Quarantining {}: {}'.format(node.alias, error))
+
+    def healthy(self, nodes):
+        return [node for node in nodes if node.alias not in self.quarantined]
+
+    def _job(self, node):
+        deadline = time.time() + self.node_timeout \
+            if self.node_timeout else None
+        return Job(node, deadline)
+
+    def run(self, function, nodes):
+        """
+        Apply `function` to every healthy node with at most `concurrency`
+        running at once.  Returns alias -> result for nodes that finished;
+        the others are quarantined.
+        """
+        pending = list(self.healthy(nodes))
+        running = {}
+        results = OrderedDict()
+        finished = Queue.Queue()
+
+        def work(job):
+            try:
+                job.result = function(GuardedNode(self, job, job.node))
+            except Exception as e:
+                job.error = e
+            finished.put(job)
+
+        while pending or running:
+            while pending and len(running) < self.concurrency and \
+                    not self.cancelled:
+                job = self._job(pending.pop(0))
+                thread = threading.Thread(target=work, args=(job,),
+                                          name=job.node.alias)
+                thread.daemon = True
+                running[job.node.alias] = job
+                thread.start()
+
+            if self.cancelled:
+                for node in pending:
+                    self.quarantine(node, Cancelled(node.alias))
+                pending = []
+
+            deadlines = [job.deadline for job in running.values()
+                         if job.deadline is not None]
+            wait = max(min(deadlines) - time.time(), 0) if deadlines \
+                else None
+            try:
+                job = finished.get(timeout=wait) if wait is not None \
+                    else finished.get()
+            except Queue.Empty:
+                job = None
+
+            if job is not None and not job.abandoned:
+                del running[job.node.alias]
+                if job.error is not None:
+                    self.quarantine(job.node, job.error)
+                else:
+                    results[job.node.alias] = job.result
+
+            now = time.time()
+            for alias, job in running.items():
+                if job.deadline is not None and now >= job.deadline:
+                    job.abandoned = True
+                    del running[alias]
+                    self.quarantine(job.node,
+                                    NodeTimeout(alias, self.node_timeout))
+        return results
+
+    def call(self, function, node):
+        """
+        Run `function(node)` for one node within the node deadline,
+        quarantining the node instead of raising when it fails.
+        """
+        if node.alias in self.quarantined:
+            return None
+        job = self._job(node)
+        finished, result, error = _call_with_timeout(
+            function, self.node_timeout, GuardedNode(self, job, node))
+        if not finished:
+            job.abandoned = True
+            error = NodeTimeout(node.alias, self.node_timeout)
+        if error is not None:
+            self.quarantine(node, error)
+            return None
+        return result
+
+    def report(self):
+        if self.quarantined:
+            log.error('{} nodes quarantined: {}'.format(
+                len(self.quarantined), ', '.join(self.quarantined)))
@@ -1,21 +1,145 @@
 #!/usr/bin/python
+"""
+Print the Myria REST URL of one or more clusters.
+
+    python getresturl.py                      # myriacluster
+    python getresturl.py cluster1 cluster2    # one "cluster url" per line
+
+Masters are found with a server-side tag filter and their URLs cached
+locally for a short time; MyriaInstaller clears a cluster's entry when it
+deploys or restarts that cluster.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import OrderedDict
 
 import starcluster.config as config
+from starcluster import static
+
+DEFAULT_CLUSTER = 'myriacluster'
+DEFAULT_REST_PORT = 8753
+DEFAULT_CACHE_PATH = '~/.starcluster/myria-rest-urls.json'
+DEFAULT_TTL = 300
+MASTER_TAG_FORMAT = '{}-master'
+
+
+class UrlCache(object):
+    """ Tag -> REST URL with an expiry, stored as JSON """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+
+    def _load(self):
+        try:
+            with open(self.path) as descriptor:
+                return json.load(descriptor)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = self.path + '.partial'
+        with open(temporary, 'w') as descriptor:
+            json.dump(entries, descriptor)
+        os.rename(temporary, self.path)
+
+    def get(self, tags):
+        now = time.time()
+        entries = self._load()
+        return dict((tag, entries[tag]['url']) for tag in tags
+                    if tag in entries and
+                    now - entries[tag]['time'] < self.ttl)
+
+    def put(self, urls):
+        entries = self._load()
+        entries.update((tag, {'url': url, 'time': time.time()})
+                       for tag, url in urls.items())
+        self._save(entries)
+
+    def invalidate(self, tags=None):
+        """ Forget the URLs of `tags`, or of every cluster """
+        if tags is None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        entries = self._load()
+        if any(tag in entries for tag in tags):
+            self._save(dict((tag, entry) for tag, entry in entries.items()
+                            if tag not in tags))
+
+
+def master_tag(master):
+    """ Cache key of the cluster `master` belongs to, or None """
+    group = master.parent_cluster
+    if group is None:
+        return None
+    return MASTER_TAG_FORMAT.format(
+        group.name[len(static.SECURITY_GROUP_PREFIX):])
+
+
+def get_instances_by_tag(ec2, tags, key='Name'):
+    """ Running instances whose `key` tag is one of `tags`, by tag value """
+    instances = ec2.get_all_instances(
+        filters={'tag:{}'.format(key): list(tags),
+                 'instance-state-name': 'running'})
+    return dict((instance.tags.get(key), instance)
+                for instance in instances
+                if instance.tags.get(key) in tags)
 
 
 def get_instance_by_tag(ec2, tag, key='Name'):
-    return next(
-        (instance for instance in ec2.get_all_instances()
-            if instance.tags[key] == tag))
+    return get_instances_by_tag(ec2, [tag], key).get(tag)
+
+
+def rest_urls(ec2, clusters, port=DEFAULT_REST_PORT, cache=None):
+    """ OrderedDict of cluster -> REST URL, or None when no master runs """
+    tags = OrderedDict((cluster, MASTER_TAG_FORMAT.format(cluster))
+                       for cluster in clusters)
+    urls = cache.get(tags.values()) if cache else {}
+
+    missing = [tag for tag in tags.values() if tag not in urls]
+    if missing:
+        found = dict((tag, 'http://{}:{}'.format(instance.dns_name, port))
+                     for tag, instance
+                     in get_instances_by_tag(ec2, missing).items())
+        if cache and found:
+            cache.put(found)
+        urls.update(found)
+
+    return OrderedDict((cluster, urls.get(tag))
+                       for cluster, tag in tags.items())
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('clusters', nargs='*', default=[DEFAULT_CLUSTER])
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL,
+                        help='Seconds to reuse a cached URL')
+    parser.add_argument('--no-cache', action='store_true')
+    arguments = parser.parse_args()
+
     configuration_file = None
     configuration = config.get_config(configuration_file)
 
     plugin = configuration.plugins['myriaplugin']
-    port = plugin.get('REST_PORT', 8753)
+    port = plugin.get('REST_PORT', DEFAULT_REST_PORT)
 
-    instance = get_instance_by_tag(
-        config.get_easy_ec2(configuration_file), 'myriacluster-master')
+    urls = rest_urls(config.get_easy_ec2(configuration_file),
+                     arguments.clusters, port,
+                     None if arguments.no_cache
+                     else UrlCache(ttl=arguments.ttl))
 
-    print 'http://{}:{}'.format(instance.dns_name, port)
+    for cluster, url in urls.items():
+        if url is None:
+            print >> sys.stderr, 'No running master for {}'.format(cluster)
+        elif len(urls) == 1:
+            print url
+        else:
+            print '{} {}'.format(cluster, url)
+    sys.exit(0 if all(urls.values()) else 1)
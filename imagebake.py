@@ -0,0 +1,72 @@
+import json
+import hashlib
+from starcluster.logger import log
+
+TAG_PREFIX = 'myria-ec2:'
+
+_image_tags = {}
+
+
+def fingerprint(recipe):
+    """ Stable hash of an install recipe (packages, versions, commits) """
+    return hashlib.sha1(json.dumps(recipe, sort_keys=True)).hexdigest()
+
+
+def tag_name(component):
+    return TAG_PREFIX + component
+
+
+def image_tags(node):
+    if node.image_id not in _image_tags:
+        image = node.ec2.get_image(node.image_id)
+        _image_tags[node.image_id] = \
+            dict(image.tags) if image is not None else {}
+    return _image_tags[node.image_id]
+
+
+def is_prebaked(node, component, recipe_fingerprint):
+    """
+    True when the node was launched from an image baked for exactly this
+    recipe, in which case provisioning can skip straight to configuration.
+    """
+    if not recipe_fingerprint:
+        return False
+    baked = image_tags(node).get(tag_name(component))
+    if baked == recipe_fingerprint:
+        log.info('{} runs image {} baked for {} recipe {}'.format(
+            node.alias, node.image_id, component, recipe_fingerprint))
+        return True
+    return False
+
+
+def record(node, component, recipe_fingerprint):
+    """ Tag the instance so that an image baked from it inherits the tag """
+    if recipe_fingerprint:
+        node.instance.add_tag(tag_name(component), recipe_fingerprint)
+
+
+def bake(node, name):
+    """
+    Snapshot a provisioned node into an image carrying the node's recipe
+    fingerprint tags, and return the new image id.
+    """
+    tags = dict((key, value)
+                for key, value in node.instance.tags.items()
+                if key.startswith(TAG_PREFIX))
+    image_name = '{}-{}'.format(
+        name, hashlib.sha1(json.dumps(tags, sort_keys=True)).hexdigest()[:12])
+
+    existing = node.ec2.get_images(filters={'name': image_name})
+    if existing:
+        log.info('Image {} ({}) already exists'.format(
+            image_name, existing[0].id))
+        return existing[0].id
+
+    node.ssh.execute('sync')
+    image_id = node.ec2.create_image(node.id, image_name,
+                                     description='Myria-EC2 provisioned node',
+                                     no_reboot=True)
+    node.ec2.conn.create_tags([image_id], tags)
+    log.info('Baking image {} ({}) from {}; set NODE_IMAGE_ID = {} to '
+             'reuse it'.format(image_name, image_id, node.alias, image_id))
+    return image_id
@@ -0,0 +1,217 @@
+"""
+Throughput instrumentation for Myria ingests.
+
+An IngestMonitor polls the status of every import query while an ingest
+runs, then combines the timeline with the planned per-worker byte totals
+and the loaded row count into a report handed to one or more sinks.
+"""
+import os
+import json
+import time
+import threading
+import importlib
+from starcluster.logger import log
+
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_HISTORY_WINDOW = 10
+DEFAULT_REGRESSION_RATIO = 0.7
+
+
+class MetricsSink(object):
+    """ Receives the report of each completed ingest """
+
+    def emit(self, report):
+        raise NotImplementedError
+
+
+class LogSink(MetricsSink):
+    def emit(self, report):
+        log.info('Ingest %s: %s bytes, %s rows in %.1fs '
+                 '(%.1f MB/s, %s rows/s, planned worker skew %.2f)',
+                 report['relation'], report['bytes'], report['rows'],
+                 report['elapsed'], (report['bytes_per_second'] or 0) / 1e6,
+                 report['rows_per_second'], report['planned_skew'])
+        for name, phase in sorted(report.get('phases', {}).items()):
+            log.info('Ingest %s %s: %s bytes in %.1fs (%.1f MB/s)',
+                     report['relation'], name, phase['bytes'],
+                     phase['elapsed'],
+                     (phase['bytes_per_second'] or 0) / 1e6)
+
+
+class JsonFileSink(MetricsSink):
+    """ Writes the latest report as a JSON document """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+    def emit(self, report):
+        with open(self.path, 'w') as descriptor:
+            json.dump(report, descriptor, indent=2, sort_keys=True)
+        log.info('Ingest metrics written to %s', self.path)
+
+
+class HistorySink(MetricsSink):
+    """
+    Appends each report to a JSON lines file and warns when throughput
+    falls below `ratio` of the median of recent ingests of the same
+    relation.
+    """
+
+    def __init__(self, path, window=DEFAULT_HISTORY_WINDOW,
+                 ratio=DEFAULT_REGRESSION_RATIO):
+        self.path = os.path.expanduser(path)
+        self.window = window
+        self.ratio = ratio
+
+    def history(self, relation):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as descriptor:
+            reports = [json.loads(line) for line in descriptor if line.strip()]
+        return [report for report in reports
+                if report.get('relation') == relation and
+                report.get('bytes_per_second')][-self.window:]
+
+    def emit(self, report):
+        previous = sorted(r['bytes_per_second']
+                          for r in self.history(report['relation']))
+        if previous and report['bytes_per_second']:
+            median = previous[len(previous) // 2]
+            if report['bytes_per_second'] < median * self.ratio:
+                log.warn('Ingest throughput regression for %s: %.1f MB/s '
+                         'against a median of %.1f MB/s over %d runs',
+                         report['relation'],
+                         report['bytes_per_second'] / 1e6, median / 1e6,
+                         len(previous))
+
+        with open(self.path, 'a') as descriptor:
+            descriptor.write(json.dumps(report, sort_keys=True) + '\n')
+
+
+def worker_bytes(work, sizes):
+    """
+    Planned input bytes per worker for (worker, source) pairs, where a
+    source is a URI or a ranged S3 source and `sizes` maps URI -> bytes.
+    """
+    totals = {}
+    for worker, source in work:
+        if isinstance(source, dict):
+            size = source['endRange'] - source['startRange'] + 1
+        else:
+            size = sizes.get(source) or 0
+        totals[worker] = totals.get(worker, 0) + size
+    return totals
+
+
+def load_sink(name, *args):
+    """ Instantiate a sink from a dotted path such as mymodule.MySink """
+    module, _, cls = name.rpartition('.')
+    return getattr(importlib.import_module(module), cls)(*args)
+
+
+class IngestMonitor(object):
+    """
+    Polls the status of tracked import queries in a background thread.
+    `relation` names the ingest in reports; `relation_key` is the
+    qualified name used to read back the loaded row count.
+    """
+
+    def __init__(self, connection, relation, relation_key=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.connection = connection
+        self.relation = relation
+        self.relation_key = relation_key
+        self.poll_interval = poll_interval
+        self.queries = []
+        self.timeline = []
+        self.phases = {}
+        self.started = None
+        self.finished = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, query_id):
+        self.queries.append(query_id)
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._poll,
+                                        name='ingest-monitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.finished = time.time()
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._sample()
+
+    def phase(self, name, seconds, size=None):
+        """ Record time spent outside the import queries, e.g. staging """
+        self.phases[name] = {
+            'elapsed': seconds, 'bytes': size,
+            'bytes_per_second': float(size) / seconds
+            if size is not None and seconds else None}
+
+    def _sample(self):
+        for query_id in list(self.queries):
+            try:
+                status = self.connection.get_query_status(query_id)
+            except Exception as e:
+                log.debug('Unable to poll query %s: %s', query_id, e)
+                continue
+            entry = {'time': time.time() - self.started,
+                     'query_id': query_id,
+                     'status': status.get('status')}
+            if status.get('elapsedNanos') is not None:
+                entry['elapsed'] = status['elapsedNanos'] / 1e9
+            if not self.timeline or \
+                    self.timeline[-1].get('status') != entry['status'] or \
+                    self.timeline[-1].get('query_id') != query_id:
+                log.info('Query %s %s at %.0fs', query_id, entry['status'],
+                         entry['time'])
+            self.timeline.append(entry)
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            self._sample()
+
+    def rows(self):
+        try:
+            dataset = self.connection.dataset(self.relation_key or
+                                              self.relation)
+            return dataset.get('numTuples')
+        except Exception as e:
+            log.debug('Unable to read size of %s: %s', self.relation, e)
+            return None
+
+    def report(self, planned_bytes):
+        """
+        Throughput report given worker id -> planned input bytes. Only
+        the whole ingest is timed, so the per-worker figures and the skew
+        describe the plan rather than measured worker throughput.
+        """
+        elapsed = (self.finished or time.time()) - self.started
+        total = sum(planned_bytes.values()) if planned_bytes else None
+        rows = self.rows()
+        mean = float(total) / len(planned_bytes) if planned_bytes else 0
+
+        return {
+            'relation': self.relation,
+            'started': self.started,
+            'elapsed': elapsed,
+            'queries': self.queries,
+            'bytes': total,
+            'rows': rows,
+            'bytes_per_second': total / elapsed if total and elapsed else None,
+            'rows_per_second': rows / elapsed if rows and elapsed else None,
+            'planned_skew': max(planned_bytes.values()) / mean
+            if mean else 1.0,
+            'workers': dict(
+                (str(worker), {'planned_bytes': size,
+                               'planned_bytes_per_second':
+                                   size / elapsed if elapsed else None})
+                for worker, size in planned_bytes.items()),
+            'phases': self.phases,
+            'timeline': self.timeline}
@@ -0,0 +1,235 @@
+"""
+Batched, resumable ingest with a bounded number of import queries in flight.
+
+The planned (worker, source) work is cut into batches recorded in a local
+JSON manifest.  Each batch imports into a staging relation of its own,
+overwriting it, so that a batch whose outcome is unknown (one that failed
+or timed out after Myria committed some of it) can be retried without
+duplicating rows.  Each finished batch is checkpointed immediately, failed
+batches are retried with exponential backoff, and a rerun against the same
+manifest only submits the batches that have not yet succeeded.  Once every
+batch has succeeded, one query replaces the relation with the union of the
+staging relations.
+"""
+import os
+import json
+import time
+from starcluster.logger import log
+
+DEFAULT_MAX_IN_FLIGHT = 2
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 5
+DEFAULT_POLL_INTERVAL = 2
+MANIFEST_FORMAT = '~/.starcluster/myria-ingest-{}.json'
+STAGING_RELATION_FORMAT = '{}__batch{}'
+
+SUCCEEDED = 'SUCCESS'
+FAILED_STATUSES = ['ERROR', 'KILLED']
+PENDING, DONE, FAILED = 'pending', 'done', 'failed'
+
+
+class IngestFailed(Exception):
+    def __init__(self, batches):
+        super(IngestFailed, self).__init__(
+            'Ingest batches failed: {}'.format(
+                ', '.join(str(batch['id']) for batch in batches)))
+        self.batches = batches
+
+
+class MergeFailed(Exception):
+    def __init__(self, status):
+        super(MergeFailed, self).__init__(
+            'Merging the ingest batches ended {}'.format(status))
+        self.status = status
+
+
+def staging_name(relation, batch_id):
+    """ Qualified name of the relation batch `batch_id` imports into """
+    return STAGING_RELATION_FORMAT.format(relation, batch_id)
+
+
+def union_program(relation, batch_ids):
+    """ MyriaL storing the union of the batches' relations as `relation` """
+    return 'merged = unionall({});\nstore(merged, {});'.format(
+        ', '.join('scan({})'.format(staging_name(relation, batch_id))
+                  for batch_id in batch_ids), relation)
+
+
+class Manifest(object):
+    def __init__(self, path, relation, uris):
+        self.path = os.path.expanduser(path)
+        self.relation = relation
+        self.uris = sorted(uris)
+        self.batches = []
+        self.merged = False
+
+    def load(self):
+        """ Previously planned batches for the same relation and sources """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as descriptor:
+            state = json.load(descriptor)
+        if state.get('relation') != self.relation or \
+                sorted(state.get('uris', [])) != self.uris:
+            log.warn('Ignoring manifest %s for a different ingest', self.path)
+            return False
+        self.batches = state['batches']
+        self.merged = state.get('merged', False)
+        for batch in self.batches:
+            if batch['status'] != DONE:
+                batch['status'], batch['attempts'] = PENDING, 0
+        return True
+
+    def save(self):
+        temporary = self.path + '.partial'
+        with open(temporary, 'w') as descriptor:
+            json.dump({'relation': self.relation,
+                       'uris': self.uris,
+                       'batches': self.batches,
+                       'merged': self.merged}, descriptor, indent=2)
+        os.rename(temporary, self.path)
+
+    def plan(self, work, batch_size):
+        """ Cut `work` into batches spreading each batch across workers """
+        by_worker = {}
+        for worker, source in work:
+            by_worker.setdefault(worker, []).append(source)
+
+        interleaved = []
+        while any(by_worker.values()):
+            for worker in sorted(by_worker):
+                if by_worker[worker]:
+                    interleaved.append([worker, by_worker[worker].pop(0)])
+
+        self.batches = [{'id': index,
+                         'work': interleaved[start:start + batch_size],
+                         'status': PENDING,
+                         'attempts': 0,
+                         'query_id': None}
+                        for index, start in enumerate(
+                            range(0, len(interleaved), batch_size))]
+
+    def pending(self):
+        return [batch for batch in self.batches if batch['status'] != DONE]
+
+
+class IngestPipeline(object):
+    """
+    Runs the manifest's pending batches through `submit(batch_id, work)`,
+    which must start an import overwriting the batch's staging relation
+    and return an object exposing `query_id` and a refreshing `status`.
+    `merge(batch_ids)` then starts the query that stores their union.
+    """
+
+    def __init__(self, manifest, submit, merge,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.manifest = manifest
+        self.submit = submit
+        self.merge = merge
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.poll_interval = float(poll_interval)
+
+    def _start(self, batch):
+        batch['attempts'] += 1
+        query = self.submit(batch['id'],
+                            [tuple(pair) for pair in batch['work']])
+        batch['query_id'] = query.query_id
+        log.info('Batch %d (%d sources, attempt %d) running as query %d',
+                 batch['id'], len(batch['work']), batch['attempts'],
+                 query.query_id)
+        return query
+
+    def _finish(self, batch, status, queue, failed):
+        if status == SUCCEEDED:
+            batch['status'] = DONE
+            log.info('Batch %d complete', batch['id'])
+        elif batch['attempts'] <= self.retries:
+            delay = self.backoff * 2 ** (batch['attempts'] - 1)
+            log.warn('Batch %d ended %s; retrying in %.0fs',
+                     batch['id'], status, delay)
+            batch['not_before'] = time.time() + delay
+            queue.append(batch)
+        else:
+            batch['status'] = FAILED
+            failed.append(batch)
+            log.error('Batch %d failed after %d attempts',
+                      batch['id'], batch['attempts'])
+        self.manifest.save()
+
+    def _wait(self, query):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                status = query.status
+            except Exception as e:
+                log.warn('Unable to poll query %d: %s', query.query_id, e)
+                continue
+            if status == SUCCEEDED or status in FAILED_STATUSES:
+                return status
+
+    def _union(self):
+        """ Store the union of every batch; rerunning it is harmless """
+        batch_ids = [batch['id'] for batch in self.manifest.batches]
+        for attempt in range(1, self.retries + 2):
+            try:
+                query = self.merge(batch_ids)
+                log.info('Merging %d batches as query %d', len(batch_ids),
+                         query.query_id)
+                status = self._wait(query)
+            except Exception as e:
+                log.warn('Unable to merge batches: %s', e)
+                status = 'ERROR'
+            if status == SUCCEEDED:
+                self.manifest.merged = True
+                self.manifest.save()
+                return
+            if attempt <= self.retries:
+                delay = self.backoff * 2 ** (attempt - 1)
+                log.warn('Merge ended %s; retrying in %.0fs', status, delay)
+                time.sleep(delay)
+        raise MergeFailed(status)
+
+    def run(self):
+        queue = self.manifest.pending()
+        if not queue and self.manifest.merged:
+            log.info('All %d batches already complete',
+                     len(self.manifest.batches))
+            return
+        log.info('Ingesting %d of %d batches, %d in flight',
+                 len(queue), len(self.manifest.batches), self.max_in_flight)
+
+        running, failed = {}, []
+        while queue or running:
+            now = time.time()
+            for batch in list(queue):
+                if len(running) >= self.max_in_flight:
+                    break
+                if batch.get('not_before', 0) > now:
+                    continue
+                queue.remove(batch)
+                try:
+                    running[batch['id']] = (batch, self._start(batch))
+                except Exception as e:
+                    log.warn('Unable to submit batch %d: %s', batch['id'], e)
+                    self._finish(batch, 'ERROR', queue, failed)
+
+            time.sleep(self.poll_interval)
+            for identifier, (batch, query) in running.items():
+                try:
+                    status = query.status
+                except Exception as e:
+                    log.warn('Unable to poll query %d: %s',
+                             query.query_id, e)
+                    continue
+                if status == SUCCEEDED or status in FAILED_STATUSES:
+                    del running[identifier]
+                    self._finish(batch, status, queue, failed)
+
+        if failed:
+            raise IngestFailed(failed)
+        self._union()
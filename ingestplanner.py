@@ -0,0 +1,175 @@
+"""
+Size-balanced assignment of ingest sources to Myria workers.
+
+Source sizes are looked up in parallel (stat for local paths, HEAD for
+HTTP, key metadata for S3), then pieces are assigned with the longest
+processing time first rule: largest piece to the least-loaded worker.
+Byte ranges of a split source begin at the start of a line, so that no
+record is cut between two workers.
+"""
+import os
+import heapq
+import urllib2
+import urlparse
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+from starcluster.logger import log
+
+DEFAULT_LOOKUP_CONCURRENCY = 16
+DEFAULT_LOOKUP_TIMEOUT = 30
+# Bytes read at a time while looking for the line following a cut
+LINE_SEARCH_BYTES = 64 * 1024
+# Scan types whose records may be split at arbitrary byte offsets
+SPLITTABLE_SCAN_TYPES = ['CSV']
+
+Piece = namedtuple('Piece', ['uri', 'size', 'start', 'end'])
+
+
+class HeadRequest(urllib2.Request):
+    def get_method(self):
+        return 'HEAD'
+
+
+def uri_size(uri, timeout=DEFAULT_LOOKUP_TIMEOUT):
+    """ Size in bytes of the object at `uri`, or None when unknown """
+    parsed = urlparse.urlparse(uri)
+    try:
+        if parsed.scheme in ('', 'file'):
+            return os.stat(parsed.path).st_size
+        elif parsed.scheme in ('http', 'https'):
+            response = urllib2.urlopen(HeadRequest(uri), timeout=timeout)
+            length = response.info().getheader('Content-Length')
+            return int(length) if length is not None else None
+        elif parsed.scheme in ('s3', 's3n', 's3a'):
+            import boto
+            key = boto.connect_s3().get_bucket(
+                parsed.netloc, validate=False).get_key(
+                    parsed.path.lstrip('/'))
+            return key.size if key is not None else None
+    except Exception as e:
+        # Includes boto's S3 errors and NoAuthHandlerFound, which does not
+        # derive from BotoClientError; an unknown size only degrades the plan
+        log.warn('Unable to determine size of {}: {}'.format(uri, e))
+    return None
+
+
+def uri_sizes(uris, concurrency=DEFAULT_LOOKUP_CONCURRENCY):
+    pool = ThreadPool(min(concurrency, len(uris)) or 1)
+    try:
+        return OrderedDict(zip(uris, pool.map(uri_size, uris)))
+    finally:
+        pool.close()
+
+
+def read_range(uri, start, end):
+    """ Bytes [start, end) of the S3 object at `uri` """
+    import boto
+    parsed = urlparse.urlparse(uri)
+    key = boto.connect_s3().get_bucket(
+        parsed.netloc, validate=False).get_key(parsed.path.lstrip('/'))
+    return key.get_contents_as_string(
+        headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+
+
+def line_start(uri, offset, size, read=read_range):
+    """
+    The first offset at or after `offset` that begins a line of `uri`, or
+    None when no line begins before `size`
+    """
+    position = offset - 1
+    while position < size:
+        end = min(position + LINE_SEARCH_BYTES, size)
+        newline = read(uri, position, end).find('\n')
+        if newline >= 0:
+            start = position + newline + 1
+            return start if start < size else None
+        position = end
+    return None
+
+
+def is_splittable(uri, scan_type, scan_parameters):
+    """ Only headerless delimited S3 objects support ranged scans """
+    if scan_type not in SPLITTABLE_SCAN_TYPES:
+        return False
+    if (scan_parameters or {}).get('skip'):
+        return False
+    return urlparse.urlparse(uri).scheme in ('s3', 's3n', 's3a')
+
+
+def split(sizes, worker_count, threshold=None, splittable=lambda uri: False,
+          align=line_start):
+    """
+    Pieces for every source.  A splittable source larger than both
+    `threshold` and a fair per-worker share is cut into byte ranges of
+    roughly one share each; `align(uri, offset, size)` moves every cut but
+    the first to the start of the next line.  Unknown sizes count as the
+    mean known size.
+    """
+    known = [size for size in sizes.values() if size is not None]
+    default = (sum(known) // len(known)) if known else 1
+    total = sum(size if size is not None else default
+                for size in sizes.values())
+    share = max(total // max(worker_count, 1), 1)
+
+    pieces = []
+    for uri, size in sizes.items():
+        if (size is not None and threshold and size > threshold and
+                size > share and splittable(uri)):
+            count = (size + share - 1) // share
+            step = (size + count - 1) // count
+            cuts = [0]
+            for offset in range(step, size, step):
+                cut = align(uri, max(offset, cuts[-1] + 1), size)
+                if cut is None:
+                    break
+                cuts.append(cut)
+            pieces.extend(Piece(uri, end - start, start, end)
+                          for start, end in zip(cuts, cuts[1:] + [size]))
+        else:
+            pieces.append(Piece(uri, size if size is not None else default,
+                                None, None))
+    return pieces
+
+
+def assign(pieces, workers):
+    """
+    Longest-processing-time-first assignment minimising the largest
+    per-worker byte total.  Returns OrderedDict worker -> [Piece].
+    """
+    plan = OrderedDict((worker, []) for worker in workers)
+    loads = [(0, index, worker) for index, worker in enumerate(workers)]
+    heapq.heapify(loads)
+    for piece in sorted(pieces, key=lambda piece: -piece.size):
+        load, index, worker = heapq.heappop(loads)
+        plan[worker].append(piece)
+        heapq.heappush(loads, (load + piece.size, index, worker))
+    return plan
+
+
+def source(piece):
+    """ The data source handed to parallel_import for a piece """
+    if piece.start is None:
+        return piece.uri
+    return {'dataType': 'S3',
+            's3Uri': piece.uri,
+            'startRange': piece.start,
+            'endRange': piece.end - 1}
+
+
+def work(plan):
+    """ (worker, source) pairs as accepted by MyriaQuery.parallel_import """
+    return [(worker, source(piece))
+            for worker, pieces in plan.items() for piece in pieces]
+
+
+def log_plan(plan):
+    totals = dict((worker, sum(piece.size for piece in pieces))
+                  for worker, pieces in plan.items())
+    for worker, pieces in plan.items():
+        log.info('Worker #%d planned %d bytes across %d pieces',
+                 worker, totals[worker], len(pieces))
+    if totals:
+        mean = float(sum(totals.values())) / len(totals)
+        log.info('Planned makespan %d bytes (mean %d, skew %.2f)',
+                 max(totals.values()), mean,
+                 max(totals.values()) / mean if mean else 1.0)
@@ -0,0 +1,156 @@
+"""
+Concurrent ingest of many relations from one manifest.
+
+Relations start largest first, as long as every worker a relation's plan
+uses is running fewer than `max_per_worker` imports; smaller relations
+fill in around a large one whose workers are busy.  Running imports are
+polled with a per-query interval that doubles up to `maximum_interval`,
+so long loads cost few status requests while short ones finish promptly.
+A relation fails once its import outlives `timeout` or its status cannot
+be read `max_poll_failures` times in a row.
+"""
+import os
+import json
+import time
+from ingestpipeline import SUCCEEDED, FAILED_STATUSES
+from starcluster.logger import log
+
+DEFAULT_MAX_PER_WORKER = 2
+DEFAULT_INITIAL_INTERVAL = 1
+DEFAULT_MAXIMUM_INTERVAL = 30
+DEFAULT_MAX_POLL_FAILURES = 5
+TIMED_OUT = 'TIMEOUT'
+
+
+class RelationsFailed(Exception):
+    def __init__(self, names):
+        super(RelationsFailed, self).__init__(
+            'Ingest failed for {}'.format(', '.join(names)))
+        self.names = names
+
+
+def load_relations(path):
+    """
+    Manifest entries: a JSON list of objects with name, schema and uris and
+    optionally workers and the scan and insert options of MyriaIngest
+    """
+    with open(os.path.expanduser(path)) as descriptor:
+        relations = json.load(descriptor)
+    for entry in relations:
+        missing = [key for key in ('name', 'schema', 'uris')
+                   if key not in entry]
+        if missing:
+            raise ValueError('Manifest entry {} lacks {}'.format(
+                entry.get('name', '?'), ', '.join(missing)))
+    return relations
+
+
+class IngestQueue(object):
+    """
+    Runs entries (dicts with name, size and work) through `submit(entry)`,
+    which must start an import and return an object exposing `query_id`
+    and a refreshing `status`.  `finish(entry, status)` is called as each
+    import ends.  `timeout` bounds the seconds each import may run; None
+    waits indefinitely.
+    """
+
+    def __init__(self, entries, submit, finish=None,
+                 max_per_worker=DEFAULT_MAX_PER_WORKER,
+                 initial_interval=DEFAULT_INITIAL_INTERVAL,
+                 maximum_interval=DEFAULT_MAXIMUM_INTERVAL,
+                 timeout=None,
+                 max_poll_failures=DEFAULT_MAX_POLL_FAILURES):
+        self.entries = sorted(entries, key=lambda entry: -entry['size'])
+        self.submit = submit
+        self.finish = finish or (lambda entry, status: None)
+        self.max_per_worker = max(int(max_per_worker), 1)
+        self.initial_interval = float(initial_interval)
+        self.maximum_interval = float(maximum_interval)
+        self.timeout = float(timeout) if timeout else None
+        self.max_poll_failures = max(int(max_poll_failures), 1)
+        self.load = {}
+
+    @staticmethod
+    def workers(entry):
+        return set(worker for worker, _ in entry['work'])
+
+    def _available(self, entry):
+        return all(self.load.get(worker, 0) < self.max_per_worker
+                   for worker in self.workers(entry))
+
+    def _start(self, entry):
+        for worker in self.workers(entry):
+            self.load[worker] = self.load.get(worker, 0) + 1
+        query = self.submit(entry)
+        log.info('Ingesting %s (%d bytes, %d workers) as query %d',
+                 entry['name'], entry['size'], len(self.workers(entry)),
+                 query.query_id)
+        now = time.time()
+        return {'entry': entry, 'query': query,
+                'interval': self.initial_interval,
+                'next_poll': now + self.initial_interval,
+                'deadline': now + self.timeout if self.timeout else None,
+                'poll_failures': 0}
+
+    def _release(self, entry):
+        for worker in self.workers(entry):
+            self.load[worker] -= 1
+
+    def run(self):
+        """ Returns the names of the relations that loaded and that failed """
+        queue, running = list(self.entries), []
+        succeeded, failed = [], []
+        log.info('Ingesting %d relations, at most %d imports per worker',
+                 len(queue), self.max_per_worker)
+
+        while queue or running:
+            for entry in list(queue):
+                if not self._available(entry):
+                    continue
+                queue.remove(entry)
+                try:
+                    running.append(self._start(entry))
+                except Exception as e:
+                    log.error('Unable to submit %s: %s', entry['name'], e)
+                    self._release(entry)
+                    failed.append(entry['name'])
+                    self.finish(entry, 'ERROR')
+
+            if not running:
+                continue
+            time.sleep(max(min(job['next_poll'] for job in running) -
+                           time.time(), 0))
+
+            now = time.time()
+            for job in [job for job in running if job['next_poll'] <= now]:
+                try:
+                    status = job['query'].status
+                    job['poll_failures'] = 0
+                except Exception as e:
+                    job['poll_failures'] += 1
+                    log.warn('Unable to poll query %d (%d of %d): %s',
+                             job['query'].query_id, job['poll_failures'],
+                             self.max_poll_failures, e)
+                    status = 'ERROR' \
+                        if job['poll_failures'] >= self.max_poll_failures \
+                        else None
+                ended = status == SUCCEEDED or status in FAILED_STATUSES
+                if not ended and job['deadline'] is not None and \
+                        now >= job['deadline']:
+                    log.error('Ingest of %s did not finish within %.0fs',
+                              job['entry']['name'], self.timeout)
+                    status, ended = TIMED_OUT, True
+                if ended:
+                    running.remove(job)
+                    self._release(job['entry'])
+                    (succeeded if status == SUCCEEDED
+                     else failed).append(job['entry']['name'])
+                    log.info('Ingest of %s ended %s', job['entry']['name'],
+                             status)
+                    self.finish(job['entry'], status)
+                else:
+                    job['interval'] = min(job['interval'] * 2,
+                                          self.maximum_interval)
+                    job['next_poll'] = min(now + job['interval'],
+                                           job['deadline'] or float('inf'))
+        return succeeded, failed
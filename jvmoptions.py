@@ -0,0 +1,112 @@
+"""
+JVM flags for the Myria coordinator and workers.
+
+The collector follows the heap size: small heaps collect quickly enough
+with the parallel (throughput) collector, while larger heaps use G1 with a
+pause-time goal so that full collections do not stall query fragments.
+The heap is fixed at its maximum to avoid resizing under load, and an
+OutOfMemoryError leaves a heap dump behind.  GC logging (with rotation)
+and Flight Recorder are optional; Flight Recorder is refused on JVMs whose
+`java -version` does not show an Oracle JDK that accepts its flags.
+"""
+import re
+
+G1_MINIMUM_HEAP_GB = 4
+DEFAULT_PAUSE_MS = 200
+GC_LOG_FILES = 5
+GC_LOG_FILE_SIZE = '20M'
+PROFILERS = ['jfr']
+ROLES = ['coordinator', 'worker']
+JAVA_VERSION_COMMAND = 'java -version 2>&1'
+# The flags below are those of Oracle JDK 7u40 through 8; later releases
+# dropped defaultrecording and OpenJDK rejects UnlockCommercialFeatures
+JFR_VERSIONS = ((1, 7, 0, 40), (1, 8, 9999, 9999))
+
+_java_version = re.compile(
+    r'version "(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:_(\d+))?')
+
+
+def parse_java_version(lines):
+    """ (vendor, version tuple) from the output of `java -version` """
+    output = '\n'.join(lines)
+    match = _java_version.search(output)
+    version = tuple(int(part or 0) for part in match.groups()) \
+        if match else None
+    vendor = 'oracle' if 'Java(TM)' in output else 'openjdk'
+    return vendor, version
+
+
+def check_profiler(profiler, lines):
+    """ Raise ValueError unless the JVM reporting `lines` runs `profiler` """
+    if profiler != 'jfr':
+        return
+    vendor, version = parse_java_version(lines)
+    if vendor != 'oracle' or version is None or \
+            not JFR_VERSIONS[0] <= version <= JFR_VERSIONS[1]:
+        raise ValueError(
+            'JVM_PROFILING=jfr needs an Oracle JDK 7u40 to 8; the cluster '
+            'runs {}'.format(' '.join(line.strip() for line in lines[:2])
+                             or 'no java'))
+
+
+def collector_options(heap_gb, pause_ms=DEFAULT_PAUSE_MS):
+    if heap_gb < G1_MINIMUM_HEAP_GB:
+        return ['-XX:+UseParallelGC', '-XX:+UseParallelOldGC']
+    return ['-XX:+UseG1GC',
+            '-XX:MaxGCPauseMillis={}'.format(int(pause_ms)),
+            '-XX:InitiatingHeapOccupancyPercent=45']
+
+
+def gc_logging_options(directory, role):
+    # %p keeps the logs of several workers on one node apart
+    return ['-XX:+PrintGCDetails', '-XX:+PrintGCDateStamps',
+            '-XX:+PrintGCApplicationStoppedTime',
+            '-Xloggc:{}/gc-{}-%p.log'.format(directory, role),
+            '-XX:+UseGCLogFileRotation',
+            '-XX:NumberOfGCLogFiles={}'.format(GC_LOG_FILES),
+            '-XX:GCLogFileSize={}'.format(GC_LOG_FILE_SIZE)]
+
+
+def profiling_options(profiler, directory, role):
+    if profiler == 'jfr':
+        # Flight Recorder ships with Oracle JDK 7u40 and later; recordings
+        # are kept per process under the repository and dumped on exit
+        return ['-XX:+UnlockCommercialFeatures', '-XX:+FlightRecorder',
+                '-XX:FlightRecorderOptions=defaultrecording=true,'
+                'disk=true,repository={}/jfr-{},maxage=1h,'
+                'dumponexit=true'.format(directory, role)]
+    return []
+
+
+def jvm_options(role, heap_gb, directory, pause_ms=DEFAULT_PAUSE_MS,
+                gc_logging=False, profiler=None, large_pages=False,
+                extra=''):
+    """ Flags for one role (besides -Xmx, which Myria sets itself) """
+    heap_mb = int(heap_gb * 1024)
+    options = ['-Xms{}m'.format(heap_mb)]
+    options += collector_options(heap_gb, pause_ms)
+    options += ['-XX:+HeapDumpOnOutOfMemoryError',
+                '-XX:HeapDumpPath={}'.format(directory)]
+    if large_pages:
+        # Requires vm.nr_hugepages to cover the heap
+        options.append('-XX:+UseLargePages')
+    if gc_logging:
+        options += gc_logging_options(directory, role)
+    if profiler:
+        options += profiling_options(profiler, directory, role)
+    options += extra.split() if extra else []
+    return options
+
+
+def runtime_entries(entries, options_by_role):
+    """
+    [runtime] section lines with the managed JVM option entries replaced:
+    jvm.options for workers and jvm.coordinator.options for the coordinator
+    """
+    keys = {'worker': 'jvm.options',
+            'coordinator': 'jvm.coordinator.options'}
+    managed = set(keys.values())
+    kept = [line for line in entries
+            if line.split('=', 1)[0].strip() not in managed]
+    return kept + ['{} = {}'.format(keys[role], ' '.join(options))
+                   for role, options in sorted(options_by_role.items())]
@@ -1,4 +1,19 @@
+import re
 import json
+import ingestplanner
+import ingestmetrics
+import bulkload
+import staging
+import ingestqueue
+from ingestpipeline import (
+    IngestPipeline,
+    Manifest,
+    staging_name,
+    union_program,
+    MANIFEST_FORMAT,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_RETRIES)
+from scheduler import TaskFailed
 from starcluster.clustersetup import DefaultClusterSetup
 from starcluster.logger import log
 from myria import MyriaConnection, MyriaSchema, MyriaRelation, MyriaQuery
@@ -10,13 +25,34 @@ DEFAULT_TIMEOUT = 3600
 
 class MyriaIngest(DefaultClusterSetup):
 
-    def __init__(self, name, schema,
-                 uris, workers=None,
+    def __init__(self, name=None, schema=None,
+                 uris='', workers=None,
                  scan_type=None, scan_parameters=None,
                  insert_type=None, insert_parameters=None,
                  hostname='localhost', port=8753, ssl=False,
                  wait_for_completion=True,
-                 timeout=DEFAULT_TIMEOUT):
+                 timeout=DEFAULT_TIMEOUT,
+                 balance='size',
+                 split_threshold=None,
+                 batch_size=None,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 retries=DEFAULT_RETRIES,
+                 manifest=None,
+                 metrics=None,
+                 metrics_history=None,
+                 metrics_sink=None,
+                 poll_interval=ingestmetrics.DEFAULT_POLL_INTERVAL,
+                 bulk_load=False,
+                 postgres_version='9.1',
+                 postgres_port=5432,
+                 database_name='myria',
+                 stage=False,
+                 staging_directory=staging.DEFAULT_STAGING_DIRECTORY,
+                 staging_ranges=staging.DEFAULT_RANGES,
+                 staging_concurrency=staging.DEFAULT_CONCURRENCY,
+                 relations=None,
+                 max_per_worker=ingestqueue.DEFAULT_MAX_PER_WORKER,
+                 maximum_poll_interval=ingestqueue.DEFAULT_MAXIMUM_INTERVAL):
         super(MyriaIngest, self).__init__()
 
         self.hostname = hostname
@@ -24,7 +60,7 @@ class MyriaIngest(DefaultClusterSetup):
         self.ssl = ssl
 
         self.name = name
-        self.schema = MyriaSchema(json.loads(schema))
+        self.schema = MyriaSchema(json.loads(schema)) if schema else None
         self.wait_for_completion = wait_for_completion
         self.timeout = timeout
 
@@ -35,36 +71,320 @@ class MyriaIngest(DefaultClusterSetup):
         self.insert_parameters = json.loads(insert_parameters) \
             if insert_parameters else None
 
-        uris = [uri.strip() for uri in uris.splitlines()]
-        ids = [int(w) for w in workers.re.findall(r"\d+", workers)] \
-            if workers else xrange(1, len(uris)+1)
-        self.work = zip(ids, uris)
+        self.uris = [uri.strip() for uri in uris.splitlines() if uri.strip()]
+        self.workers = [int(w) for w in re.findall(r"\d+", workers)] \
+            if workers else None
+        self.balance = balance
+        self.split_threshold = int(split_threshold) \
+            if split_threshold else None
+        self.work = None
 
-    def run(self, nodes, master, user, user_shell, volumes):
-        for worker, uri in self.work:
-            log.info("Worker #%d ingesting %s", worker, uri)
+        self.batch_size = int(batch_size) if batch_size else None
+        self.max_in_flight = int(max_in_flight)
+        self.retries = int(retries)
+        self.manifest = manifest or MANIFEST_FORMAT.format(
+            (name or '').replace(':', '_'))
+
+        self.sizes = None
+        self.poll_interval = float(poll_interval)
+        self.sinks = [ingestmetrics.LogSink()]
+        if metrics:
+            self.sinks.append(ingestmetrics.JsonFileSink(metrics))
+        if metrics_history:
+            self.sinks.append(ingestmetrics.HistorySink(metrics_history))
+        if metrics_sink:
+            self.sinks.append(ingestmetrics.load_sink(metrics_sink))
+
+        self.bulk_load = bulkload.BulkLoad(postgres_version, postgres_port) \
+            if str(bulk_load).lower() in ('true', 'yes', '1') else None
+        self.database_name = database_name
+        self.staging = staging.Staging(
+            name or 'manifest', staging_directory, staging_ranges,
+            staging_concurrency) \
+            if str(stage).lower() in ('true', 'yes', '1') else None
+        self.nodes_by_worker = {}
+
+        # Manifest-driven mode: many relations queued across the cluster
+        self.relations = ingestqueue.load_relations(relations) \
+            if relations else None
+        if not self.relations and not (name and schema and self.uris):
+            raise ValueError('MyriaIngest needs name, schema and uris, '
+                             'or a relations manifest')
+        self.max_per_worker = int(max_per_worker)
+        self.maximum_poll_interval = float(maximum_poll_interval)
 
+    def plan(self, connection):
+        """ Assign sources to live workers, balancing bytes per worker """
+        if self.balance != 'size':
+            ids = self.workers or xrange(1, len(self.uris)+1)
+            return zip(ids, self.uris)
+
+        alive = sorted(int(w) for w in connection.workers_alive())
+        workers = [w for w in self.workers if w in alive] \
+            if self.workers else alive
+        if not workers:
+            raise ValueError('No live workers available for ingest')
+
+        self.sizes = ingestplanner.uri_sizes(self.uris)
+        pieces = ingestplanner.split(
+            self.sizes, len(workers), self.split_threshold,
+            lambda uri: ingestplanner.is_splittable(
+                uri, self.scan_type, self.scan_parameters))
+        plan = ingestplanner.assign(pieces, workers)
+        ingestplanner.log_plan(plan)
+        return ingestplanner.work(plan)
+
+    def run(self, nodes, master, user, user_shell, volumes):
         with master.ssh.remote_file(DEPLOYMENT_PATH, 'r') as descriptor:
             connection = MyriaConnection(deployment=descriptor, ssl=self.ssl)
             log.info("MyriaConnection URI: " + connection._url_start)
-            relation = MyriaRelation(self.name,
-                                     schema=self.schema,
-                                     connection=connection)
-            query = MyriaQuery.parallel_import(
-                relation, self.work,
-                scan_type=self.scan_type,
-                scan_parameters=self.scan_parameters,
-                insert_type=self.insert_type,
-                insert_parameters=self.insert_parameters,
-                timeout=self.timeout)
+
+            if self.bulk_load and not (self.batch_size or
+                                       self.wait_for_completion or
+                                       self.relations):
+                log.warn("Bulk-load mode requires waiting for completion; "
+                         "ingesting with normal settings")
+                self.bulk_load = None
+            if self.staging and (self.batch_size or self.relations or
+                                 not self.wait_for_completion):
+                log.warn("Staging requires a single import that is waited "
+                         "for; importing from the original sources")
+                self.staging = None
+            if self.staging:
+                hosts = dict((node.dns_name, node) for node in nodes)
+                self.nodes_by_worker = dict(
+                    (worker, hosts.get(host)) for worker, (host, _)
+                    in MyriaInstaller.deployment_workers(master).items())
+
+            workers = []
+            if self.bulk_load:
+                databases = bulkload.databases_by_host(
+                    MyriaInstaller.deployment_section(master, 'workers'),
+                    self.database_name)
+                workers = [node for node in nodes
+                           if node.dns_name in databases]
+            failed = []
+            try:
+                if self.bulk_load:
+                    self.bulk_load.begin(workers)
+                if self.relations:
+                    loaded, failed = self.run_queue(connection)
+                else:
+                    relation = MyriaRelation(self.name,
+                                             schema=self.schema,
+                                             connection=connection)
+                    monitor = ingestmetrics.IngestMonitor(
+                        connection, self.name, relation.qualified_name,
+                        self.poll_interval)
+                    self.ingest(connection, relation, monitor)
+                    loaded = [relation]
+            finally:
+                if self.bulk_load:
+                    # Never mask the ingest's own error with this one
+                    try:
+                        self.bulk_load.end(workers)
+                    except Exception as e:
+                        log.error("Unable to close the bulk-load window; "
+                                  "check {} on the workers: {}".format(
+                                      bulkload.BULKLOAD_FILENAME, e))
+
+            if self.bulk_load:
+                for relation in loaded:
+                    self.bulk_load.vacuum_analyze(
+                        workers, databases,
+                        bulkload.table_name(relation.qualified_name))
+
+            MyriaInstaller.web_restart(master)
+            if failed:
+                raise ingestqueue.RelationsFailed(failed)
+
+    def ingest(self, connection, relation, monitor):
+        if self.batch_size:
+            self.run_pipeline(connection, relation, monitor)
+        else:
+            self.work = self.plan(connection)
+            work = self.stage(monitor) if self.staging else self.work
+            for worker, uri in work:
+                log.info("Worker #%d ingesting %s", worker, uri)
+
+            monitor.start()
+            query = self.submit(relation, work)
+            monitor.track(query.query_id)
             log.info("Ingesting as query %d", query.query_id)
 
             if self.wait_for_completion:
-                query.wait_for_completion()
+                try:
+                    query.wait_for_completion()
+                finally:
+                    monitor.stop()
                 log.info("Ingest complete (%d, %s)",
                          query.query_id, query.status)
+                if self.staging and query.status == 'SUCCESS':
+                    self.staging.cleanup()
+                self.emit_metrics(monitor, self.work)
 
-            MyriaInstaller.web_restart(master)
+    def stage(self, monitor):
+        """ Prefetch sources to the workers; the original work on failure """
+        try:
+            work = self.staging.stage(self.work, self.nodes_by_worker)
+        except TaskFailed as e:
+            log.warn("Staging failed (%s); importing from the original "
+                     "sources", e)
+            self.staging.cleanup()
+            return self.work
+        monitor.phase('staging', self.staging.elapsed, self.staging.bytes)
+        return work
+
+    def relation_ingest(self, entry):
+        """ A single-relation ingest for a manifest entry """
+        def option(key, default):
+            value = entry.get(key, default)
+            return json.dumps(value) if isinstance(value, (dict, list)) \
+                else value
+
+        ingest = MyriaIngest(
+            entry['name'], option('schema', None),
+            '\n'.join(entry['uris']),
+            workers=option('workers', None),
+            scan_type=entry.get('scan_type', self.scan_type),
+            scan_parameters=option('scan_parameters', self.scan_parameters),
+            insert_type=entry.get('insert_type', self.insert_type),
+            insert_parameters=option('insert_parameters',
+                                     self.insert_parameters),
+            timeout=self.timeout,
+            balance=entry.get('balance', self.balance),
+            split_threshold=entry.get('split_threshold',
+                                      self.split_threshold),
+            poll_interval=self.poll_interval)
+        ingest.sinks = self.sinks
+        return ingest
+
+    def run_queue(self, connection):
+        """
+        Ingest every relation in the manifest; returns the relations that
+        loaded and the names of those that failed
+        """
+        entries = []
+        for entry in self.relations:
+            ingest = self.relation_ingest(entry)
+            relation = MyriaRelation(ingest.name, schema=ingest.schema,
+                                     connection=connection)
+            ingest.work = ingest.plan(connection)
+            if ingest.sizes is None:
+                ingest.sizes = ingestplanner.uri_sizes(ingest.uris)
+            entries.append({
+                'name': ingest.name, 'ingest': ingest, 'relation': relation,
+                'work': ingest.work,
+                'size': sum(ingestmetrics.worker_bytes(
+                    ingest.work, ingest.sizes).values()),
+                'monitor': ingestmetrics.IngestMonitor(
+                    connection, ingest.name, relation.qualified_name,
+                    self.poll_interval)})
+
+        def submit(entry):
+            entry['monitor'].start()
+            query = entry['ingest'].submit(entry['relation'], entry['work'])
+            entry['monitor'].track(query.query_id)
+            return query
+
+        def finish(entry, status):
+            entry['monitor'].stop()
+            if status == 'SUCCESS':
+                entry['ingest'].emit_metrics(entry['monitor'], entry['work'])
+
+        queue = ingestqueue.IngestQueue(
+            entries, submit, finish, self.max_per_worker,
+            maximum_interval=self.maximum_poll_interval,
+            timeout=self.timeout)
+        loaded, failed = queue.run()
+        return [entry['relation'] for entry in entries
+                if entry['name'] in loaded], failed
+
+    def submit(self, relation, work):
+        return MyriaQuery.parallel_import(
+            relation, work,
+            scan_type=self.scan_type,
+            scan_parameters=self.scan_parameters,
+            insert_type=self.insert_type,
+            insert_parameters=self.insert_parameters,
+            timeout=self.timeout)
+
+    def emit_metrics(self, monitor, work):
+        if self.sizes is None:
+            self.sizes = ingestplanner.uri_sizes(
+                [uri for uri in self.uris
+                 if any(source == uri for _, source in work)])
+        report = monitor.report(ingestmetrics.worker_bytes(work, self.sizes))
+        for sink in self.sinks:
+            try:
+                sink.emit(report)
+            except Exception as e:
+                log.warn("Unable to record ingest metrics with %s: %s",
+                         type(sink).__name__, e)
+
+    def run_pipeline(self, connection, relation, monitor):
+        manifest = Manifest(self.manifest, self.name, self.uris)
+        if manifest.load():
+            log.info("Resuming ingest from %s", manifest.path)
+            self.reassign(manifest, connection)
+        else:
+            self.work = self.plan(connection)
+            manifest.plan(self.work, self.batch_size)
+            manifest.save()
+
+        def submit(batch_id, work):
+            query = self.submit(MyriaRelation(
+                staging_name(relation.name, batch_id), schema=self.schema,
+                connection=connection), work)
+            monitor.track(query.query_id)
+            return query
+
+        def merge(batch_ids):
+            return MyriaQuery.submit(
+                union_program(relation.name, batch_ids),
+                connection=connection, timeout=self.timeout,
+                wait_for_completion=False)
+
+        work = [tuple(pair) for batch in manifest.pending()
+                for pair in batch['work']]
+        pipeline = IngestPipeline(manifest, submit, merge,
+                                  max_in_flight=self.max_in_flight,
+                                  retries=self.retries)
+        monitor.start()
+        try:
+            pipeline.run()
+        finally:
+            monitor.stop()
+        log.info("Ingest complete (%d batches)", len(manifest.batches))
+        self.drop_staging(connection, relation, manifest.batches)
+        self.emit_metrics(monitor, work)
+
+    @staticmethod
+    def drop_staging(connection, relation, batches):
+        """ Delete the per-batch relations once they have been merged """
+        for batch in batches:
+            name = staging_name(relation.name, batch['id'])
+            try:
+                connection.delete_dataset(dict(
+                    zip(['userName', 'programName', 'relationName'],
+                        name.split(':'))))
+            except Exception as e:
+                log.warn("Unable to delete %s: %s", name, e)
+
+    @staticmethod
+    def reassign(manifest, connection):
+        """ Move pending work planned for workers that are no longer live """
+        alive = sorted(int(w) for w in connection.workers_alive())
+        if not alive:
+            raise ValueError('No live workers available for ingest')
+        index = 0
+        for batch in manifest.pending():
+            for pair in batch['work']:
+                if pair[0] not in alive:
+                    log.info("Worker #%d is down; moving %s to worker #%d",
+                             pair[0], pair[1], alive[index % len(alive)])
+                    pair[0] = alive[index % len(alive)]
+                    index += 1
 
     def on_restart(self, nodes, master, user, user_shell, volumes):
         pass
@@ -1,17 +1,48 @@
 import os
-import time
+import re
+import posixpath
+import json
 import random
 import string
+import time
+from functools import partial
+import pgbouncer
 from postgresplugin import (
     PostgresInstaller,
     DEFAULT_PATH_FORMAT,
     DEFAULT_DATA_PATH)
+import distribution
+import engine
+import getresturl
+import imagebake
+import jvmoptions
+import nodetuning
+import pgtuning
+import tracing
+import workersizing
+from buildcache import BuildCache, DEFAULT_CACHE_ENTRIES
+from aptcache import PackageCache, update_once_command, DEFAULT_PROXY_PORT
+from remotebatch import CommandBatch, apt_install
+from readiness import (
+    wait_for_all,
+    workers_alive,
+    PostgresProbe,
+    TcpProbe,
+    HttpProbe,
+    DEFAULT_READY_TIMEOUT)
+from scheduler import TaskGraph, map_nodes
 from starcluster.clustersetup import DefaultClusterSetup
 from starcluster.logger import log
 
 DEFAULT_HEAP_SIZE = 2
 DEFAULT_MYRIA_POSTGRES_PORT = 5432
 DEFAULT_DEPLOYMENT_FILENAME = 'deployment.cfg.ec2'
+# The deployment without its workers, used to lay out the master's tree
+MASTER_DEPLOYMENT_FILENAME = 'deployment.cfg.master'
+# Per-node state that setup_cluster.py creates and the fan-out must not copy
+LOCAL_DEPLOYMENT_FILES = ['worker_*', '*.log']
+DISTRIBUTION_MODES = ['tree', 'push']
+DEFAULT_BUILD_TASKS = ['clean', 'eclipseClasspath', 'jar']
 DEFAULT_WEB_REPOSITORY_URL = 'https://github.com/uwescience/myria-web.git'
 DEFAULT_HOSTNAME_CONFIG_PATH = '/mnt/myria_web/appengine/myria_web_main.py'
 DEFAULT_PYTHON_REPOSITORY_URL = \
@@ -20,6 +51,27 @@ DEFAULT_APPENGINE_URL = (
     'https://storage.googleapis.com/appengine-sdks/featured/'
     'google_appengine_1.9.23.zip')
 
+# Coordinator REST endpoints and worker process commands used to grow and
+# shrink a running cluster.  They track the Myria version being deployed.
+WORKERS_ALIVE_ENDPOINT = '/workers/alive'
+ADD_WORKERS_ENDPOINT = '/workers/add'
+REMOVE_WORKER_ENDPOINT = '/workers/worker-{id}'
+RUNNING_QUERIES_ENDPOINT = '/query?status=RUNNING'
+START_WORKER_COMMAND = (
+    'mkdir -p {path}/worker_{id} && cd {path} && nohup java -Xmx{heap}g {options} -cp "{path}/libs/*" '
+    'edu.washington.escience.myria.parallel.Worker '
+    '--workingDir {path}/worker_{id} '
+    '> {path}/worker_{id}_stdout 2> {path}/worker_{id}_stderr &')
+STOP_WORKER_COMMAND = "pkill -f 'workingDir {path}/worker_{id}( |$)'"
+# A worker's configuration: the deployment file plus a [worker] section
+WORKER_CONFIG_PATH = '{path}/worker_{id}/worker.cfg'
+RUNTIME_HEAP_KEY = 'jvm.heap.size.max.gb'
+RUNTIME_OPTIONS_KEY = 'jvm.options'
+DEFAULT_DRAIN_TIMEOUT = 600
+DEFAULT_DRAIN_INTERVAL = 10
+
+_worker_entry = re.compile(r'^\s*(\d+)\s*=\s*([^:\s]+):(\d+)')
+
 MYRIA_WEB_SERVICE_CONFIG = \
 """'# Myria-Web Service
 description     "Myria Webserver"
@@ -29,6 +81,56 @@ stop on starting rc RUNLEVEL=[016]
 respawn
 exec /mnt/google_appengine/dev_appserver.py --host {hostname} --port 80 --skip_sdk_update_check true /mnt/myria_web/appengine'"""
 
+# Multi-process mode: gunicorn serves the app behind nginx, which answers
+# port 80 and serves static assets with caching headers
+DEFAULT_WEB_WORKERS = 4
+DEFAULT_WEB_THREADS = 4
+DEFAULT_WEB_APPLICATION_PORT = 8080
+DEFAULT_WEB_STATIC_EXPIRY = '7d'
+MYRIA_WEB_WSGI_PATH = '/mnt/myria_web/appengine/myria_web_wsgi.py'
+MYRIA_WEB_NGINX_PATH = '/etc/nginx/sites-available/myria-web'
+
+MYRIA_WEB_WSGI_MODULE = """import sys
+sys.path.insert(0, '/mnt/google_appengine')
+import dev_appserver
+dev_appserver.fix_sys_path()
+from myria_web_main import app
+"""
+
+MYRIA_WEB_WSGI_SERVICE_CONFIG = \
+"""'# Myria-Web Service
+description     "Myria Webserver"
+author          "Brandon Haynes <bhaynes@cs.washington.edu>"
+start on runlevel [2345]
+stop on starting rc RUNLEVEL=[016]
+respawn
+chdir /mnt/myria_web/appengine
+exec gunicorn --workers {workers} --threads {threads} --bind 127.0.0.1:{port} myria_web_wsgi:app'"""
+
+MYRIA_WEB_NGINX_CONFIG = """server {{
+    listen 80 default_server;
+    server_name {hostname};
+
+    location ~* \\.(css|js|png|jpg|jpeg|gif|svg|ico|woff|woff2|ttf|eot|map)$ {{
+        root /mnt/myria_web/appengine;
+        expires {expiry};
+        add_header Cache-Control public;
+        try_files $uri @myria_web;
+    }}
+
+    location / {{
+        try_files /nonexistent @myria_web;
+    }}
+
+    location @myria_web {{
+        proxy_pass http://127.0.0.1:{port};
+        proxy_set_header Host $host;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_read_timeout 300;
+    }}
+}}
+"""
+
 
 class MyriaInstaller(DefaultClusterSetup):
 
@@ -49,8 +151,33 @@ class MyriaInstaller(DefaultClusterSetup):
                  myria_commit=None,
                  jvm_version="java-1.7.0-openjdk",
                  database_name='myria',
+                 build_cache_directory=None,
+                 build_cache_entries=DEFAULT_CACHE_ENTRIES,
+                 ready_timeout=DEFAULT_READY_TIMEOUT,
+                 package_cache=None,
+                 package_cache_port=DEFAULT_PROXY_PORT,
+                 bake_image=None,
+                 postgres_tuning=None,
+                 workers_per_node=None,
+                 trace=None,
+                 distribution=None,
+                 web_server=None,
+                 web_workers=DEFAULT_WEB_WORKERS,
+                 web_threads=DEFAULT_WEB_THREADS,
+                 node_timeout=None,
+                 command_timeout=None,
+                 node_tuning=None,
+                 node_tuning_dry_run=False,
+                 jvm_tuning=None,
+                 gc_pause_ms=jvmoptions.DEFAULT_PAUSE_MS,
+                 gc_logging=None,
+                 jvm_profiling=None,
+                 jvm_large_pages=None,
+                 coordinator_jvm_options='',
+                 worker_jvm_options='',
 
                  postgres_port=DEFAULT_MYRIA_POSTGRES_PORT,
+                 postgres_pool_port=None,
                  postgres_version="9.1",
                  postgres_path=DEFAULT_PATH_FORMAT,
                  postgres_name=None,
@@ -72,9 +199,46 @@ class MyriaInstaller(DefaultClusterSetup):
         self.database_name = database_name
         self.myria_commit = myria_commit
         self.jvm_version = jvm_version
+        self.build_cache = BuildCache(build_cache_directory,
+                                      build_cache_entries) \
+            if build_cache_directory else None
+        self.ready_timeout = int(ready_timeout)
+        self.package_cache = PackageCache(package_cache_port) \
+            if package_cache == 'proxy' else None
+        self.package_cache_host = None
+        self.bake_image = bake_image
+        self.resolved_commit = None
+        self.postgres_tuning = postgres_tuning == 'auto'
+        self.workers_per_node = workers_per_node
+        self.worker_plan = None
+        self.deployed = None
+        self.trace = trace
+        self.tracer = tracing.tracer(trace)
+        self.distribution = distribution \
+            if distribution in DISTRIBUTION_MODES else None
+        self.web_server = web_server
+        self.web_workers = int(web_workers)
+        self.web_threads = int(web_threads)
+        self.engine = engine.Engine(node_timeout=node_timeout,
+                                    command_timeout=command_timeout)
+        self.node_tuning = node_tuning
+        if node_tuning:
+            nodetuning.profile(node_tuning)
+        self.node_tuning_dry_run = \
+            str(node_tuning_dry_run).lower() in ('true', 'yes', '1')
+        self.jvm_tuning = jvm_tuning == 'auto'
+        self.gc_pause_ms = int(gc_pause_ms)
+        self.gc_logging = str(gc_logging).lower() in ('true', 'yes', '1')
+        self.jvm_profiling = jvm_profiling \
+            if jvm_profiling in jvmoptions.PROFILERS else None
+        self.jvm_large_pages = \
+            str(jvm_large_pages).lower() in ('true', 'yes', '1')
+        self.extra_jvm_options = {'coordinator': coordinator_jvm_options,
+                                  'worker': worker_jvm_options}
 
         self.deploy_dir = "{}/myriadeploy".format(install_directory)
         self.postgres = {'port': postgres_port,
+                         'pool_port': postgres_pool_port,
                          'version': postgres_version,
                          'path': postgres_path,
                          'name': postgres_name,
@@ -84,24 +248,139 @@ class MyriaInstaller(DefaultClusterSetup):
     def _set_up_node(self, node):
         log.info("Begin configuring {}".format(node.alias))
 
-        log.info('*   Removing source deb '
-                 'http://www.cs.wisc.edu/condor/debian/development '
-                 'lenny contrib')
-        node.ssh.execute('sed -i "s/deb http:\/\/www.cs.wisc.edu\/condor\/debian\/development lenny contrib/#deb http:\/\/www.cs.wisc.edu\/condor\/debian\/development lenny contrib/g" /etc/apt/sources.list')
-
-        node.apt_command('update')
-        node.package_install(' '.join(self.packages))
-        node.ssh.execute(
-            'sudo update-java-alternatives -s {}'.format(self.jvm_version))
-
+        batch = CommandBatch(node)
+        self._install_packages(node, batch)
         if self.dbms == "postgresql":
-            self.configure_postgres(node)
+            self.configure_postgres(node, batch)
+
+        batch.run()
+
+    def _install_packages(self, node, batch=None):
+        commands = batch if batch is not None else CommandBatch(node)
+        commands.add('Remove source deb '
+                     'http://www.cs.wisc.edu/condor/debian/development '
+                     'lenny contrib',
+                     'sed -i "s/deb http:\/\/www.cs.wisc.edu\/condor\/debian\/development lenny contrib/#deb http:\/\/www.cs.wisc.edu\/condor\/debian\/development lenny contrib/g" /etc/apt/sources.list')
+        if self.package_cache:
+            self.package_cache.configure_client(commands,
+                                                self.package_cache_host)
+        commands.add('Update package lists', update_once_command())
+        commands.add('Install packages', apt_install(' '.join(self.packages)))
+        commands.add('Select JVM',
+                     'sudo update-java-alternatives -s {}'.format(
+                         self.jvm_version))
+
+        if batch is None:
+            commands.run()
 
     def run(self, nodes, master, user, user_shell, volumes):
+        nodes = self.tracer.nodes(nodes)
+        master = self.tracer.node(master)
         worker_nodes = filter(lambda node: not node.is_master(), nodes)
 
         log.info('Beginning Myria configuration')
 
+        self.load_password(master)
+
+        with self.tracer.span('fingerprint', 'fingerprint', master.alias):
+            fingerprint = self.fingerprint(master)
+            prebaked = dict((node.alias,
+                             imagebake.is_prebaked(node, 'myria',
+                                                   fingerprint))
+                            for node in nodes)
+        provision = [node for node in nodes if not prebaked[node.alias]]
+
+        graph = TaskGraph(tracer=self.tracer)
+        package_dependencies = []
+        if self.package_cache and provision:
+            self.package_cache_host = master.private_ip_address
+            package_dependencies = [graph.add(
+                'package-cache',
+                partial(self.package_cache.set_up_master, master))]
+
+        for node in provision:
+            graph.add(self._task('packages', node),
+                      self._node_job(self._install_packages, node),
+                      package_dependencies)
+        sizing = []
+        if self.workers_per_node == 'auto':
+            sizing = [graph.add('sizing',
+                                partial(self.size_workers, worker_nodes))]
+
+        for node in nodes if self.dbms == "postgresql" else []:
+            graph.add(self._task('postgres', node),
+                      self._node_job(self.configure_postgres, node),
+                      sizing + ([self._task('packages', node)]
+                                if node in provision else []))
+        for node in nodes if self.node_tuning else []:
+            graph.add(self._task('tuning', node),
+                      self._node_job(self.tune_node, node))
+        node_tasks = [name for name in graph.order
+                      if name not in package_dependencies + sizing]
+
+        # get, compile and deploy myria from master
+        if prebaked[master.alias]:
+            graph.add('build', lambda: None)
+        else:
+            graph.add('build', partial(self.build, master),
+                      [self._task('packages', master)])
+            graph.add('myria-python',
+                      partial(self.configure_python, master,
+                              DEFAULT_PYTHON_REPOSITORY_URL),
+                      [self._task('packages', master)])
+            if self.bake_image and fingerprint:
+                graph.add('bake', partial(self.bake, master, fingerprint),
+                          ['build', 'myria-python'] +
+                          ([self._task('postgres', master)]
+                           if self.dbms == "postgresql" else []))
+
+        # Quarantined workers are left out of the deployment, so it waits
+        # until every node's setup has finished or been quarantined
+        healthy = lambda: self.engine.healthy(worker_nodes)
+        graph.add('deployment',
+                  lambda: self.create_configuration(master, healthy()),
+                  ['build'] + sizing + node_tasks)
+        distribute = []
+        if self.distribution:
+            distribute = [graph.add(
+                'distribute', lambda: self.distribute(master, healthy()),
+                ['deployment'] + node_tasks)]
+        graph.add('launch',
+                  lambda: self.launch(master, [master] + healthy()),
+                  ['deployment'] + node_tasks + distribute)
+
+        # Instance storage (/mnt) is not captured by images, so myria-web
+        # is installed even on prebaked nodes
+        graph.add('myria-web',
+                  partial(self.configure_web, master,
+                          DEFAULT_APPENGINE_URL,
+                          DEFAULT_WEB_REPOSITORY_URL),
+                  [] if prebaked[master.alias] else ['myria-python'])
+
+        try:
+            graph.run()
+        finally:
+            graph.report()
+            self.engine.report()
+            if self.trace:
+                self.tracer.export(os.path.expanduser(self.trace))
+                self.tracer.summary()
+
+        self.forget_rest_url(master)
+        log.info('End Myria configuration')
+
+    def on_restart(self, nodes, master, user, user_shell, volumes):
+        # Cached REST URLs may name addresses the cluster no longer has
+        self.forget_rest_url(master)
+
+    @staticmethod
+    def forget_rest_url(master):
+        """ Drop this cluster's cached REST URL; others stay cached """
+        tag = getresturl.master_tag(master)
+        getresturl.UrlCache().invalidate([tag] if tag else None)
+
+    def load_password(self, master):
+        """ Keep the password of an existing deployment """
         if (self.dbms == "postgresql" and
                          master.ssh.isfile(DEFAULT_DEPLOYMENT_FILENAME)):
             lines = master.ssh.get_remote_file_lines(
@@ -110,31 +389,224 @@ class MyriaInstaller(DefaultClusterSetup):
                 self.postgres['password'] = lines[0].replace(
                     'database_password = ', '')
 
-        # init nodes in parallel
-        for node in nodes:
-            self.pool.simple_job(
-                self._set_up_node, (node), jobid=node.alias)
-        self.pool.wait(len(nodes))
-
-        # get, compile and deploy myria from master
-        log.info('Begin repository clone on {}'.format(master.alias))
+    def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        """
+        Provision `node`, copy the built Myria installation to it from the
+        master and register its workers with the running coordinator.
+        Existing workers are neither rebuilt nor restarted.
+        """
+        node = self.tracer.node(node)
+        master = self.tracer.node(master)
+        log.info('Adding {} to the Myria cluster'.format(node.alias))
+        self.load_password(master)
+        if self.package_cache:
+            self.package_cache_host = master.private_ip_address
+
+        existing = self.deployment_workers(master)
+        first_id = max(existing.keys() or [0]) + 1
+        # New workers match the running ones, not this plugin's defaults
+        self.deployed = self.deployed_runtime(master)
+
+        graph = TaskGraph(tracer=self.tracer)
+        if self.workers_per_node == 'auto':
+            graph.add('sizing', partial(self.size_new_node, node))
+        fingerprint = self.fingerprint(master)
+        if not imagebake.is_prebaked(node, 'myria', fingerprint):
+            graph.add(self._task('packages', node),
+                      partial(self._install_packages, node))
+        if self.dbms == "postgresql":
+            graph.add(self._task('postgres', node),
+                      partial(self.configure_postgres, node),
+                      [name for name in graph.order])
+        if self.node_tuning:
+            graph.add(self._task('tuning', node),
+                      partial(self.tune_node, node))
+        graph.add(self._task('artifacts', node),
+                  partial(self.copy_artifacts, master, node),
+                  [name for name in graph.order if name != 'sizing'])
+        graph.add('deployment',
+                  partial(self.add_to_deployment, master, node, first_id),
+                  ['sizing'] if 'sizing' in graph.tasks else [])
+        graph.add(self._task('register', node),
+                  partial(self.register_workers, master, node, first_id,
+                          len(existing)),
+                  list(graph.order))
+        try:
+            graph.run()
+        finally:
+            graph.report()
+
+    def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        """ Drain, deregister and stop the workers running on `node` """
+        node = self.tracer.node(node)
+        master = self.tracer.node(master)
+        workers = dict((worker_id, entry)
+                       for worker_id, entry
+                       in self.deployment_workers(master).items()
+                       if entry[0] == node.dns_name)
+        if not workers:
+            log.info('No Myria workers on {}'.format(node.alias))
+            return
+
+        log.info('Removing workers {} on {} from the Myria cluster'.format(
+            ', '.join(map(str, sorted(workers))), node.alias))
+        with self.tracer.span('drain', 'drain', node.alias):
+            self.drain(master)
+        with self.tracer.span('deregister', 'deregister', node.alias):
+            for worker_id in sorted(workers):
+                master.ssh.execute(
+                    "curl -sf -X DELETE 'http://localhost:{}{}'".format(
+                        self.rest_port,
+                        REMOVE_WORKER_ENDPOINT.format(id=worker_id)),
+                    ignore_exit_status=True)
+                node.ssh.execute(STOP_WORKER_COMMAND.format(
+                    path=self.path, id=worker_id), ignore_exit_status=True)
+            self.rewrite_deployment_section(master, 'workers', [
+                line for line in self.deployment_section(master, 'workers')
+                if not _worker_entry.match(line) or
+                int(_worker_entry.match(line).group(1)) not in workers])
+
+    def size_new_node(self, node):
+        hardware = pgtuning.read_hardware(node, self.path)
+        heap = self.deployed['heap']
+        count = workersizing.workers_for(hardware, self.dbms, heap)
+        self.worker_plan = {node.alias: [
+            workersizing.Worker(node.dns_name, int(self.worker_port) + index,
+                                self.database_name if index == 0
+                                else '{}_{}'.format(self.database_name,
+                                                    index))
+            for index in range(count)]}
+        log.info('{}: {} workers with {}GB heaps'.format(
+            node.alias, count, heap))
+
+    def copy_artifacts(self, master, node):
+        """ Ship the master's deployed Myria installation to `node` """
+        log.info('Copying Myria installation to {}'.format(node.alias))
+        node.ssh.execute('mkdir -p {}'.format(self.path))
         master.ssh.execute(
-            'rm -rf {dir} ; git clone {} {dir}'.format(
-                self.repository, dir=self.directory))
-        log.info("commit version: {}".format(self.myria_commit))
-        if self.myria_commit:
-            master.ssh.execute(
-                'cd {dir} && git checkout {commit}'.format(
-                    dir=self.directory, commit=self.myria_commit))
+            'rsync -a --exclude "worker_*" --exclude "*.log" '
+            '{path}/ {host}:{path}/'.format(path=self.path,
+                                            host=node.dns_name))
+
+    def add_to_deployment(self, master, node, first_id):
+        entries = self.deployment_section(master, 'workers')
+        entries.extend(
+            '{} = {}:{}:{}:{}'.format(worker_id, worker.host, worker.port,
+                                      self.path, worker.database)
+            for worker_id, worker in enumerate(self.workers_on(node),
+                                               first_id))
+        self.rewrite_deployment_section(master, 'workers', entries)
+
+    def deployed_runtime(self, master):
+        """ Heap (GB) and worker JVM options of the running deployment """
+        runtime = dict((key.strip(), value.strip()) for key, _, value in
+                       (line.partition('=') for line in
+                        self.deployment_section(master, 'runtime')))
+        heap = workersizing.heap_gb(runtime.get(RUNTIME_HEAP_KEY), None)
+        return {'heap': max(int(heap), workersizing.MINIMUM_HEAP_GB)
+                if heap else self.heap_size(),
+                'options': runtime.get(RUNTIME_OPTIONS_KEY,
+                                       ' '.join(self.jvm_options('worker')))}
+
+    def write_worker_configs(self, master, node, workers):
+        """ Give each new worker id its own configuration file """
+        with master.ssh.remote_file(DEFAULT_DEPLOYMENT_FILENAME, 'r') as f:
+            deployment = f.read().rstrip('\n')
+        for worker_id, worker in sorted(workers.items()):
+            path = WORKER_CONFIG_PATH.format(path=self.path, id=worker_id)
+            node.ssh.execute('mkdir -p {}'.format(posixpath.dirname(path)))
+            with node.ssh.remote_file(path, 'w') as f:
+                f.write('{}\n\n[worker]\nid = {}\nhost = {}\nport = {}\n'
+                        'database_name = {}\n'.format(
+                            deployment, worker_id, worker.host, worker.port,
+                            worker.database))
+
+    def start_workers(self, master, node, first_id):
+        workers = dict(enumerate(self.workers_on(node), first_id))
+        self.write_worker_configs(master, node, workers)
+        for worker_id in sorted(workers):
+            node.ssh.execute(START_WORKER_COMMAND.format(
+                path=self.path, heap=self.deployed['heap'], id=worker_id,
+                options=self.deployed['options']))
+        return workers
+
+    def register_workers(self, master, node, first_id, existing_count):
+        workers = self.start_workers(master, node, first_id)
+        master.ssh.execute(
+            "curl -sf -X POST -H 'Content-Type: application/json' "
+            "-d '{}' 'http://localhost:{}{}'".format(
+                json.dumps(dict((str(worker_id), '{}:{}'.format(
+                    worker.host, worker.port))
+                    for worker_id, worker in workers.items())),
+                self.rest_port, ADD_WORKERS_ENDPOINT))
+        wait_for_all([master],
+                     lambda _: [HttpProbe(
+                         'http://localhost:{}{}'.format(
+                             self.rest_port, WORKERS_ALIVE_ENDPOINT),
+                         workers_alive(existing_count + len(workers)))],
+                     self.ready_timeout)
+
+    def drain(self, master, timeout=DEFAULT_DRAIN_TIMEOUT,
+              interval=DEFAULT_DRAIN_INTERVAL):
+        """ Wait until the coordinator reports no running queries """
+        deadline = time.time() + timeout
+        while True:
+            output = '\n'.join(master.ssh.execute(
+                "curl -sf 'http://localhost:{}{}'".format(
+                    self.rest_port, RUNNING_QUERIES_ENDPOINT),
+                ignore_exit_status=True))
+            try:
+                running = json.loads(output) if output.strip() else []
+            except ValueError:
+                running = []
+            if isinstance(running, dict):
+                running = running.get('results', [])
+            if not running:
+                return
+            if time.time() > deadline:
+                log.warn('{} queries still running after {}s; removing '
+                         'anyway'.format(len(running), timeout))
+                return
+            log.info('Waiting for {} running queries to finish'.format(
+                len(running)))
+            time.sleep(interval)
 
-        log.info('Begin build on {}'.format(master.alias))
-        master.ssh.execute('cd {} && ./gradlew clean'.format(self.directory))
-        master.ssh.execute('cd {} && ./gradlew eclipseClasspath'.format(
-            self.directory))
-        master.ssh.execute('cd {} && ./gradlew jar'.format(self.directory))
+    @staticmethod
+    def deployment_section(master, section):
+        """ Lines in the body of one [section] of the deployment file """
+        with master.ssh.remote_file(DEFAULT_DEPLOYMENT_FILENAME, 'r') as f:
+            lines = f.read().splitlines()
+        header, inside, body = '[{}]'.format(section), False, []
+        for line in lines:
+            if line.strip().startswith('['):
+                inside = line.strip() == header
+            elif inside and line.strip():
+                body.append(line)
+        return body
+
+    @classmethod
+    def deployment_workers(cls, master):
+        """ Worker id -> (host, port) from the deployment file """
+        workers = {}
+        for line in cls.deployment_section(master, 'workers'):
+            match = _worker_entry.match(line)
+            if match:
+                workers[int(match.group(1))] = (match.group(2),
+                                                int(match.group(3)))
+        return workers
 
-        log.info('Begin create deployment file on {}'.format(master.alias))
-        self.create_configuration(master, worker_nodes)
+    @staticmethod
+    def _task(phase, node):
+        return '{}:{}'.format(phase, node.alias)
+
+    def _node_job(self, function, node):
+        """ A worker's failure quarantines it; the master's is fatal """
+        if node.is_master():
+            return partial(function, node)
+        return partial(self.engine.call, function, node)
+
+    def launch(self, master, nodes):
+        worker_nodes = filter(lambda node: not node.is_master(), nodes)
 
         enter_deploy = "cd {}".format(self.deploy_dir)
         log.info('Begin Myria cluster setup on {}'.format(master.alias))
@@ -142,47 +614,181 @@ class MyriaInstaller(DefaultClusterSetup):
             '{} && sudo ./setup_cluster.py ~/{}'.format(
                 enter_deploy, DEFAULT_DEPLOYMENT_FILENAME))
 
-        time.sleep(20)
+        if self.dbms == "postgresql":
+            wait_for_all(worker_nodes, self.postgres_probes,
+                         self.ready_timeout)
 
         log.info('Begin Myria cluster launch on {}'.format(master.alias))
         master.ssh.execute(
             '{} && sudo ./launch_cluster.sh ~/{}'.format(
                 enter_deploy, DEFAULT_DEPLOYMENT_FILENAME))
 
-        self.configure_python(master, DEFAULT_PYTHON_REPOSITORY_URL)
-        self.configure_web(master,
-                           DEFAULT_APPENGINE_URL,
-                           DEFAULT_WEB_REPOSITORY_URL)
+        worker_count = sum(len(self.workers_on(node))
+                           for node in worker_nodes)
+        wait_for_all(nodes,
+                     lambda node: self.myria_probes(node, worker_count),
+                     self.ready_timeout)
+
+    def distribute(self, master, nodes):
+        """
+        Lay out the deployed tree on the master, then fan it out to the
+        workers so that setup_cluster.py finds it in place during launch
+        and only sends what differs (the per-worker catalogs)
+        """
+        self.rewrite_deployment_section(master, 'workers', [],
+                                        MASTER_DEPLOYMENT_FILENAME)
+        master.ssh.execute('cd {} && sudo ./setup_cluster.py ~/{}'.format(
+            self.deploy_dir, MASTER_DEPLOYMENT_FILENAME))
+        bundle = distribution.Bundle.create(
+            master, self.path,
+            excludes=distribution.DEFAULT_EXCLUDES + LOCAL_DEPLOYMENT_FILES)
+        distribution.distribute(master, nodes, bundle, self.path,
+                                tree=self.distribution == 'tree')
+
+    def fingerprint(self, master):
+        """ Fingerprint of everything a prebaked image would contain """
+        self.resolved_commit = BuildCache.resolve_remote_commit(
+            master, self.repository, self.myria_commit)
+        if not self.resolved_commit:
+            return None
+
+        return imagebake.fingerprint({
+            'packages': sorted(self.packages),
+            'jvm': self.jvm_version,
+            'repository': self.repository,
+            'commit': self.resolved_commit,
+            'build': DEFAULT_BUILD_TASKS,
+            'dbms': self.dbms,
+            'postgres': {'version': self.postgres['version'],
+                         'port': self.postgres['port'],
+                         'path': self.postgres['path']},
+            'python': DEFAULT_PYTHON_REPOSITORY_URL})
+
+    def bake(self, master, fingerprint):
+        imagebake.record(master, 'myria', fingerprint)
+        imagebake.bake(master, self.bake_image)
+
+    def build(self, master):
+        options = {'repository': self.repository,
+                   'tasks': DEFAULT_BUILD_TASKS,
+                   'jvm': self.jvm_version}
+        key = None
+
+        if self.build_cache:
+            commit = self.resolved_commit or BuildCache.resolve_remote_commit(
+                master, self.repository, self.myria_commit)
+            key = BuildCache.key(commit, options)
+            if self.build_cache.contains(master, key):
+                log.info('Build cache hit for commit {}'.format(commit))
+                self.build_cache.restore(master, key, self.directory)
+                return
 
-        log.info('End Myria configuration')
+        log.info('Begin repository clone on {}'.format(master.alias))
+        master.ssh.execute(
+            'rm -rf {dir} ; git clone {} {dir}'.format(
+                self.repository, dir=self.directory))
+        log.info("commit version: {}".format(self.myria_commit))
+        if self.myria_commit:
+            master.ssh.execute(
+                'cd {dir} && git checkout {commit}'.format(
+                    dir=self.directory, commit=self.myria_commit))
 
-    def create_configuration(self, master, nodes):
-        log.info('{deploy_dir}/create_deployment.py '
-            '--rest-port {rest_port} '
-            '--name {database_name} '
-            '--database-type {dbms} '
-            '--database-port {database_port} '
-            '--database-password {password} '
-            '--coordinator-port {coordinator_port} '
-            '--worker-base-port {worker_port} '
-            '--jvm-max-heap-size-gb "{heap}" '
-            '{path} {coordinator} {workers} > {deployment_filename}'.format(
-              deploy_dir=self.deploy_dir,
-              rest_port=self.rest_port,
-              dbms=self.dbms,
-              database_name=self.database_name,
-              database_port=self.postgres.get('port',
-                                              DEFAULT_MYRIA_POSTGRES_PORT),
-              password=self.postgres.get('password', '""'),
-              coordinator_port=self.master_port,
-              worker_port=self.worker_port,
-              heap=self.heap if self.heap else DEFAULT_HEAP_SIZE,
-              path=self.path,
-              coordinator=master.dns_name,
-              workers=' '.join(node.dns_name for node in nodes),
-              deployment_filename=DEFAULT_DEPLOYMENT_FILENAME))
+        if self.build_cache and not key:
+            # Abbreviated or otherwise unresolvable reference; retry locally
+            commit = BuildCache.resolve_local_commit(master, self.directory)
+            key = BuildCache.key(commit, options)
+            if self.build_cache.contains(master, key):
+                log.info('Build cache hit for commit {}'.format(commit))
+                self.build_cache.restore(master, key, self.directory)
+                return
 
-        master.ssh.execute(
+        log.info('Begin build on {}'.format(master.alias))
+        for task in DEFAULT_BUILD_TASKS:
+            master.ssh.execute('cd {} && ./gradlew {}'.format(
+                self.directory, task))
+
+        if self.build_cache and key:
+            self.build_cache.store(master, key, self.directory)
+
+    def size_workers(self, nodes):
+        hardware = map_nodes(
+            lambda node: pgtuning.read_hardware(node, self.path), nodes)
+        hosts = dict((node.alias, node.dns_name) for node in nodes)
+        heap = workersizing.heap_gb(self.heap, None)
+        self.heap, self.worker_plan = workersizing.plan_workers(
+            hosts, hardware, self.dbms, self.worker_port,
+            self.database_name, heap)
+
+        for node in nodes:
+            log.info('{}: {} workers with {}GB heaps ({}MB, {} cores)'.format(
+                node.alias, len(self.worker_plan[node.alias]), self.heap,
+                hardware[node.alias]['memory_mb'],
+                hardware[node.alias]['cores']))
+
+    def workers_on(self, node):
+        if self.worker_plan is not None:
+            return self.worker_plan.get(node.alias, [])
+        if node.is_master():
+            return []
+        return [workersizing.Worker(node.dns_name, int(self.worker_port),
+                                    self.database_name)]
+
+    def databases_on(self, node):
+        return [worker.database for worker in self.workers_on(node)] or \
+            [self.database_name]
+
+    def heap_size(self):
+        """ Whole gigabytes, as the deployment file and -Xmx<N>g need """
+        return max(int(workersizing.heap_gb(self.heap, DEFAULT_HEAP_SIZE)),
+                   workersizing.MINIMUM_HEAP_GB)
+
+    def jvm_options(self, role):
+        extra = self.extra_jvm_options[role]
+        if not self.jvm_tuning:
+            return extra.split() if extra else []
+        return jvmoptions.jvm_options(
+            role, self.heap_size(), self.path, self.gc_pause_ms,
+            self.gc_logging,
+            self.jvm_profiling if role == 'worker' else None,
+            self.jvm_large_pages, extra)
+
+    def configure_runtime(self, master):
+        """ Carry the JVM options into the deployment's [runtime] """
+        if self.jvm_tuning and self.jvm_profiling:
+            jvmoptions.check_profiler(self.jvm_profiling, master.ssh.execute(
+                jvmoptions.JAVA_VERSION_COMMAND, ignore_exit_status=True))
+        options = dict((role, self.jvm_options(role))
+                       for role in jvmoptions.ROLES)
+        if not any(options.values()):
+            return
+        for role, flags in sorted(options.items()):
+            log.info('JVM options for the {}: {}'.format(role,
+                                                          ' '.join(flags)))
+        self.rewrite_deployment_section(
+            master, 'runtime', jvmoptions.runtime_entries(
+                self.deployment_section(master, 'runtime'), options))
+
+    def reserved_memory(self, node):
+        """ Megabytes of memory used by Myria JVMs on the node """
+        return int(self.heap_size() * 1024 *
+                   max(len(self.workers_on(node)), 1))
+
+    def postgres_probes(self, node):
+        version = self.postgres['version']
+        return [PostgresProbe(self.postgres['port'],
+                              self.postgres['path'].format(version=version))]
+
+    def myria_probes(self, node, worker_count):
+        if node.is_master():
+            return [TcpProbe(self.master_port),
+                    TcpProbe(self.rest_port),
+                    HttpProbe('http://localhost:{}{}'.format(
+                        self.rest_port, WORKERS_ALIVE_ENDPOINT),
+                        workers_alive(worker_count))]
+        return [TcpProbe(worker.port) for worker in self.workers_on(node)]
+
+    def create_configuration(self, master, nodes):
+        command = (
             '{deploy_dir}/create_deployment.py '
             '--rest-port {rest_port} '
             '--name {database_name} '
@@ -197,17 +803,58 @@ class MyriaInstaller(DefaultClusterSetup):
               rest_port=self.rest_port,
               dbms=self.dbms,
               database_name=self.database_name,
-              database_port=self.postgres.get('port',
+              database_port=self.postgres.get('pool_port') or
+                            self.postgres.get('port',
                                               DEFAULT_MYRIA_POSTGRES_PORT),
               password=self.postgres.get('password', '""'),
               coordinator_port=self.master_port,
               worker_port=self.worker_port,
-              heap=self.heap if self.heap else DEFAULT_HEAP_SIZE,
+              heap=self.heap_size(),
               path=self.path,
               coordinator=master.dns_name,
               workers=' '.join(node.dns_name for node in nodes),
               deployment_filename=DEFAULT_DEPLOYMENT_FILENAME))
 
+        log.info(command)
+        master.ssh.execute(command)
+
+        if self.worker_plan is not None:
+            workers = [worker for node in nodes
+                       for worker in self.workers_on(node)]
+            self.rewrite_deployment_section(master, 'workers', [
+                '{} = {}:{}:{}:{}'.format(index, worker.host, worker.port,
+                                          self.path, worker.database)
+                for index, worker in enumerate(workers, 1)])
+        self.configure_runtime(master)
+
+    @staticmethod
+    def rewrite_deployment_section(master, section, entries,
+                                   target=DEFAULT_DEPLOYMENT_FILENAME):
+        """
+        Replace the body of one [section] of the deployment file, writing
+        the result to `target`
+        """
+        with master.ssh.remote_file(DEFAULT_DEPLOYMENT_FILENAME, 'r') as f:
+            lines = f.read().splitlines()
+
+        header = '[{}]'.format(section)
+        output, skipping, found = [], False, False
+        for line in lines:
+            if line.strip().startswith('['):
+                skipping = line.strip() == header
+                if skipping:
+                    found = True
+                    output.append(header)
+                    output.extend(entries)
+                    continue
+            if not skipping:
+                output.append(line)
+        if not found:
+            output.extend([header] + entries)
+
+        with master.ssh.remote_file(target, 'w') as f:
+            f.write('\n'.join(output) + '\n')
+
     def configure_web(self, node, appengine_url, repository_url):
         log.info('Begin installing Myria-Web on %s', node.alias)
 
@@ -239,13 +886,48 @@ class MyriaInstaller(DefaultClusterSetup):
           r'''sed -i "s/hostname='localhost'/hostname='{hostname}'/" {path}'''
             .format(hostname=node.dns_name, path=DEFAULT_HOSTNAME_CONFIG_PATH))
 
+        if self.web_server == 'wsgi':
+            self.configure_wsgi(node)
+        else:
+            log.info('Create myria-web service and launch')
+            node.ssh.execute('echo {} > /etc/init/myria-web.conf'.format(
+                MYRIA_WEB_SERVICE_CONFIG.format(hostname=node.dns_name)))
+            self.web_restart(node)
+
+        log.info('Done installing Myria-Web on %s', node.alias)
+
+    def configure_wsgi(self, node):
+        log.info('Serve Myria-Web from gunicorn ({} workers, {} threads) '
+                 'behind nginx'.format(self.web_workers, self.web_threads))
+        batch = CommandBatch(node)
+        batch.add('Update package lists', update_once_command())
+        batch.add('Install nginx', apt_install('nginx python-pip'))
+        # --threads selects the gthread worker, which on Python 2 needs the
+        # concurrent.futures backport
+        batch.add('Install gunicorn',
+                  "pip install 'gunicorn>=19,<20' 'futures>=3,<4'")
+        batch.run()
+
+        with node.ssh.remote_file(MYRIA_WEB_WSGI_PATH, 'w') as f:
+            f.write(MYRIA_WEB_WSGI_MODULE)
+        with node.ssh.remote_file(MYRIA_WEB_NGINX_PATH, 'w') as f:
+            f.write(MYRIA_WEB_NGINX_CONFIG.format(
+                hostname=node.dns_name,
+                port=DEFAULT_WEB_APPLICATION_PORT,
+                expiry=DEFAULT_WEB_STATIC_EXPIRY))
+
         log.info('Create myria-web service and launch')
         node.ssh.execute('echo {} > /etc/init/myria-web.conf'.format(
-            MYRIA_WEB_SERVICE_CONFIG.format(hostname=node.dns_name)))
+            MYRIA_WEB_WSGI_SERVICE_CONFIG.format(
+                workers=self.web_workers, threads=self.web_threads,
+                port=DEFAULT_WEB_APPLICATION_PORT)))
+        node.ssh.execute(
+            'rm -f /etc/nginx/sites-enabled/default && '
+            'ln -sf {} /etc/nginx/sites-enabled/myria-web && '
+            'nginx -t && sudo service nginx restart'.format(
+                MYRIA_WEB_NGINX_PATH))
         self.web_restart(node)
 
-        log.info('Done installing Myria-Web on %s', node.alias)
-
     def configure_python(self, node, repository_url):
         log.info('Installing Myria-Python on %s', node.alias)
         node.ssh.execute(
@@ -256,8 +938,12 @@ class MyriaInstaller(DefaultClusterSetup):
                                              repository=repository_url))
         log.info('Done installing Myria-Python on %s', node.alias)
 
-    def configure_postgres(self, node):
-        database = self.database_name
+    def tune_node(self, node):
+        # Myria is launched through sudo, so its processes run as root
+        nodetuning.tune(node, self.node_tuning, 'root',
+                        self.node_tuning_dry_run)
+
+    def configure_postgres(self, node, batch=None):
         username = self.postgres['username']
         password = self.postgres['password']
         version = self.postgres['version']
@@ -268,14 +954,33 @@ class MyriaInstaller(DefaultClusterSetup):
             log.info("WARNING: Myria requires a postgres user named 'uwdb'")
 
         log.info('Begin Postgres configuration on {}'.format(node.alias))
-        PostgresInstaller.create_user(node, username, password, path, port)
-        PostgresInstaller.create_database(node, database, path, port)
-        PostgresInstaller.grant_all(node, database, username, path, port)
-        PostgresInstaller.set_listeners(node, '*', version=version)
-        PostgresInstaller.add_host_authentication(node,
-                                                  'host all all 0.0.0.0/0 md5',
-                                                  version=version)
-        PostgresInstaller.restart(node)
+        commands = batch if batch is not None else CommandBatch(node)
+        commands.add('Create user', PostgresInstaller.create_user_command(
+            username, password, path, port))
+        commands.add('Set password', PostgresInstaller.set_password_command(
+            username, password, path, port))
+        if self.postgres['pool_port']:
+            commands.add('Export users to pgbouncer',
+                         pgbouncer.userlist_command(path, port))
+        for database in self.databases_on(node):
+            commands.add('Create database',
+                         PostgresInstaller.create_database_command(
+                             database, path, port))
+            commands.add('Grant privileges',
+                         PostgresInstaller.grant_all_command(
+                             database, username, path, port))
+        commands.add('Set listeners', PostgresInstaller.set_listeners_command(
+            '*', version=version))
+        commands.add('Add host authentication',
+                     PostgresInstaller.add_host_authentication_command(
+                         'host all all 0.0.0.0/0 md5', version=version))
+        if self.postgres_tuning:
+            commands.extend('Tune postgres', PostgresInstaller.tuning_commands(
+                node, self.reserved_memory(node), DEFAULT_DATA_PATH, version))
+        commands.add('Restart postgres', PostgresInstaller.RESTART_COMMAND)
+
+        if batch is None:
+            commands.run()
 
     @staticmethod
     def web_start(node):
@@ -0,0 +1,158 @@
+"""
+Named kernel, network and limits profiles for Myria nodes.
+
+Workers exchange large volumes over TCP during shuffles and write heavily
+during ingest, neither of which the distribution defaults are sized for.
+A profile is applied live and persisted (sysctl.d, limits.d and rc.local
+for transparent huge pages, which have no sysctl), then read back so that
+settings the kernel rejected or clamped are reported.
+"""
+from collections import OrderedDict
+from remotebatch import CommandBatch
+from starcluster.logger import log
+
+SYSCTL_PATH = '/etc/sysctl.d/40-myria-node.conf'
+LIMITS_PATH = '/etc/security/limits.d/40-myria.conf'
+THP_PATHS = ['/sys/kernel/mm/transparent_hugepage/enabled',
+             '/sys/kernel/mm/transparent_hugepage/defrag']
+RC_LOCAL_PATH = '/etc/rc.local'
+
+_COMMON = OrderedDict([
+    ('vm.swappiness', 1),
+    ('fs.file-max', 2097152),
+    ('net.core.somaxconn', 4096),
+    ('net.ipv4.tcp_max_syn_backlog', 8192),
+    ('net.ipv4.ip_local_port_range', '10240 65000'),
+    ('net.ipv4.tcp_tw_reuse', 1)])
+
+PROFILES = {
+    # Large socket buffers and backlogs for all-to-all exchange on the
+    # worker port range; modest dirty thresholds keep writeback smooth
+    'shuffle-heavy': {
+        'sysctl': OrderedDict(_COMMON.items() + [
+            ('net.core.rmem_max', 16777216),
+            ('net.core.wmem_max', 16777216),
+            ('net.core.netdev_max_backlog', 30000),
+            ('net.ipv4.tcp_rmem', '4096 87380 16777216'),
+            ('net.ipv4.tcp_wmem', '4096 65536 16777216'),
+            ('net.ipv4.tcp_slow_start_after_idle', 0),
+            ('vm.dirty_background_ratio', 5),
+            ('vm.dirty_ratio', 10)]),
+        'nofile': 131072,
+        'transparent_hugepage': 'never'},
+    # Start writeback early and let more dirty data accumulate before
+    # writers block, favouring sustained sequential writes
+    'ingest-heavy': {
+        'sysctl': OrderedDict(_COMMON.items() + [
+            ('net.core.rmem_max', 8388608),
+            ('net.core.wmem_max', 8388608),
+            ('net.ipv4.tcp_rmem', '4096 87380 8388608'),
+            ('net.ipv4.tcp_wmem', '4096 65536 8388608'),
+            ('vm.dirty_background_ratio', 10),
+            ('vm.dirty_ratio', 40),
+            ('vm.dirty_expire_centisecs', 3000)]),
+        'nofile': 65536,
+        'transparent_hugepage': 'never'},
+}
+
+
+def profile(name):
+    if name not in PROFILES:
+        raise ValueError('Unknown node tuning profile {} (expected one of '
+                         '{})'.format(name, ', '.join(sorted(PROFILES))))
+    return PROFILES[name]
+
+
+def _normalise(value):
+    return ' '.join(str(value).split())
+
+
+def render_sysctl(settings):
+    lines = ['# Managed by Myria-EC2; regenerated on every deployment']
+    lines += ['{} = {}'.format(key, value) for key, value in settings.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def render_limits(nofile):
+    return ''.join('{} {} nofile {}\n'.format(domain, kind, nofile)
+                   for domain in ['*', 'root']
+                   for kind in ['soft', 'hard'])
+
+
+def apply_commands(settings):
+    """ Commands that apply `settings` (a profile) now and at boot """
+    thp = '; '.join('[ ! -e {1} ] || echo {0} > {1}'.format(
+        settings['transparent_hugepage'], path) for path in THP_PATHS)
+    return [
+        "cat > {path} <<'__MYRIA_NODE__'\n{body}__MYRIA_NODE__\n"
+        "sysctl -p {path}".format(path=SYSCTL_PATH,
+                                  body=render_sysctl(settings['sysctl'])),
+        "cat > {path} <<'__MYRIA_NODE__'\n{body}__MYRIA_NODE__".format(
+            path=LIMITS_PATH, body=render_limits(settings['nofile'])),
+        thp,
+        # rc.local runs before "exit 0"; keep a single managed line
+        "sed -i '/# myria-thp$/d' {rc} && "
+        "sed -i '/^exit 0/i {thp}  # myria-thp' {rc}".format(
+            rc=RC_LOCAL_PATH, thp=thp)]
+
+
+def current_command(settings, user):
+    """ Print key=value for every setting the profile manages """
+    lines = ['echo "{0}=$(sysctl -n {0})"'.format(key)
+             for key in settings['sysctl']]
+    lines.append("echo \"nofile=$(su - {} -c 'ulimit -n')\"".format(user))
+    lines.append('echo "transparent_hugepage=$(grep -o "\\[[a-z]*\\]" {} '
+                 '| tr -d "[]")"'.format(THP_PATHS[0]))
+    return '\n'.join(lines)
+
+
+def parse_current(lines):
+    return dict((key.strip(), _normalise(value)) for key, value in
+                (line.split('=', 1) for line in lines if '=' in line))
+
+
+def differences(settings, current):
+    """ Setting -> (expected, actual) for everything not yet in effect """
+    expected = OrderedDict((key, _normalise(value))
+                           for key, value in settings['sysctl'].items())
+    expected['nofile'] = str(settings['nofile'])
+    expected['transparent_hugepage'] = settings['transparent_hugepage']
+    return OrderedDict((key, (value, current.get(key)))
+                       for key, value in expected.items()
+                       if current.get(key) != value)
+
+
+def read_current(node, settings, user):
+    return parse_current(node.ssh.execute(
+        current_command(settings, user), ignore_exit_status=True))
+
+
+def tune(node, name, user='root', dry_run=False):
+    """
+    Apply profile `name` to `node` and verify it; with `dry_run`, only log
+    what would change.  Returns the settings not in effect afterwards.
+    """
+    settings = profile(name)
+    pending = differences(settings, read_current(node, settings, user))
+    if dry_run:
+        log.info('{} tuning on {} would change: {}'.format(
+            name, node.alias, ', '.join(
+                '{} {} -> {}'.format(key, actual, expected)
+                for key, (expected, actual) in pending.items()) or 'nothing'))
+        return pending
+    if not pending:
+        log.info('{} already tuned for {}'.format(node.alias, name))
+        return pending
+
+    batch = CommandBatch(node)
+    batch.extend('Apply {} tuning'.format(name), apply_commands(settings))
+    batch.run()
+    remaining = differences(settings, read_current(node, settings, user))
+    if remaining:
+        log.warn('{} tuning did not take effect on {}: {}'.format(
+            name, node.alias, ', '.join(
+                '{} is {} (wanted {})'.format(key, actual, expected)
+                for key, (expected, actual) in remaining.items())))
+    else:
+        log.info('Applied {} tuning to {}'.format(name, node.alias))
+    return remaining
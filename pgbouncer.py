@@ -0,0 +1,82 @@
+"""
+PgBouncer connection pooling in front of each node's Postgres.
+
+Pool sizes follow the node's core count: a few server connections per core
+keep every core busy without the per-backend memory and context switching
+of one backend per client.  The bouncer authenticates with md5 against a
+user list exported from pg_shadow, refreshed once Myria's user exists.
+"""
+from collections import OrderedDict
+from remotebatch import apt_install
+
+DEFAULT_POOL_PORT = 6432
+# Transaction pooling is not offered: Myria builds its own JDBC URLs, so
+# the driver cannot be told to avoid the server-side prepared statements
+# (prepareThreshold=0) that break when a transaction changes backend
+POOL_MODES = ['session']
+CONFIG_PATH = '/etc/pgbouncer/pgbouncer.ini'
+USERLIST_PATH = '/etc/pgbouncer/userlist.txt'
+DEFAULTS_PATH = '/etc/default/pgbouncer'
+RESTART_COMMAND = 'sudo service pgbouncer restart'
+RELOAD_COMMAND = 'sudo service pgbouncer reload'
+
+SERVER_CONNECTIONS_PER_CORE = 2
+CLIENT_CONNECTIONS_PER_CORE = 50
+MINIMUM_CLIENT_CONNECTIONS = 100
+# Share of Postgres' max_connections one database pool may use
+MAXIMUM_POOL_FRACTION = 0.25
+
+
+def pool_settings(cores, mode, max_connections):
+    """ Pool sizing for a node with `cores` cores """
+    pool = SERVER_CONNECTIONS_PER_CORE * cores + 1
+    pool = max(min(pool, int(max_connections * MAXIMUM_POOL_FRACTION)), 1)
+    return OrderedDict([
+        ('pool_mode', mode),
+        ('default_pool_size', pool),
+        ('reserve_pool_size', max(cores // 2, 1)),
+        ('max_client_conn', max(CLIENT_CONNECTIONS_PER_CORE * cores,
+                                MINIMUM_CLIENT_CONNECTIONS)),
+        # Session state must not leak between clients sharing a server
+        ('server_reset_query', 'DISCARD ALL' if mode == 'session' else '')])
+
+
+def render_config(settings, listen_port, postgres_port):
+    lines = ['; Managed by Myria-EC2; regenerated on every deployment',
+             '[databases]',
+             '* = host=127.0.0.1 port={}'.format(postgres_port),
+             '',
+             '[pgbouncer]',
+             'listen_addr = *',
+             'listen_port = {}'.format(listen_port),
+             'unix_socket_dir = /var/run/postgresql',
+             'auth_type = md5',
+             'auth_file = {}'.format(USERLIST_PATH),
+             'logfile = /var/log/postgresql/pgbouncer.log',
+             'pidfile = /var/run/postgresql/pgbouncer.pid',
+             # Sent by the Postgres JDBC driver on connect
+             'ignore_startup_parameters = extra_float_digits']
+    lines += ['{} = {}'.format(key, value) for key, value in settings.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def install_commands(settings, listen_port, postgres_port):
+    return [
+        apt_install('pgbouncer'),
+        "cat > {path} <<'__MYRIA_PGBOUNCER__'\n{body}__MYRIA_PGBOUNCER__"
+        .format(path=CONFIG_PATH,
+                body=render_config(settings, listen_port, postgres_port)),
+        'touch {0} && chown postgres:postgres {0} && chmod 600 {0}'.format(
+            USERLIST_PATH),
+        "sed -i 's/^START=0/START=1/' {}".format(DEFAULTS_PATH),
+        RESTART_COMMAND]
+
+
+def userlist_command(path, port):
+    """ Export Postgres' md5 password hashes for the bouncer and reload """
+    return (
+        'sudo -u postgres {path}/psql -p {port} -Atc '
+        '"SELECT \'\\"\' || usename || \'\\" \\"\' || passwd || \'\\"\' '
+        'FROM pg_shadow WHERE passwd IS NOT NULL" > {userlist} && '
+        '{reload}').format(path=path, port=port, userlist=USERLIST_PATH,
+                           reload=RELOAD_COMMAND)
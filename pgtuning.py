@@ -0,0 +1,133 @@
+"""
+Hardware-aware PostgreSQL settings for Myria workers.
+
+`compute_tuning` is a pure function of a node's memory, cores and disks
+(and the server version) so that the sizing rules can be checked for any
+instance shape; the remaining helpers gather that hardware description
+over SSH and render the settings as a managed include file.
+"""
+from collections import OrderedDict
+
+TUNING_FILENAME = 'myria-tuning.conf'
+SHM_SYSCTL_PATH = '/etc/sysctl.d/30-myria-postgresql-shm.conf'
+PAGE_SIZE = 4096
+
+DEFAULT_MAX_CONNECTIONS = 100
+OPERATING_SYSTEM_MB = 512
+MINIMUM_SHARED_BUFFERS_MB = 32
+MAXIMUM_SHARED_BUFFERS_MB = 8192
+MINIMUM_WORK_MEM_MB = 4
+MAXIMUM_WORK_MEM_MB = 512
+MINIMUM_MAINTENANCE_WORK_MEM_MB = 64
+MAXIMUM_MAINTENANCE_WORK_MEM_MB = 2048
+# 9.5 replaced checkpoint_segments with max_wal_size
+MAX_WAL_SIZE_VERSION = (9, 5)
+WAL_SEGMENT_MB = 16
+
+HARDWARE_COMMAND = r"""
+echo memory_kb=$(awk '/MemTotal/ {{print $2}}' /proc/meminfo)
+echo cores=$(nproc)
+echo disks=$(lsblk -dn -o TYPE | grep -c disk)
+p={path}; while [ ! -e $p ]; do p=$(dirname $p); done
+dev=$(basename $(df -P $p | awk 'NR==2 {{print $1}}'))
+[ -e /sys/block/$dev ] || dev=${{dev%%[0-9]*}}
+echo rotational=$(cat /sys/block/$dev/queue/rotational 2>/dev/null || echo 1)
+"""
+
+
+def hardware_command(data_path):
+    return HARDWARE_COMMAND.format(path=data_path).strip()
+
+
+def parse_hardware(lines):
+    values = dict(line.strip().split('=', 1) for line in lines
+                  if '=' in line)
+    return {'memory_mb': int(values.get('memory_kb', 0)) // 1024,
+            'cores': max(int(values.get('cores', 1)), 1),
+            'disks': max(int(values.get('disks', 1)), 1),
+            'rotational': values.get('rotational', '1').strip() != '0'}
+
+
+def read_hardware(node, data_path):
+    return parse_hardware(node.ssh.execute(hardware_command(data_path)))
+
+
+def _clamp(value, minimum, maximum):
+    return int(max(minimum, min(maximum, value)))
+
+
+def version_tuple(version):
+    return tuple(int(part) for part in str(version).split('.')[:2])
+
+
+def compute_tuning(hardware, reserved_mb=0,
+                   max_connections=DEFAULT_MAX_CONNECTIONS, version=9.1):
+    """
+    Settings for a node described by `hardware` (see `parse_hardware`) after
+    setting aside `reserved_mb` for the Myria JVM heap(s) on that node, for
+    PostgreSQL `version`.
+    Returns an ordered mapping of postgresql.conf settings and the kernel
+    shared memory limits needed to honour them.
+    """
+    available = max(hardware['memory_mb'] - reserved_mb - OPERATING_SYSTEM_MB,
+                    MINIMUM_SHARED_BUFFERS_MB * 4)
+
+    shared_buffers = _clamp(available // 4, MINIMUM_SHARED_BUFFERS_MB,
+                            MAXIMUM_SHARED_BUFFERS_MB)
+    effective_cache_size = max(available * 3 // 4, shared_buffers)
+    work_mem = _clamp((available - shared_buffers) //
+                      max(max_connections // 4, hardware['cores']),
+                      MINIMUM_WORK_MEM_MB, MAXIMUM_WORK_MEM_MB)
+    maintenance_work_mem = _clamp(available // 16,
+                                  MINIMUM_MAINTENANCE_WORK_MEM_MB,
+                                  MAXIMUM_MAINTENANCE_WORK_MEM_MB)
+    checkpoint_segments = 64 if available >= 8192 else 32
+    if version_tuple(version) >= MAX_WAL_SIZE_VERSION:
+        # The same WAL volume: three checkpoints' worth of segments
+        wal = ('max_wal_size', '{}MB'.format(
+            3 * checkpoint_segments * WAL_SEGMENT_MB))
+    else:
+        wal = ('checkpoint_segments', checkpoint_segments)
+
+    settings = OrderedDict([
+        ('max_connections', max_connections),
+        ('shared_buffers', '{}MB'.format(shared_buffers)),
+        ('effective_cache_size', '{}MB'.format(effective_cache_size)),
+        ('work_mem', '{}MB'.format(work_mem)),
+        ('maintenance_work_mem', '{}MB'.format(maintenance_work_mem)),
+        ('wal_buffers', '16MB'),
+        wal,
+        ('checkpoint_completion_target', 0.9),
+        ('checkpoint_timeout', "'15min'"),
+        ('random_page_cost', 4.0 if hardware['rotational'] else 1.1),
+        ('effective_io_concurrency',
+         hardware['disks'] * (1 if hardware['rotational'] else 4)),
+    ])
+    # 9.1 allocates shared memory through System V; leave headroom for
+    # lock tables and connection state beyond shared_buffers
+    shmmax = (shared_buffers + 64 + max_connections // 4) * 1024 * 1024 \
+        * 5 // 4
+    kernel = OrderedDict([('kernel.shmmax', shmmax),
+                          ('kernel.shmall', shmmax // PAGE_SIZE)])
+    return settings, kernel
+
+
+def render_settings(settings):
+    lines = ['# Managed by Myria-EC2; regenerated on every deployment']
+    lines += ['{} = {}'.format(key, value) for key, value in settings.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def tuning_commands(settings, kernel, config_directory):
+    """ Commands that install the include file and kernel limits """
+    include = "include '{}'".format(TUNING_FILENAME)
+    config = '{}/postgresql.conf'.format(config_directory)
+    return [
+        "cat > {path} <<'__MYRIA_TUNING__'\n{body}__MYRIA_TUNING__".format(
+            path='{}/{}'.format(config_directory, TUNING_FILENAME),
+            body=render_settings(settings)),
+        'grep -qxF "{include}" {config} || echo "{include}" >> {config}'
+        .format(include=include, config=config),
+        "cat > {path} <<'__MYRIA_TUNING__'\n{body}__MYRIA_TUNING__\n"
+        "sudo sysctl -p {path}".format(
+            path=SHM_SYSCTL_PATH, body=render_settings(kernel))]
@@ -1,4 +1,13 @@
-import time
+import os
+from engine import Engine, DEFAULT_CONCURRENCY
+from readiness import wait_for, PostgresProbe
+import imagebake
+import pgbouncer
+import pgtuning
+import storage
+import tracing
+from aptcache import PackageCache, update_once_command, DEFAULT_PROXY_PORT
+from remotebatch import CommandBatch, apt_install
 from starcluster.clustersetup import DefaultClusterSetup
 from starcluster.logger import log
 
@@ -7,20 +16,58 @@ DEFAULT_PORT = 5432
 DEFAULT_DATA_PATH = '/mnt/postgresdata'
 DEFAULT_PATH_FORMAT = '/usr/lib/postgresql/{version}/bin'
 DEFAULT_PATH = DEFAULT_PATH_FORMAT.format(version=DEFAULT_VERSION)
+DEFAULT_CONFIG_DIRECTORY_FORMAT = '/etc/postgresql/{version}/main'
+DEFAULT_RESERVED_MEMORY = 2
 
 
 class PostgresInstaller(DefaultClusterSetup):
+    START_COMMAND = 'sudo service postgresql start'
+    STOP_COMMAND = 'sudo service postgresql stop'
+    RESTART_COMMAND = 'sudo service postgresql restart'
+
     def __init__(self,
                  port=DEFAULT_PORT,
                  version=DEFAULT_VERSION,
                  database_path=DEFAULT_DATA_PATH,
-                 install_on_master=True):
+                 install_on_master=True,
+                 package_cache=None,
+                 package_cache_port=DEFAULT_PROXY_PORT,
+                 tuning=None,
+                 reserved_memory=DEFAULT_RESERVED_MEMORY,
+                 storage_layout=None,
+                 wal=None,
+                 trace=None,
+                 pooling=None,
+                 pool_port=pgbouncer.DEFAULT_POOL_PORT,
+                 concurrency=DEFAULT_CONCURRENCY,
+                 node_timeout=None,
+                 command_timeout=None):
         super(PostgresInstaller, self).__init__()
 
         self.port = port
         self.version = version
         self.database_path = database_path
         self.install_on_master = install_on_master
+        self.package_cache = PackageCache(package_cache_port) \
+            if package_cache == 'proxy' else None
+        self.package_cache_host = None
+        self.tuning = tuning == 'auto'
+        self.reserved_memory = float(reserved_memory)
+        self.storage = storage_layout == 'stripe'
+        self.split_wal = wal == 'split'
+        self.volume_devices = []
+        self.trace = trace
+        self.tracer = tracing.tracer(trace)
+        if pooling and pooling not in pgbouncer.POOL_MODES:
+            raise ValueError('Unsupported pooling mode {}; choose from {}'
+                             .format(pooling, ', '.join(pgbouncer.POOL_MODES)))
+        self.pooling = pooling or None
+        self.pool_port = int(pool_port)
+        self.engine = Engine(concurrency, node_timeout, command_timeout)
+        self.fingerprint = imagebake.fingerprint(
+            {'package': 'postgresql-{}'.format(version),
+             'port': port,
+             'database_path': database_path})
 
         # Generated properties
         self.log = "{}/server.log".format(database_path)
@@ -29,125 +76,304 @@ class PostgresInstaller(DefaultClusterSetup):
         self.options = "-c config_file={} -p {}".format(self.conf, port)
 
     def _set_up_node(self, node):
+        with self.tracer.span('postgres:{}'.format(node.alias), 'postgres',
+                              node.alias):
+            self._configure_node(node)
+
+    def _configure_node(self, node):
         log.info("Begin configuration {}".format(node.alias))
 
-        if not node.is_master() or self.install_on_master:
+        batch = CommandBatch(node)
+        storage_plan = self.add_storage(node, batch)
+        wal = storage_plan.wal_mount if storage_plan else None
+
+        prebaked = imagebake.is_prebaked(node, 'postgres', self.fingerprint)
+        if prebaked:
+            log.info("Postgres already installed on {}".format(node.alias))
+            # Instance storage is not captured in the image; reseed it
+            batch.add('Restore data path',
+                      self.restore_data_path_command(
+                          data_path=self.database_path,
+                          version=self.version))
+            self.add_wal_relocation(batch, wal)
+            self.add_tuning(node, batch)
+            batch.add('Start postgres', self.start_command())
+            self.add_pooling(node, batch)
+        elif not node.is_master() or self.install_on_master:
             log.info("Setting up postgres on {}".format(node.alias))
 
-            node.ssh.execute('sudo add-apt-repository -r "deb '
-                             'http://www.cs.wisc.edu/condor/debian/development'
-                             ' lenny contrib"')
-            node.apt_command('update')
-            node.apt_install("postgresql-{}".format(self.version))
+            batch.add('Remove condor source',
+                      'sudo add-apt-repository -r "deb '
+                      'http://www.cs.wisc.edu/condor/debian/development'
+                      ' lenny contrib"')
+            if self.package_cache:
+                self.package_cache.configure_client(batch,
+                                                    self.package_cache_host)
+            batch.add('Update package lists', update_once_command())
+            batch.add('Install postgres',
+                      apt_install("postgresql-{}".format(self.version)))
+            batch.add('Set port',
+                      self.set_port_command(self.port, version=self.version))
+            batch.extend('Set data path',
+                         self.set_data_path_commands(
+                             data_path=self.database_path,
+                             version=self.version,
+                             restart=False))
+            self.add_wal_relocation(batch, wal)
+            self.add_tuning(node, batch)
+            batch.add('Start postgres', self.start_command())
+            self.add_pooling(node, batch)
+
+        with self.tracer.span('install', node=node.alias):
+            batch.run()
+
+        if prebaked or not node.is_master() or self.install_on_master:
+            with self.tracer.span('ready', node=node.alias):
+                wait_for(node, [PostgresProbe(self.port, self.path)])
+        if storage_plan:
+            with self.tracer.span('throughput', node=node.alias):
+                storage.measure_throughput(node, storage_plan.mount)
+
+        if node.is_master() and (prebaked or self.install_on_master):
+            imagebake.record(node, 'postgres', self.fingerprint)
 
-            self.set_port(node, self.port, version=self.version)
-            self.set_data_path(node,
-                               data_path=self.database_path,
-                               version=self.version,
-                               restart=False)
-
-            start_pg = ('sudo -u postgres {pg_path}/pg_ctl '
-                        '-D {data} -o "{opt}" -l {log} start;').format(
-                            pg_path=self.path, data=self.database_path,
-                            opt=self.options, log=self.log)
-            node.ssh.execute(start_pg)
+        log.info("End configuration {}".format(node.alias))
 
-            # sleep 5 seconds wait for postgres start
-            time.sleep(5)
+    def add_storage(self, node, batch):
+        """ Stripe the node's instance-store disks; returns the plan """
+        if not self.storage:
+            return None
+
+        devices = storage.detect(node, self.volume_devices)
+        plan = storage.plan_storage(devices, split_wal=self.split_wal)
+        if plan is None:
+            log.info('{} has {} instance-store devices; not striping'.format(
+                node.alias, len(devices)))
+            return None
+
+        log.info('Striping {} on {}{}'.format(
+            ', '.join(device.name for device in plan.data), node.alias,
+            ' with WAL on {}'.format(plan.wal.name) if plan.wal else ''))
+        batch.add('Update package lists', update_once_command())
+        batch.extend('Stripe instance storage',
+                     storage.layout_commands(plan))
+        return plan
+
+    def add_wal_relocation(self, batch, wal_mount):
+        if wal_mount:
+            batch.add('Relocate WAL', '{} ; {}'.format(
+                self.STOP_COMMAND,
+                storage.relocate_wal_command(self.database_path, wal_mount,
+                                             self.version)))
+
+    def add_tuning(self, node, batch):
+        if self.tuning:
+            batch.extend('Tune postgres', self.tuning_commands(
+                node, int(self.reserved_memory * 1024),
+                self.database_path, self.version))
+
+    def add_pooling(self, node, batch):
+        if not self.pooling:
+            return
+        cores = pgtuning.read_hardware(node, self.database_path)['cores']
+        settings = pgbouncer.pool_settings(
+            cores, self.pooling, pgtuning.DEFAULT_MAX_CONNECTIONS)
+        log.info('PgBouncer on {} port {}: {}'.format(
+            node.alias, self.pool_port,
+            ', '.join('{}={}'.format(key, value)
+                      for key, value in settings.items())))
+        batch.extend('Install pgbouncer', pgbouncer.install_commands(
+            settings, self.pool_port, self.port))
 
-        log.info("End configuration {}".format(node.alias))
+    @staticmethod
+    def tuning_commands(node, reserved_mb,
+                        data_path=DEFAULT_DATA_PATH,
+                        version=DEFAULT_VERSION):
+        hardware = pgtuning.read_hardware(node, data_path)
+        settings, kernel = pgtuning.compute_tuning(hardware, reserved_mb,
+                                                   version=version)
+        log.info('Postgres tuning for {} ({}MB, {} cores, {} disks): {}'
+                 .format(node.alias, hardware['memory_mb'],
+                         hardware['cores'], hardware['disks'],
+                         ', '.join('{}={}'.format(key, value)
+                                   for key, value in settings.items())))
+        return pgtuning.tuning_commands(
+            settings, kernel,
+            DEFAULT_CONFIG_DIRECTORY_FORMAT.format(version=version))
+
+    def start_command(self):
+        return ('sudo -u postgres {pg_path}/pg_ctl '
+                '-D {data} -o "{opt}" -l {log} start;').format(
+                    pg_path=self.path, data=self.database_path,
+                    opt=self.options, log=self.log)
 
     def run(self, nodes, master, user, user_shell, volumes):
         log.info('Beginning Postgres configuration')
+        nodes = self.tracer.nodes(nodes)
+        master = self.tracer.node(master)
+        self.volume_devices = storage.volume_devices(volumes)
+
+        if self.package_cache:
+            self.package_cache.set_up_master(master)
+            self.package_cache_host = master.private_ip_address
+
+        # init java and postgres in parallel; a failed or hung worker is
+        # quarantined rather than holding up the others, but the master's
+        # failure is fatal
+        self.engine.run(self._set_up_node, nodes)
+        self.engine.report()
+
+        if self.trace:
+            self.tracer.export(os.path.expanduser(self.trace))
+            self.tracer.summary()
+        if master.alias in self.engine.quarantined:
+            raise self.engine.quarantined[master.alias]
+        log.info('End Postgres configuration')
 
-        # init java and postgres in parallel
-        for node in nodes:
-            self.pool.simple_job(
-                self._set_up_node, node, jobid=node.alias)
-        self.pool.wait(len(nodes))
+    def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        self.volume_devices = storage.volume_devices(volumes)
+        if self.package_cache:
+            self.package_cache_host = master.private_ip_address
+        self.engine.quarantined.pop(node.alias, None)
+        self.engine.run(self._set_up_node, [self.tracer.node(node)])
+        if node.alias in self.engine.quarantined:
+            raise self.engine.quarantined[node.alias]
 
-        log.info('End Postgres configuration')
+    def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        pass
 
     @staticmethod
     def create_user(node, user, password,
                     path=DEFAULT_PATH, port=DEFAULT_PORT):
+        return node.ssh.execute(PostgresInstaller.create_user_command(
+            user, password, path, port))
+
+    @staticmethod
+    def create_user_command(user, password,
+                            path=DEFAULT_PATH, port=DEFAULT_PORT):
         sql = "CREATE USER {user} WITH PASSWORD \'{password}\'".format(
             user=user, password=password)
         conditional_command = """sudo -u postgres psql -tAc "SELECT 1 FROM pg_roles WHERE rolname='{user}'" | grep -q 1""".format(user=user)
         create_command = """sudo -u postgres {path}/psql -p {port} -c "{sql}" """.format(path=path, port=port, sql=sql)
         command = conditional_command + '||' + create_command
-        return PostgresInstaller._execute(node, command, path)
+        return PostgresInstaller._command(command, path)
+
+    @staticmethod
+    def set_password_command(user, password,
+                             path=DEFAULT_PATH, port=DEFAULT_PORT):
+        sql = "ALTER USER {user} WITH PASSWORD \'{password}\'".format(
+            user=user, password=password)
+        command = """sudo -u postgres {path}/psql -p {port} -c "{sql}" """.format(path=path, port=port, sql=sql)
+        return PostgresInstaller._command(command, path)
 
     @staticmethod
     def grant_all(node, name, user, path=DEFAULT_PATH, port=DEFAULT_PORT):
+        return node.ssh.execute(PostgresInstaller.grant_all_command(
+            name, user, path, port))
+
+    @staticmethod
+    def grant_all_command(name, user, path=DEFAULT_PATH, port=DEFAULT_PORT):
         sql = "GRANT ALL PRIVILEGES ON DATABASE {database} TO {user}".format(database=name, user=user)
         command = """sudo -u postgres {pg_path}/psql -p {port} -c "{sql}"
                   """.format(pg_path=path, port=port, sql=sql)
-        return PostgresInstaller._execute(node, command, path)
+        return PostgresInstaller._command(command, path)
 
     @staticmethod
     def create_database(node, name, path=DEFAULT_PATH, port=DEFAULT_PORT):
+        return node.ssh.execute(PostgresInstaller.create_database_command(
+            name, path, port))
+
+    @staticmethod
+    def create_database_command(name, path=DEFAULT_PATH, port=DEFAULT_PORT):
         conditional_command = """sudo -u postgres psql -tAc "SELECT 1 FROM pg_database WHERE datname = '{name}'" | grep -q 1""".format(name=name)
         create_command = """sudo -u postgres {pg_path}/psql -p {port} -c "CREATE DATABASE {db}" """.format(pg_path=path, port=port, db=name)
         command = conditional_command + '||' + create_command
-        return PostgresInstaller._execute(node, command, path)
+        return PostgresInstaller._command(command, path)
 
     @staticmethod
     def set_listeners(node, listeners, path='/etc/postgresql/{version}/main/postgresql.conf', version=DEFAULT_VERSION):
-        node.ssh.execute(r'sed -i "s/^\s*\#\?\s*listen_addresses\s*=\s*''.*\?''/listen_addresses = \'{listeners}\'/ig" {path}'.format(
+        node.ssh.execute(PostgresInstaller.set_listeners_command(
+            listeners, path, version))
+
+    @staticmethod
+    def set_listeners_command(listeners, path='/etc/postgresql/{version}/main/postgresql.conf', version=DEFAULT_VERSION):
+        return r'sed -i "s/^\s*\#\?\s*listen_addresses\s*=\s*''.*\?''/listen_addresses = \'{listeners}\'/ig" {path}'.format(
             listeners=listeners,
-            path=path.format(version=version)))
+            path=path.format(version=version))
 
     @staticmethod
     def set_port(node, port, path='/etc/postgresql/{version}/main/postgresql.conf', version=DEFAULT_VERSION):
-        node.ssh.execute(r'sed -i "s/^\s*port\s*=\s*[0-9]\+/port = {port}/ig" {path}'.format(
+        node.ssh.execute(PostgresInstaller.set_port_command(
+            port, path, version))
+
+    @staticmethod
+    def set_port_command(port, path='/etc/postgresql/{version}/main/postgresql.conf', version=DEFAULT_VERSION):
+        return r'sed -i "s/^\s*port\s*=\s*[0-9]\+/port = {port}/ig" {path}'.format(
             port=port,
-            path=path.format(version=version)))
+            path=path.format(version=version))
 
     @staticmethod
     def add_host_authentication(node, authentication, path='/etc/postgresql/{version}/main/pg_hba.conf', version=DEFAULT_VERSION):
         with node.ssh.remote_file(path.format(version=version), 'a') as descriptor:
             descriptor.write(authentication + '\n')
 
+    @staticmethod
+    def add_host_authentication_command(authentication, path='/etc/postgresql/{version}/main/pg_hba.conf', version=DEFAULT_VERSION):
+        return "grep -qxF '{auth}' {path} || echo '{auth}' >> {path}".format(
+            auth=authentication, path=path.format(version=version))
+
     @staticmethod
     def set_data_path(node, config_path='/etc/postgresql/{version}/main/postgresql.conf',
                             data_path=DEFAULT_DATA_PATH,
                             version=DEFAULT_VERSION,
                             restart=True):
-        PostgresInstaller.stop(node)
-
-        node.ssh.execute("sudo mkdir -m 700 -p {}".format(data_path))
-        node.ssh.execute(r"""sudo cp -rp `grep -Po "data_directory\\s*=\\s*'\K[^']*(?=')" {config_path}`/* {data_path}""".format(
-            config_path=config_path.format(version=version),
-            data_path=data_path))
-
-		# Just in case directory already existed
-        node.ssh.execute("sudo chmod 700 {}".format(data_path))
-        node.ssh.execute("sudo chown -R postgres {}".format(data_path))
-        node.ssh.execute("sudo chgrp -R postgres {}".format(data_path))
-
-        # Change data directory in .config
-        node.ssh.execute(r"""sed -i "s+^\\s*data_directory\\s*=\\s*'[^']*'+data_directory = '{data_path}'+g" {config_path}""".format(
-            data_path=data_path,
-            config_path=config_path.format(version=version)))
-
-        PostgresInstaller.start(node)
+        for command in PostgresInstaller.set_data_path_commands(
+                config_path, data_path, version, restart):
+            node.ssh.execute(command)
 
     @staticmethod
-    def restart(node):
-        node.ssh.execute('sudo service postgresql restart')
+    def set_data_path_commands(config_path='/etc/postgresql/{version}/main/postgresql.conf',
+                               data_path=DEFAULT_DATA_PATH,
+                               version=DEFAULT_VERSION,
+                               restart=True):
+        return [
+            PostgresInstaller.STOP_COMMAND,
+            "sudo mkdir -m 700 -p {}".format(data_path),
+            r"""sudo cp -rp `grep -Po "data_directory\\s*=\\s*'\K[^']*(?=')" {config_path}`/* {data_path}""".format(
+                config_path=config_path.format(version=version),
+                data_path=data_path),
+            # Just in case directory already existed
+            "sudo chmod 700 {}".format(data_path),
+            "sudo chown -R postgres {}".format(data_path),
+            "sudo chgrp -R postgres {}".format(data_path),
+            # Change data directory in .config
+            r"""sed -i "s+^\\s*data_directory\\s*=\\s*'[^']*'+data_directory = '{data_path}'+g" {config_path}""".format(
+                data_path=data_path,
+                config_path=config_path.format(version=version)),
+            PostgresInstaller.START_COMMAND]
 
     @staticmethod
     def start(node):
-        node.ssh.execute('sudo service postgresql start')
+        node.ssh.execute(PostgresInstaller.START_COMMAND)
 
     @staticmethod
     def stop(node):
-        node.ssh.execute('sudo service postgresql stop')
+        node.ssh.execute(PostgresInstaller.STOP_COMMAND)
+
+    @staticmethod
+    def restore_data_path_command(data_path=DEFAULT_DATA_PATH,
+                                  source_path='/var/lib/postgresql/{version}/main',
+                                  version=DEFAULT_VERSION):
+        return ('[ -f {data_path}/PG_VERSION ] || ('
+                'sudo mkdir -m 700 -p {data_path} && '
+                'sudo cp -rp {source_path}/* {data_path} && '
+                'sudo chown -R postgres:postgres {data_path})').format(
+                    data_path=data_path,
+                    source_path=source_path.format(version=version))
 
     @staticmethod
     def restart(node):
-        node.ssh.execute('sudo service postgresql restart')
+        node.ssh.execute(PostgresInstaller.RESTART_COMMAND)
 
     @staticmethod
     def initialize_database(node, database_path, path=DEFAULT_PATH):
@@ -156,5 +382,9 @@ class PostgresInstaller(DefaultClusterSetup):
 
     @staticmethod
     def _execute(node, command, path=DEFAULT_PATH):
+        return node.ssh.execute(PostgresInstaller._command(command, path))
+
+    @staticmethod
+    def _command(command, path=DEFAULT_PATH):
         cd = "cd {}".format(path)
-        return node.ssh.execute(';'.join([cd, command]))
+        return ';'.join([cd, command])
@@ -0,0 +1,172 @@
+import json
+import time
+import threading
+from starcluster.logger import log
+
+DEFAULT_READY_TIMEOUT = 300
+DEFAULT_INITIAL_INTERVAL = 0.5
+DEFAULT_MAXIMUM_INTERVAL = 10
+READY_TOKEN = '__MYRIA_READY__'
+
+
+class ReadinessTimeout(Exception):
+    def __init__(self, pending, timeout):
+        super(ReadinessTimeout, self).__init__(
+            'Not ready after {}s: {}'.format(
+                timeout, ', '.join(sorted(pending))))
+        self.pending = pending
+
+
+class ProbeFailed(Exception):
+    """ Probing raised something other than a timeout on some nodes """
+
+    def __init__(self, errors):
+        super(ProbeFailed, self).__init__(
+            'Unable to probe {}'.format(', '.join(
+                '{} ({})'.format(alias, error)
+                for alias, error in sorted(errors.items()))))
+        self.errors = errors
+
+
+class Probe(object):
+    """ A readiness check executed on a node over a single SSH call """
+
+    def __init__(self, description):
+        self.description = description
+
+    def command(self):
+        raise NotImplementedError
+
+    def accept(self, lines):
+        return READY_TOKEN in lines
+
+    def check(self, node):
+        lines = node.ssh.execute(
+            '( {} ) >/dev/null 2>&1 && echo {}'.format(
+                self.command(), READY_TOKEN),
+            ignore_exit_status=True)
+        return self.accept([line.strip() for line in lines])
+
+    def __str__(self):
+        return self.description
+
+
+class PostgresProbe(Probe):
+    def __init__(self, port, path):
+        super(PostgresProbe, self).__init__('postgres:{}'.format(port))
+        self.port = port
+        self.path = path
+
+    def command(self):
+        return "sudo -u postgres {}/psql -p {} -tAc 'SELECT 1'".format(
+            self.path, self.port)
+
+
+class TcpProbe(Probe):
+    def __init__(self, port, host='localhost'):
+        super(TcpProbe, self).__init__('tcp:{}:{}'.format(host, port))
+        self.host = host
+        self.port = port
+
+    def command(self):
+        return "bash -c 'exec 3<>/dev/tcp/{}/{}'".format(self.host, self.port)
+
+
+class HttpProbe(Probe):
+    """ Succeeds when the URL answers 2xx and `predicate(body)` holds """
+
+    def __init__(self, url, predicate=None):
+        super(HttpProbe, self).__init__('http:{}'.format(url))
+        self.url = url
+        self.predicate = predicate
+
+    def check(self, node):
+        lines = node.ssh.execute(
+            "curl -sf '{}' && echo && echo {}".format(self.url, READY_TOKEN),
+            ignore_exit_status=True)
+        lines = [line.strip() for line in lines]
+        if READY_TOKEN not in lines:
+            return False
+        if self.predicate is None:
+            return True
+
+        body = '\n'.join(lines[:lines.index(READY_TOKEN)])
+        try:
+            return bool(self.predicate(body))
+        except ValueError:
+            return False
+
+
+def workers_alive(count):
+    """ Predicate for the REST /workers/alive body listing `count` workers """
+    return lambda body: len(json.loads(body)) >= count
+
+
+def wait_for(node, probes, timeout=DEFAULT_READY_TIMEOUT,
+             initial_interval=DEFAULT_INITIAL_INTERVAL,
+             maximum_interval=DEFAULT_MAXIMUM_INTERVAL):
+    """
+    Poll `probes` on `node` with exponential backoff until each succeeds.
+    Returns the seconds taken, or raises ReadinessTimeout at the deadline.
+    """
+    start = time.time()
+    deadline = start + timeout
+    interval = initial_interval
+    remaining = list(probes)
+
+    while remaining:
+        remaining = [probe for probe in remaining if not probe.check(node)]
+        if not remaining:
+            break
+        if time.time() + interval > deadline:
+            raise ReadinessTimeout(
+                ['{} ({})'.format(node.alias,
+                                  ', '.join(str(p) for p in remaining))],
+                timeout)
+        time.sleep(interval)
+        interval = min(interval * 2, maximum_interval)
+
+    elapsed = time.time() - start
+    log.info('{} ready in {:.1f}s ({})'.format(
+        node.alias, elapsed, ', '.join(str(p) for p in probes)))
+    return elapsed
+
+
+def wait_for_all(nodes, probes_for, timeout=DEFAULT_READY_TIMEOUT):
+    """
+    Probe every node in parallel; `probes_for(node)` returns its probes.
+    Returns a dict of node alias to seconds until ready; raises
+    ReadinessTimeout or, when probing itself failed, ProbeFailed.
+    """
+    elapsed = {}
+    pending = {}
+    errors = {}
+
+    def probe(node):
+        try:
+            elapsed[node.alias] = wait_for(node, probes_for(node), timeout)
+        except ReadinessTimeout as e:
+            pending[node.alias] = e
+        except Exception as e:
+            log.error('Unable to probe {}: {}'.format(node.alias, e))
+            errors[node.alias] = e
+
+    threads = [threading.Thread(target=probe, args=(node,),
+                                name='ready-{}'.format(node.alias))
+               for node in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise ProbeFailed(errors)
+    if pending:
+        raise ReadinessTimeout(
+            [alias for e in pending.values() for alias in e.pending],
+            timeout)
+    if elapsed:
+        slowest = max(elapsed, key=elapsed.get)
+        log.info('All {} nodes ready; slowest {} at {:.1f}s'.format(
+            len(elapsed), slowest, elapsed[slowest]))
+    return elapsed
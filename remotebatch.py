@@ -0,0 +1,118 @@
+import re
+from collections import namedtuple
+from starcluster.logger import log
+
+STEP_MARKER = '__MYRIA_STEP__'
+SCRIPT_DELIMITER = '__MYRIA_BATCH__'
+DPKG_OPTIONS = "Dpkg::Options::='--force-confnew'"
+
+StepResult = namedtuple('StepResult',
+                        ['description', 'command', 'status', 'output'])
+
+_marker = re.compile(r'^{} (begin|end) (\d+)(?: (-?\d+))?$'.format(
+    STEP_MARKER))
+
+
+class BatchError(Exception):
+    def __init__(self, alias, step):
+        super(BatchError, self).__init__(
+            'Step "{}" failed on {} with exit status {}'.format(
+                step.description, alias, step.status))
+        self.alias = alias
+        self.step = step
+
+
+def apt_command(command):
+    """ Shell equivalent of StarCluster's Node.apt_command """
+    return ("DEBIAN_FRONTEND='noninteractive' "
+            "apt-get -o {} -y --force-yes {}".format(DPKG_OPTIONS, command))
+
+
+def apt_install(packages):
+    return apt_command('install {}'.format(packages))
+
+
+class CommandBatch(object):
+    """
+    Collects the remote setup steps for one node and executes them as a
+    single shell script over one SSH round trip.
+
+    Each step runs in its own subshell reading /dev/null, with its output
+    and exit status bracketed by marker lines, which are parsed back into a
+    StepResult per step.  By default the script stops at the first failing step and
+    `run` raises a BatchError describing it.
+    """
+
+    def __init__(self, node, stop_on_failure=True):
+        self.node = node
+        self.stop_on_failure = stop_on_failure
+        self.steps = []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, description, command):
+        self.steps.append((description, command))
+        return self
+
+    def extend(self, description, commands):
+        for command in commands:
+            self.add(description, command)
+        return self
+
+    def script(self):
+        lines = []
+        for index, (_, command) in enumerate(self.steps):
+            lines.append('echo "{} begin {}"'.format(STEP_MARKER, index))
+            # The script itself is bash's stdin; keep steps from reading it
+            lines.append('( {}\n) </dev/null 2>&1'.format(command))
+            lines.append('status=$?')
+            lines.append('echo "{} end {} $status"'.format(STEP_MARKER,
+                                                           index))
+            if self.stop_on_failure:
+                lines.append('[ $status -eq 0 ] || exit $status')
+        return 'bash <<\'{delimiter}\'\n{body}\n{delimiter}'.format(
+            delimiter=SCRIPT_DELIMITER, body='\n'.join(lines))
+
+    def parse(self, lines):
+        results = []
+        current, output = None, []
+        for line in lines:
+            match = _marker.match(line.strip())
+            if not match:
+                output.append(line)
+            elif match.group(1) == 'begin':
+                current, output = int(match.group(2)), []
+            elif current is not None:
+                description, command = self.steps[current]
+                results.append(StepResult(description, command,
+                                          int(match.group(3)), output))
+                current, output = None, []
+
+        # A step that never reported (e.g. connection lost) counts as failed
+        if current is not None:
+            description, command = self.steps[current]
+            results.append(StepResult(description, command, -1, output))
+        return results
+
+    def run(self):
+        if not self.steps:
+            return []
+
+        log.info('Executing {} batched steps on {}'.format(
+            len(self.steps), self.node.alias))
+        lines = self.node.ssh.execute(self.script(),
+                                      ignore_exit_status=True)
+        results = self.parse(lines)
+
+        for result in results:
+            if result.status != 0:
+                log.error('Step "%s" on %s exited with %d:\n%s',
+                          result.description, self.node.alias,
+                          result.status, '\n'.join(result.output))
+                raise BatchError(self.node.alias, result)
+        if len(results) < len(self.steps):
+            missing = self.steps[len(results)]
+            raise BatchError(self.node.alias,
+                             StepResult(missing[0], missing[1], -1, []))
+        return results
@@ -0,0 +1,186 @@
+import time
+import Queue
+import threading
+from functools import partial
+from starcluster.logger import log
+from tracing import NULL_TRACER
+
+DEFAULT_CONCURRENCY = 20
+
+
+class TaskFailed(Exception):
+    def __init__(self, failures):
+        super(TaskFailed, self).__init__(
+            'Tasks failed: {}'.format(', '.join(
+                '{} ({})'.format(task.name, task.error)
+                for task in failures)))
+        self.failures = failures
+
+
+class Task(object):
+    def __init__(self, name, function, dependencies):
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies)
+        self.start = None
+        self.end = None
+        self.error = None
+        self.skipped = False
+
+    @property
+    def duration(self):
+        return (self.end - self.start) if self.end is not None else 0.0
+
+    @property
+    def done(self):
+        return self.end is not None or self.skipped
+
+
+class TaskGraph(object):
+    """
+    A set of named tasks with declared dependencies, executed so that each
+    task starts as soon as all of its dependencies have finished.
+
+    Tasks run on a bounded set of threads.  A failing task causes its
+    transitive dependents to be skipped while unrelated tasks continue;
+    `run` raises TaskFailed once everything runnable has finished.
+
+    Each task runs inside a span of `tracer`; names of the form
+    phase:alias are traced as that phase on that node.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, tracer=NULL_TRACER):
+        self.concurrency = int(concurrency)
+        self.tracer = tracer
+        self.tasks = {}
+        self.order = []
+        self.started = None
+
+    def add(self, name, function, dependencies=()):
+        if name in self.tasks:
+            raise ValueError('Duplicate task {}'.format(name))
+        self.tasks[name] = Task(name, function, dependencies)
+        self.order.append(name)
+        return name
+
+    def _validate(self):
+        for task in self.tasks.values():
+            for dependency in task.dependencies:
+                if dependency not in self.tasks:
+                    raise ValueError('Task {} depends on unknown task {}'
+                                     .format(task.name, dependency))
+
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visiting:
+                raise ValueError('Dependency cycle through {}'.format(name))
+            if name not in visited:
+                visiting.add(name)
+                for dependency in self.tasks[name].dependencies:
+                    visit(dependency)
+                visiting.remove(name)
+                visited.add(name)
+        for name in self.order:
+            visit(name)
+
+    def run(self):
+        self._validate()
+        self.started = time.time()
+        ready = Queue.Queue()
+        finished = Queue.Queue()
+
+        def worker():
+            while True:
+                task = ready.get()
+                if task is None:
+                    return
+                task.start = time.time()
+                phase, _, alias = task.name.partition(':')
+                try:
+                    with self.tracer.span(task.name, phase, alias or None):
+                        task.function()
+                except Exception as e:
+                    log.error('Task {} failed: {}'.format(task.name, e))
+                    task.error = e
+                task.end = time.time()
+                finished.put(task)
+
+        threads = [threading.Thread(target=worker,
+                                    name='scheduler-{}'.format(index))
+                   for index in range(min(self.concurrency,
+                                          len(self.tasks)) or 1)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        pending = list(self.order)
+        running = 0
+        failures = []
+        while pending or running:
+            for name in list(pending):
+                task = self.tasks[name]
+                dependencies = [self.tasks[d] for d in task.dependencies]
+                if any(d.skipped or d.error for d in dependencies):
+                    log.warn('Skipping {}; a dependency failed'.format(name))
+                    task.skipped = True
+                    pending.remove(name)
+                elif all(d.done for d in dependencies):
+                    pending.remove(name)
+                    ready.put(task)
+                    running += 1
+            if running:
+                task = finished.get()
+                running -= 1
+                if task.error:
+                    failures.append(task)
+
+        for _ in threads:
+            ready.put(None)
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise TaskFailed(failures)
+
+    def critical_path(self):
+        """ Tasks on the chain of dependencies that finished last """
+        completed = [self.tasks[name] for name in self.order
+                     if self.tasks[name].end is not None]
+        if not completed:
+            return []
+
+        path = [max(completed, key=lambda task: task.end)]
+        while True:
+            dependencies = [self.tasks[name]
+                            for name in path[-1].dependencies
+                            if self.tasks[name].end is not None]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda task: task.end))
+        return list(reversed(path))
+
+    def report(self):
+        path = self.critical_path()
+        if not path:
+            return
+        total = path[-1].end - self.started
+        log.info('Critical path ({:.1f}s total):'.format(total))
+        previous_end = self.started
+        for task in path:
+            log.info('  {:<32} {:>7.1f}s  (waited {:.1f}s)'.format(
+                task.name, task.duration,
+                max(task.start - previous_end, 0)))
+            previous_end = task.end
+
+
+def map_nodes(function, nodes, concurrency=DEFAULT_CONCURRENCY):
+    """ Apply `function` to every node in parallel; returns alias -> result """
+    graph = TaskGraph(concurrency)
+    results = {}
+
+    def apply(node):
+        results[node.alias] = function(node)
+    for node in nodes:
+        graph.add(node.alias, partial(apply, node))
+    graph.run()
+    return results
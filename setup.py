@@ -5,7 +5,15 @@ import re
 from setuptools import setup
 from setuptools.command.install import install
 
-plugin_names = ['myriaplugin.py', 'postgresplugin.py']
+plugin_names = ['myriaplugin.py', 'postgresplugin.py', 'buildcache.py',
+                'remotebatch.py', 'readiness.py', 'scheduler.py',
+                'aptcache.py', 'imagebake.py', 'pgtuning.py',
+                'workersizing.py', 'storage.py',
+                'ingestplanner.py', 'ingestpipeline.py', 'ingestmetrics.py',
+                'tracing.py', 'distribution.py', 'getresturl.py',
+                'pgbouncer.py', 'bulkload.py', 'engine.py',
+                'nodetuning.py', 'jvmoptions.py', 'staging.py',
+                'ingestqueue.py']
 config_name = 'myriacluster.config'
 config_path = '~/.starcluster'
 
@@ -0,0 +1,148 @@
+"""
+Prefetch of HTTP ingest sources onto the local disk of their workers.
+
+Each worker downloads the sources it was assigned with several ranged
+requests per file (when the server advertises byte ranges), checks the
+assembled file against the Content-Length and, for single-part S3-style
+ETags, the MD5, and the import then reads file:// paths.  Other sources,
+such as ranged S3 pieces, are imported from where they are.
+"""
+import re
+import time
+import urlparse
+import posixpath
+from scheduler import map_nodes
+from starcluster.logger import log
+
+DEFAULT_STAGING_DIRECTORY = '/mnt/myria_staging'
+DEFAULT_RANGES = 4
+DEFAULT_CONCURRENCY = 4
+# Files smaller than this are fetched with a single request
+MINIMUM_RANGE_BYTES = 8 * 1024 * 1024
+STAGEABLE_SCHEMES = ['http', 'https']
+
+# stage URL PATH: fetch URL to PATH, printing "staged BYTES PATH"
+STAGE_FUNCTION = r"""
+stage() {
+  url=$1; path=$2
+  headers=$(curl -sfIL "$url" | tr -d '\r') || return 1
+  length=$(echo "$headers" | awk 'tolower($1)=="content-length:" {n=$2} END {print n}')
+  etag=$(echo "$headers" | awk 'tolower($1)=="etag:" {e=$2} END {print e}' | tr -d '"')
+  rm -f "$path".part*
+  if [ -n "$length" ] && [ "$length" -ge {minimum} ] &&
+     echo "$headers" | grep -qi '^accept-ranges: *bytes'; then
+    step=$(( (length + {ranges} - 1) / {ranges} )); pids=""
+    for i in $(seq 0 $(( {ranges} - 1 ))); do
+      start=$(( i * step )); end=$(( start + step - 1 ))
+      [ $start -lt $length ] || break
+      part=$(printf '%s.part%05d' "$path" $i)
+      curl -sfL -r $start-$end -o "$part" "$url" & pids="$pids $!"
+    done
+    for pid in $pids; do wait $pid || return 1; done
+    cat "$path".part* > "$path".partial && rm -f "$path".part[0-9]*
+  else
+    curl -sfL -o "$path".partial "$url" || return 1
+  fi
+  size=$(stat -c %s "$path".partial)
+  if [ -n "$length" ] && [ "$size" != "$length" ]; then
+    echo "size mismatch for $url: $size of $length bytes" >&2; return 1
+  fi
+  if echo "$etag" | grep -qE '^[0-9a-f]{32}$'; then
+    echo "$etag  $path.partial" | md5sum -c --quiet || return 1
+  fi
+  mv "$path".partial "$path" && echo "staged $size $path"
+}
+"""
+
+_staged = re.compile(r'^staged (\d+) (\S+)$')
+
+
+def stageable(source):
+    return not isinstance(source, dict) and \
+        urlparse.urlparse(source).scheme in STAGEABLE_SCHEMES
+
+
+def local_path(directory, index, uri):
+    name = posixpath.basename(urlparse.urlparse(uri).path) or 'source'
+    return '{}/{:05d}-{}'.format(directory, index, name)
+
+
+def stage_command(directory, files, ranges=DEFAULT_RANGES,
+                  concurrency=DEFAULT_CONCURRENCY):
+    """ A bash script fetching [(uri, path)] with bounded concurrency """
+    function = STAGE_FUNCTION.replace('{minimum}', str(MINIMUM_RANGE_BYTES)) \
+        .replace('{ranges}', str(int(ranges)))
+    lines = ['mkdir -p {}'.format(directory), function.strip(), 'pids=""']
+    for uri, path in files:
+        lines.append(
+            'while [ $(jobs -rp | wc -l) -ge {} ]; do sleep 0.2; done'.format(
+                int(concurrency)))
+        lines.append("stage '{}' '{}' & pids=\"$pids $!\"".format(
+            uri.replace("'", "'\\''"), path))
+    lines.append('status=0; for pid in $pids; do wait $pid || status=1; '
+                 'done; exit $status')
+    return "bash <<'__MYRIA_STAGE__'\n{}\n__MYRIA_STAGE__".format(
+        '\n'.join(lines))
+
+
+def parse_staged(lines):
+    """ Path -> bytes for every file reported as staged """
+    staged = {}
+    for line in lines:
+        match = _staged.match(line.strip())
+        if match:
+            staged[match.group(2)] = int(match.group(1))
+    return staged
+
+
+class Staging(object):
+    def __init__(self, relation, directory=DEFAULT_STAGING_DIRECTORY,
+                 ranges=DEFAULT_RANGES, concurrency=DEFAULT_CONCURRENCY):
+        self.directory = '{}/{}'.format(
+            directory, re.sub(r'[^\w.-]', '_', relation))
+        self.ranges = int(ranges)
+        self.concurrency = int(concurrency)
+        self.nodes = []
+        self.bytes = 0
+        self.elapsed = 0
+
+    def stage(self, work, nodes_by_worker):
+        """
+        Download the stageable sources of (worker, source) pairs onto the
+        worker's node; returns the work with those sources replaced by
+        file:// URIs.
+        """
+        files, staged_work = {}, []
+        for index, (worker, source) in enumerate(work):
+            node = nodes_by_worker.get(worker)
+            if node is None or not stageable(source):
+                staged_work.append((worker, source))
+                continue
+            path = local_path(self.directory, index, source)
+            files.setdefault(node, []).append((source, path))
+            staged_work.append((worker, 'file://' + path))
+        if not files:
+            log.info('No sources to stage')
+            return work
+
+        self.nodes = files.keys()
+        log.info('Staging %d sources onto %d nodes under %s',
+                 sum(len(pairs) for pairs in files.values()),
+                 len(self.nodes), self.directory)
+        start = time.time()
+        results = map_nodes(lambda node: node.ssh.execute(stage_command(
+            self.directory, files[node], self.ranges, self.concurrency)),
+            self.nodes)
+        self.elapsed = time.time() - start
+        self.bytes = sum(sum(parse_staged(lines).values())
+                         for lines in results.values())
+        log.info('Staged %d bytes in %.1fs (%.1f MB/s)', self.bytes,
+                 self.elapsed, self.bytes / self.elapsed / 1e6
+                 if self.elapsed else 0)
+        return staged_work
+
+    def cleanup(self):
+        if self.nodes:
+            log.info('Removing staged files from %d nodes', len(self.nodes))
+            map_nodes(lambda node: node.ssh.execute(
+                'rm -rf {}'.format(self.directory)), self.nodes)
@@ -0,0 +1,204 @@
+"""
+Striped instance-store layout for Postgres and Myria data.
+
+Detection output is gathered over SSH in one call and parsed by pure
+functions, so device discovery and planning can be exercised against
+captured `lsblk`, metadata and /proc/mounts output without real disks.
+"""
+import re
+from collections import namedtuple
+from pgtuning import version_tuple
+from starcluster.logger import log
+
+DEFAULT_MOUNT = '/mnt'
+DEFAULT_WAL_MOUNT = '/mnt/postgreswal'
+DEFAULT_ARRAY = '/dev/md0'
+DEFAULT_CHUNK_KB = 256
+DEFAULT_MOUNT_OPTIONS = 'noatime,nodiratime,nobarrier,nofail'
+DEFAULT_THROUGHPUT_MB = 1024
+BLOCK_KB = 4
+# pg_xlog was renamed to pg_wal in PostgreSQL 10
+WAL_DIRECTORY_RENAME_VERSION = (10,)
+
+METADATA_URL = 'http://169.254.169.254/latest/meta-data/block-device-mapping'
+SECTION = '__MYRIA_STORAGE__'
+
+DETECT_COMMAND = r"""
+echo {section} lsblk; lsblk -dn -b -o NAME,SIZE,TYPE
+echo {section} mapping
+for m in $(curl -sf {url}/ | grep ephemeral); do curl -sf {url}/$m; echo; done
+echo {section} mounts; cat /proc/mounts
+""".format(section=SECTION, url=METADATA_URL).strip()
+
+Device = namedtuple('Device', ['name', 'size'])
+StoragePlan = namedtuple('StoragePlan', ['data', 'wal', 'mount', 'wal_mount'])
+
+_throughput = re.compile(r'copied, [\d.]+ s, ([\d.]+) ([KMG]?B)/s')
+
+
+def _sections(lines):
+    sections, current = {}, None
+    for line in lines:
+        if line.startswith(SECTION):
+            current = line[len(SECTION):].strip()
+            sections[current] = []
+        elif current is not None and line.strip():
+            sections[current].append(line.strip())
+    return sections
+
+
+def _kernel_name(name):
+    """ Metadata reports sdb/sdc; Xen guests expose them as xvdb/xvdc """
+    name = name.replace('/dev/', '')
+    return re.sub(r'^sd', 'xvd', name)
+
+
+def parse_devices(lines, excluded=()):
+    """
+    Instance-store disks in detection output that are neither the root
+    device nor mounted anywhere other than the default /mnt, and are not
+    listed in `excluded` (e.g. devices of attached EBS volumes).
+    """
+    sections = _sections(lines)
+    ephemeral = set(_kernel_name(name)
+                    for name in sections.get('mapping', []))
+    excluded = set(_kernel_name(name) for name in excluded)
+
+    mounted = {}
+    for line in sections.get('mounts', []):
+        fields = line.split()
+        if len(fields) >= 2 and fields[0].startswith('/dev/'):
+            device = re.sub(r'\d+$', '', _kernel_name(fields[0]))
+            mounted.setdefault(device, set()).add(fields[1])
+
+    devices = []
+    for line in sections.get('lsblk', []):
+        fields = line.split()
+        if len(fields) < 3 or fields[2] != 'disk':
+            continue
+        name = fields[0]
+        if name not in ephemeral or name in excluded:
+            continue
+        if mounted.get(name, set()) - set([DEFAULT_MOUNT]):
+            continue
+        devices.append(Device(name, int(fields[1])))
+    return sorted(devices)
+
+
+def plan_storage(devices, split_wal=False,
+                 mount=DEFAULT_MOUNT, wal_mount=DEFAULT_WAL_MOUNT):
+    """
+    Stripe every device into one array, or with `split_wal` and at least
+    three devices, dedicate the last device to the WAL and stripe the rest.
+    Returns None when there is nothing to stripe.
+    """
+    if len(devices) < 2:
+        return None
+    devices = sorted(devices)
+    if split_wal and len(devices) >= 3:
+        return StoragePlan(devices[:-1], devices[-1], mount, wal_mount)
+    return StoragePlan(devices, None, mount, None)
+
+
+def layout_commands(plan, array=DEFAULT_ARRAY, chunk_kb=DEFAULT_CHUNK_KB,
+                    options=DEFAULT_MOUNT_OPTIONS):
+    """
+    Commands that assemble and mount the array at `plan.mount`, carrying
+    over anything already stored there.  Idempotent when the array exists.
+    """
+    stride = chunk_kb // BLOCK_KB
+    devices = ' '.join('/dev/{}'.format(d.name) for d in plan.data)
+    carry = '/tmp/myria-storage-carry'
+
+    assemble = ' && '.join([
+        'mkdir -p {carry} && rsync -a {mount}/ {carry}/',
+        'for d in {devices}; do umount $d 2>/dev/null; '
+        'mdadm --zero-superblock $d 2>/dev/null; true; done',
+        'yes | mdadm --create {array} --level=0 --chunk={chunk} '
+        '--raid-devices={count} {devices} --run',
+        'mkfs.ext4 -F -q -m 0 -E stride={stride},stripe-width={width} {array}',
+        'mkdir -p {mount} && mount -o {options} {array} {mount}',
+        'rsync -a {carry}/ {mount}/ && rm -rf {carry}',
+        'mdadm --detail --scan > /etc/mdadm/mdadm.conf',
+        "sed -i '\\#[[:space:]]{mount}[[:space:]]#d' /etc/fstab",
+        "echo '{array} {mount} ext4 {options} 0 2' >> /etc/fstab"]).format(
+            carry=carry, mount=plan.mount, devices=devices, array=array,
+            chunk=chunk_kb, count=len(plan.data), stride=stride,
+            width=stride * len(plan.data), options=options)
+
+    commands = [
+        'dpkg -s mdadm >/dev/null 2>&1 || '
+        "DEBIAN_FRONTEND='noninteractive' apt-get -y install mdadm",
+        # Formatting is skipped only once the array is in place at the mount
+        'grep -q "^{array} {mount} " /proc/mounts || ({assemble})'.format(
+            array=array, mount=plan.mount, assemble=assemble)]
+
+    if plan.wal is not None:
+        commands.append(
+            'grep -q "^/dev/{device} {wal_mount} " /proc/mounts || ('
+            '(umount /dev/{device} 2>/dev/null; true) && '
+            'mkfs.ext4 -F -q -m 0 /dev/{device} && mkdir -p {wal_mount} && '
+            'mount -o {options} /dev/{device} {wal_mount} && '
+            "echo '/dev/{device} {wal_mount} ext4 {options} 0 2' "
+            '>> /etc/fstab)'.format(device=plan.wal.name,
+                                    wal_mount=plan.wal_mount,
+                                    options=options))
+    return commands
+
+
+def wal_directory(version):
+    """ Name of the WAL directory under the data path for `version` """
+    if version_tuple(version) >= WAL_DIRECTORY_RENAME_VERSION:
+        return 'pg_wal'
+    return 'pg_xlog'
+
+
+def relocate_wal_command(data_path, wal_mount, version):
+    """
+    Move the WAL directory of PostgreSQL `version` onto the WAL device;
+    Postgres must be stopped
+    """
+    directory = wal_directory(version)
+    wal = '{}/{}'.format(wal_mount, directory)
+    return ('[ -L {data}/{directory} ] || ('
+            'sudo rm -rf {wal} && sudo mv {data}/{directory} {wal} && '
+            'sudo ln -s {wal} {data}/{directory} && '
+            'sudo chown -R postgres:postgres {wal_mount})').format(
+                data=data_path, directory=directory, wal=wal,
+                wal_mount=wal_mount)
+
+
+def detect(node, excluded=()):
+    return parse_devices(node.ssh.execute(DETECT_COMMAND,
+                                          ignore_exit_status=True),
+                         excluded)
+
+
+def volume_devices(volumes):
+    """ Devices of the EBS volumes StarCluster passes to run() """
+    return [volume.get('device') for volume in (volumes or {}).values()
+            if volume.get('device')]
+
+
+def parse_throughput(line):
+    match = _throughput.search(line)
+    if not match:
+        return None
+    scale = {'KB': 1.0 / 1000, 'MB': 1, 'GB': 1000, 'B': 1.0 / 1000000}
+    return float(match.group(1)) * scale[match.group(2)]
+
+
+def measure_throughput(node, path=DEFAULT_MOUNT, size_mb=DEFAULT_THROUGHPUT_MB):
+    """ Sequential write and read MB/s of the filesystem holding `path` """
+    target = '{}/.myria-throughput'.format(path)
+    lines = node.ssh.execute(
+        'dd if=/dev/zero of={target} bs=1M count={count} oflag=direct 2>&1 '
+        '| tail -1 && sync && echo 3 > /proc/sys/vm/drop_caches && '
+        'dd if={target} of=/dev/null bs=1M iflag=direct 2>&1 | tail -1; '
+        'rm -f {target}'.format(target=target, count=size_mb),
+        ignore_exit_status=True)
+    rates = [rate for rate in map(parse_throughput, lines) if rate]
+    write, read = (rates + [None, None])[:2]
+    log.info('{} storage at {}: sequential write {} MB/s, read {} MB/s'
+             .format(node.alias, path, write, read))
+    return write, read
@@ -0,0 +1,60 @@
+import unittest
+import clustersim
+import myriaplugin
+
+DEPLOYMENT = """[deployment]
+name = myria
+
+[runtime]
+jvm.heap.size.max.gb = 3
+jvm.options = -Xms3072m -XX:+UseParallelGC
+
+[workers]
+1 = node001.simulated.internal:8001:/mnt/myria:myria
+"""
+
+
+class AddNodeTest(unittest.TestCase):
+    def setUp(self):
+        nodes, _ = clustersim.make_cluster(3)
+        self.master, self.node = nodes[0], nodes[2]
+        with self.master.ssh.remote_file(
+                myriaplugin.DEFAULT_DEPLOYMENT_FILENAME, 'w') as f:
+            f.write(DEPLOYMENT)
+        # Plugin defaults differ from what the cluster was deployed with
+        self.installer = myriaplugin.MyriaInstaller(heap='8',
+                                                    workers_per_node='auto')
+        self.installer.deployed = self.installer.deployed_runtime(self.master)
+
+    def test_reads_deployed_runtime(self):
+        self.assertEqual(self.installer.deployed,
+                         {'heap': 3,
+                          'options': '-Xms3072m -XX:+UseParallelGC'})
+
+    def test_new_workers_use_deployed_heap_and_options(self):
+        self.installer.size_new_node(self.node)
+        workers = self.installer.start_workers(self.master, self.node, 2)
+
+        starts = [command for command in self.node.ssh.commands
+                  if 'edu.washington.escience.myria.parallel.Worker'
+                  in command]
+        self.assertTrue(workers)
+        self.assertEqual(len(starts), len(workers))
+        for command in starts:
+            self.assertIn('-Xmx3g -Xms3072m -XX:+UseParallelGC', command)
+
+    def test_config_written_before_each_worker_starts(self):
+        self.installer.size_new_node(self.node)
+        workers = self.installer.start_workers(self.master, self.node, 2)
+
+        for worker_id, worker in workers.items():
+            path = myriaplugin.WORKER_CONFIG_PATH.format(
+                path=self.installer.path, id=worker_id)
+            config = self.node.ssh.files[path]
+            self.assertIn('jvm.heap.size.max.gb = 3', config)
+            self.assertIn('[worker]\nid = {}\n'.format(worker_id), config)
+            self.assertIn('port = {}'.format(worker.port), config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import aptcache
+import clustersim
+import myriaplugin
+import remotebatch
+
+
+class UpdateOnceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sources = os.path.join(self.directory, 'sources.list')
+        self.write_sources('deb http://archive.ubuntu.com/ubuntu trusty main')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_sources(self, line):
+        with open(self.sources, 'a') as descriptor:
+            descriptor.write(line + '\n')
+
+    def updates(self, command=None):
+        """ Whether the command would run apt-get update """
+        command = (command or aptcache.update_once_command()) \
+            .replace(remotebatch.apt_command('update'), 'echo updated') \
+            .replace(aptcache.SOURCES_PATHS, self.sources) \
+            .replace(aptcache.UPDATE_STAMP_PATH,
+                     os.path.join(self.directory, 'stamp'))
+        return 'updated' in subprocess.check_output(['bash', '-c', command])
+
+    def test_same_sources_update_once(self):
+        self.assertTrue(self.updates())
+        self.assertFalse(self.updates())
+
+    def test_new_source_forces_update(self):
+        self.assertTrue(self.updates())
+        self.write_sources('deb http://apt.postgresql.org/pub/repos/apt '
+                           'trusty-pgdg main')
+        self.assertTrue(self.updates())
+
+    def test_different_packages_skip_update(self):
+        nodes, _ = clustersim.make_cluster(1)
+        batch = remotebatch.CommandBatch(nodes[0])
+        myriaplugin.MyriaInstaller()._install_packages(nodes[0], batch)
+        myria = dict(batch.steps)['Update package lists']
+        # The package proxy installs apt-cacher-ng after Myria's packages
+        proxy = aptcache.PackageCache().server_commands()[0]
+
+        self.assertTrue(self.updates(myria))
+        self.assertFalse(self.updates(proxy))
+
+    def test_proxy_configuration_is_part_of_the_key(self):
+        self.assertIn(aptcache.PROXY_CONFIG_PATH, aptcache.SOURCES_PATHS)
+
+
+if __name__ == '__main__':
+    unittest.main()
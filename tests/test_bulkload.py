@@ -0,0 +1,30 @@
+import subprocess
+import unittest
+import clustersim
+import bulkload
+
+
+class VacuumAnalyzeTest(unittest.TestCase):
+    def command(self, databases):
+        nodes, _ = clustersim.make_cluster(2)
+        node = nodes[1]
+        bulkload.BulkLoad('9.5', 5432).vacuum_analyze(
+            [node], {node.dns_name: databases}, '"public:adhoc:edges"')
+        return node.ssh.commands[-1]
+
+    def test_every_database_is_vacuumed(self):
+        command = self.command(['myria', 'myria_1'])
+        self.assertIn('-d myria -c', command)
+        self.assertIn('-d myria_1 -c', command)
+
+    def test_a_failed_vacuum_fails_the_command(self):
+        command = self.command(['myria', 'myria_1'])
+        # Stand in for psql: the vacuum of myria_1 fails
+        stub = 'sudo() { case "$*" in *myria_1*) return 1;; esac; }; '
+        self.assertNotEqual(subprocess.call(['bash', '-c', stub + command]),
+                            0)
+        self.assertEqual(subprocess.call(
+            ['bash', '-c', stub + command.replace('myria_1', 'myria_2')]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import clustersim
+import myriaplugin
+
+
+class RecordingInstaller(myriaplugin.MyriaInstaller):
+    """ Records the master's commands up to launch; launches nothing """
+
+    def launch(self, master, nodes):
+        self.before_launch = list(master.ssh.commands)
+
+    def configure_web(self, node, appengine_url, repository_url):
+        pass
+
+
+class DistributionTest(unittest.TestCase):
+    def deploy(self, size, mode):
+        nodes, _ = clustersim.make_cluster(size)
+        nodes[0].ssh.respond(r'sha256sum \S+/bundle.partial', ['0' * 64])
+        installer = RecordingInstaller(distribution=mode,
+                                       workers_per_node='auto')
+        installer.run(nodes, nodes[0], 'root', 'bash', {})
+        return nodes, installer
+
+    def test_deployed_tree_fans_out_before_launch(self):
+        nodes, installer = self.deploy(8, 'tree')
+        master = nodes[0]
+
+        setups = [command for command in installer.before_launch
+                  if 'setup_cluster.py' in command]
+        self.assertEqual(len(setups), 1)
+        self.assertIn(myriaplugin.MASTER_DEPLOYMENT_FILENAME, setups[0])
+        bundles = [command for command in installer.before_launch
+                   if 'tar cf -' in command]
+        self.assertEqual(len(bundles), 1)
+        self.assertIn('cd {} '.format(installer.path), bundles[0])
+        self.assertIn("-path './worker_*' -prune", bundles[0])
+
+        for node in nodes[1:]:
+            self.assertTrue([command for command in node.ssh.commands
+                             if 'tar xzf' in command and
+                             '-C {}'.format(installer.path) in command])
+        # Workers that received the bundle forward it
+        self.assertTrue([node for node in nodes[1:]
+                         if [command for command in node.ssh.commands
+                             if 'scp ' in command]])
+
+    def test_master_only_deployment_has_no_workers(self):
+        nodes, installer = self.deploy(4, 'tree')
+        with nodes[0].ssh.remote_file(
+                myriaplugin.MASTER_DEPLOYMENT_FILENAME, 'r') as f:
+            lines = f.read().splitlines()
+        workers = lines[lines.index('[workers]') + 1:]
+        following = [index for index, line in enumerate(workers)
+                     if line.startswith('[')]
+        self.assertFalse([line for line in workers[:(following or [None])[0]]
+                          if line.strip()])
+        self.assertTrue(installer.deployment_section(nodes[0], 'workers'))
+
+    def test_no_fan_out_by_default(self):
+        nodes, installer = self.deploy(4, None)
+        self.assertFalse([command for command in installer.before_launch
+                          if 'tar cf -' in command])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+import clustersim
+import getresturl
+import myriaplugin
+
+
+class UrlCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.previous_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.home
+        self.cache = getresturl.UrlCache()
+        self.cache.put({'first-master': 'http://first:8753',
+                        'second-master': 'http://second:8753'})
+
+    def tearDown(self):
+        os.environ['HOME'] = self.previous_home
+        shutil.rmtree(self.home)
+
+    def test_invalidate_one_cluster(self):
+        self.cache.invalidate(['first-master'])
+        self.assertEqual(
+            self.cache.get(['first-master', 'second-master']),
+            {'second-master': 'http://second:8753'})
+
+    def test_invalidate_every_cluster(self):
+        self.cache.invalidate()
+        self.assertEqual(
+            self.cache.get(['first-master', 'second-master']), {})
+
+    def test_restart_forgets_only_its_cluster(self):
+        nodes, _ = clustersim.make_cluster(2, cluster='first')
+        myriaplugin.MyriaInstaller().on_restart(nodes, nodes[0], 'root',
+                                                'bash', {})
+        self.assertEqual(
+            self.cache.get(['first-master', 'second-master']),
+            {'second-master': 'http://second:8753'})
+
+
+if __name__ == '__main__':
+    unittest.main()
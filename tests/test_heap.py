@@ -0,0 +1,27 @@
+import unittest
+import clustersim
+import myriaplugin
+
+
+class HeapSizeTest(unittest.TestCase):
+    def test_heap_size_is_whole_gigabytes(self):
+        for heap, expected in [(None, myriaplugin.DEFAULT_HEAP_SIZE),
+                               ('auto', myriaplugin.DEFAULT_HEAP_SIZE),
+                               ('-Xmx2g', 2), ('4', 4), ('2.5', 2),
+                               ('3584m', 3), ('512m', 1)]:
+            installer = myriaplugin.MyriaInstaller(heap=heap)
+            self.assertEqual(installer.heap_size(), expected, heap)
+            self.assertIsInstance(installer.heap_size(), int)
+
+    def test_deployment_gets_normalised_heap(self):
+        nodes, _ = clustersim.make_cluster(2)
+        installer = myriaplugin.MyriaInstaller(heap='-Xmx2g')
+        installer.create_configuration(nodes[0], nodes[1:])
+
+        command = [command for command in nodes[0].ssh.commands
+                   if 'create_deployment.py' in command][0]
+        self.assertIn('--jvm-max-heap-size-gb "2"', command)
+
+
+if __name__ == '__main__':
+    unittest.main()
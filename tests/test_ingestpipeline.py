@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+import ingestpipeline
+
+
+class FakeQuery(object):
+    def __init__(self, query_id, status):
+        self.query_id = query_id
+        self.status = status
+
+
+class Myria(object):
+    """ Imports into per-batch relations; batch ids in `flaky` fail once """
+
+    def __init__(self, flaky=()):
+        self.flaky = set(flaky)
+        self.relations = {}
+        self.merged = None
+        self.queries = 0
+
+    def submit(self, batch_id, work):
+        self.queries += 1
+        # Rows land even when the query is reported as failed
+        self.relations[batch_id] = [source for _, source in work]
+        if batch_id in self.flaky:
+            self.flaky.remove(batch_id)
+            return FakeQuery(self.queries, 'ERROR')
+        return FakeQuery(self.queries, 'SUCCESS')
+
+    def merge(self, batch_ids):
+        self.queries += 1
+        self.merged = sorted(row for batch_id in batch_ids
+                             for row in self.relations[batch_id])
+        return FakeQuery(self.queries, 'SUCCESS')
+
+
+class IngestPipelineTest(unittest.TestCase):
+    WORK = [(1, 'a'), (2, 'b'), (1, 'c'), (2, 'd'), (1, 'e')]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def manifest(self):
+        manifest = ingestpipeline.Manifest(
+            os.path.join(self.directory, 'manifest.json'), 'edges',
+            [source for _, source in self.WORK])
+        if not manifest.load():
+            manifest.plan(self.WORK, 2)
+        return manifest
+
+    def run_pipeline(self, myria):
+        manifest = self.manifest()
+        ingestpipeline.IngestPipeline(
+            manifest, myria.submit, myria.merge, backoff=0,
+            poll_interval=0).run()
+        return manifest
+
+    def test_retried_batches_do_not_duplicate_rows(self):
+        myria = Myria(flaky=[0, 2])
+        manifest = self.run_pipeline(myria)
+        self.assertEqual(myria.merged, ['a', 'b', 'c', 'd', 'e'])
+        self.assertTrue(manifest.merged)
+
+    def test_completed_ingest_is_not_resubmitted(self):
+        self.run_pipeline(Myria())
+        myria = Myria()
+        self.run_pipeline(myria)
+        self.assertEqual(myria.queries, 0)
+
+    def test_union_program(self):
+        self.assertEqual(
+            ingestpipeline.union_program('public:adhoc:edges', [0, 1]),
+            'merged = unionall(scan(public:adhoc:edges__batch0), '
+            'scan(public:adhoc:edges__batch1));\n'
+            'store(merged, public:adhoc:edges);')
+
+
+if __name__ == '__main__':
+    unittest.main()
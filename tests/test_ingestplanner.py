@@ -0,0 +1,76 @@
+import unittest
+import boto
+import boto.exception
+import ingestplanner
+
+LINES = ''.join('{},{}\n'.format(index, 'x' * (index % 7))
+                for index in range(200))
+
+
+def read(uri, start, end):
+    return LINES[start:end]
+
+
+def align(uri, offset, size):
+    return ingestplanner.line_start(uri, offset, size, read)
+
+
+class UriSizeTest(unittest.TestCase):
+    def setUp(self):
+        self.connect_s3 = boto.connect_s3
+
+    def tearDown(self):
+        boto.connect_s3 = self.connect_s3
+
+    def size_when_raising(self, error):
+        def connect_s3(*args, **kwargs):
+            raise error
+        boto.connect_s3 = connect_s3
+        return ingestplanner.uri_size('s3://bucket/edges')
+
+    def test_s3_server_error_is_unknown_size(self):
+        self.assertIsNone(self.size_when_raising(
+            boto.exception.S3ResponseError(403, 'Forbidden')))
+
+    def test_s3_client_error_is_unknown_size(self):
+        self.assertIsNone(self.size_when_raising(
+            boto.exception.BotoClientError('bad request')))
+
+    def test_missing_credentials_is_unknown_size(self):
+        self.assertIsNone(self.size_when_raising(
+            boto.exception.NoAuthHandlerFound('no credentials')))
+
+
+class SplitTest(unittest.TestCase):
+    def pieces(self, workers):
+        return ingestplanner.split({'s3://bucket/edges': len(LINES)},
+                                   workers, 1, lambda uri: True, align)
+
+    def test_ranges_begin_at_line_starts(self):
+        for workers in [2, 3, 7, 16]:
+            pieces = self.pieces(workers)
+            self.assertEqual(pieces[0].start, 0)
+            for piece in pieces[1:]:
+                self.assertEqual(LINES[piece.start - 1], '\n')
+
+    def test_ranges_cover_every_line_once(self):
+        for workers in [2, 3, 7, 16]:
+            pieces = self.pieces(workers)
+            self.assertEqual(''.join(LINES[piece.start:piece.end]
+                                     for piece in pieces), LINES)
+            self.assertEqual(sum(piece.size for piece in pieces),
+                             len(LINES))
+
+    def test_line_start_past_last_line(self):
+        self.assertIsNone(ingestplanner.line_start(
+            'uri', len(LINES) - 1, len(LINES), read))
+
+    def test_line_search_spans_reads(self):
+        data = 'a' * (ingestplanner.LINE_SEARCH_BYTES * 2 + 5) + '\nb\n'
+        self.assertEqual(ingestplanner.line_start(
+            'uri', 1, len(data), lambda uri, start, end: data[start:end]),
+            data.index('\n') + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
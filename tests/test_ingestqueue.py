@@ -0,0 +1,120 @@
+import itertools
+import unittest
+import ingestqueue
+
+
+class FakeQuery(object):
+    """ Reports RUNNING `polls` times, then `final`; raises if an error """
+
+    ids = itertools.count(1)
+
+    def __init__(self, polls=1, final='SUCCESS'):
+        self.query_id = next(self.ids)
+        self.polls = polls
+        self.final = final
+
+    @property
+    def status(self):
+        if self.polls > 0:
+            self.polls -= 1
+            return 'RUNNING'
+        if isinstance(self.final, Exception):
+            raise self.final
+        return self.final
+
+
+def entry(name, size, workers):
+    return {'name': name, 'size': size,
+            'work': [(worker, 's3://bucket/{}/{}'.format(name, worker))
+                     for worker in workers]}
+
+
+class FakeSubmit(object):
+    """ Records submissions and the peak number of imports per worker """
+
+    def __init__(self, queries=None, failing=()):
+        self.queries = queries or {}
+        self.failing = failing
+        self.order = []
+        self.peak = {}
+        self.queue = None
+
+    def __call__(self, entry):
+        self.order.append(entry['name'])
+        if entry['name'] in self.failing:
+            raise IOError('connection refused')
+        for worker, count in self.queue.load.items():
+            self.peak[worker] = max(self.peak.get(worker, 0), count)
+        return self.queries.get(entry['name']) or FakeQuery()
+
+
+class IngestQueueTest(unittest.TestCase):
+    def run_queue(self, entries, submit, **kwargs):
+        finished = []
+        queue = ingestqueue.IngestQueue(
+            entries, submit, lambda entry, status: finished.append(
+                (entry['name'], status)),
+            initial_interval=0.01, maximum_interval=0.02, **kwargs)
+        submit.queue = queue
+        succeeded, failed = queue.run()
+        return succeeded, failed, dict(finished)
+
+    def test_largest_first(self):
+        submit = FakeSubmit()
+        succeeded, failed, _ = self.run_queue(
+            [entry('small', 10, [1]), entry('large', 1000, [2]),
+             entry('medium', 100, [3])], submit)
+        self.assertEqual(submit.order, ['large', 'medium', 'small'])
+        self.assertEqual(sorted(succeeded), ['large', 'medium', 'small'])
+        self.assertEqual(failed, [])
+
+    def test_per_worker_cap(self):
+        submit = FakeSubmit(dict(
+            ('r{}'.format(index), FakeQuery(polls=3)) for index in range(5)))
+        succeeded, failed, _ = self.run_queue(
+            [entry('r{}'.format(index), 100 - index, [1, 2])
+             for index in range(5)], submit, max_per_worker=2)
+        self.assertEqual(submit.peak, {1: 2, 2: 2})
+        self.assertEqual(len(succeeded), 5)
+
+    def test_smaller_relation_fills_in_around_busy_workers(self):
+        submit = FakeSubmit({'large': FakeQuery(polls=5)})
+        self.run_queue([entry('large', 1000, [1]), entry('next', 500, [1]),
+                        entry('other', 10, [2])], submit, max_per_worker=1)
+        self.assertEqual(submit.order, ['large', 'other', 'next'])
+
+    def test_submit_failure(self):
+        submit = FakeSubmit(failing=['broken'])
+        succeeded, failed, finished = self.run_queue(
+            [entry('broken', 1000, [1]), entry('fine', 10, [1])], submit,
+            max_per_worker=1)
+        self.assertEqual(succeeded, ['fine'])
+        self.assertEqual(failed, ['broken'])
+        self.assertEqual(finished['broken'], 'ERROR')
+
+    def test_import_error(self):
+        submit = FakeSubmit({'bad': FakeQuery(final='ERROR')})
+        succeeded, failed, _ = self.run_queue(
+            [entry('bad', 10, [1]), entry('good', 5, [2])], submit)
+        self.assertEqual(succeeded, ['good'])
+        self.assertEqual(failed, ['bad'])
+
+    def test_repeated_poll_failures(self):
+        submit = FakeSubmit({'lost': FakeQuery(final=IOError('timed out'))})
+        succeeded, failed, finished = self.run_queue(
+            [entry('lost', 10, [1])], submit, max_poll_failures=3)
+        self.assertEqual(failed, ['lost'])
+        self.assertEqual(finished['lost'], 'ERROR')
+
+    def test_timeout(self):
+        submit = FakeSubmit({'hung': FakeQuery(polls=10 ** 6)})
+        succeeded, failed, finished = self.run_queue(
+            [entry('hung', 10, [1]), entry('quick', 5, [1])], submit,
+            max_per_worker=1, timeout=0.1)
+        self.assertEqual(failed, ['hung'])
+        self.assertEqual(succeeded, ['quick'])
+        self.assertEqual(finished['hung'], ingestqueue.TIMED_OUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
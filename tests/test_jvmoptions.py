@@ -0,0 +1,41 @@
+import unittest
+import clustersim
+import jvmoptions
+import myriaplugin
+
+ORACLE_7U80 = ['java version "1.7.0_80"',
+               'Java(TM) SE Runtime Environment (build 1.7.0_80-b15)']
+ORACLE_7U25 = ['java version "1.7.0_25"',
+               'Java(TM) SE Runtime Environment (build 1.7.0_25-b15)']
+ORACLE_11 = ['java version "11.0.2" 2019-01-15 LTS',
+             'Java(TM) SE Runtime Environment 18.9 (build 11.0.2+9-LTS)']
+OPENJDK_7 = ['java version "1.7.0_211"',
+             'OpenJDK Runtime Environment (IcedTea 2.6.17)']
+
+
+class ProfilerCheckTest(unittest.TestCase):
+    def test_java_version(self):
+        self.assertEqual(jvmoptions.parse_java_version(ORACLE_7U80),
+                         ('oracle', (1, 7, 0, 80)))
+        self.assertEqual(jvmoptions.parse_java_version(ORACLE_11),
+                         ('oracle', (11, 0, 2, 0)))
+        self.assertEqual(jvmoptions.parse_java_version(OPENJDK_7),
+                         ('openjdk', (1, 7, 0, 211)))
+
+    def test_jfr_needs_supported_oracle_jdk(self):
+        jvmoptions.check_profiler('jfr', ORACLE_7U80)
+        for lines in [ORACLE_7U25, ORACLE_11, OPENJDK_7, []]:
+            self.assertRaises(ValueError, jvmoptions.check_profiler,
+                              'jfr', lines)
+
+    def test_deployment_refuses_jfr_on_openjdk(self):
+        nodes, _ = clustersim.make_cluster(2)
+        master = nodes[0]
+        master.ssh.respond('java -version', OPENJDK_7)
+        installer = myriaplugin.MyriaInstaller(jvm_tuning='auto',
+                                               jvm_profiling='jfr')
+        self.assertRaises(ValueError, installer.configure_runtime, master)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import pgtuning
+
+
+def hardware(memory_mb, cores, disks=1, rotational=True):
+    return {'memory_mb': memory_mb, 'cores': cores, 'disks': disks,
+            'rotational': rotational}
+
+
+class ComputeTuningTest(unittest.TestCase):
+    # memory MB, cores -> shared_buffers, work_mem, effective_cache_size
+    CASES = [
+        (1024, 1, '128MB', '15MB', '384MB'),
+        (8192, 4, '1920MB', '230MB', '5760MB'),
+        (32768, 128, '8064MB', '189MB', '24192MB'),
+        (65536, 16, '8192MB', '512MB', '48768MB'),
+    ]
+
+    def test_memory_settings(self):
+        for memory_mb, cores, shared, work, cache in self.CASES:
+            settings, _ = pgtuning.compute_tuning(hardware(memory_mb, cores))
+            self.assertEqual(
+                (settings['shared_buffers'], settings['work_mem'],
+                 settings['effective_cache_size']),
+                (shared, work, cache), '{}MB/{} cores'.format(memory_mb,
+                                                              cores))
+
+    def test_checkpoint_segments_before_9_5(self):
+        for version in [9.1, '9.4']:
+            settings, _ = pgtuning.compute_tuning(hardware(8192, 4),
+                                                  version=version)
+            self.assertEqual(settings['checkpoint_segments'], 32)
+            self.assertNotIn('max_wal_size', settings)
+
+    def test_max_wal_size_from_9_5(self):
+        for version in ['9.5', 9.6, '10', '12']:
+            settings, _ = pgtuning.compute_tuning(hardware(65536, 16),
+                                                  version=version)
+            self.assertNotIn('checkpoint_segments', settings)
+            self.assertEqual(settings['max_wal_size'], '3072MB')
+
+
+if __name__ == '__main__':
+    unittest.main()
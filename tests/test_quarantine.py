@@ -0,0 +1,80 @@
+import unittest
+import clustersim
+import myriaplugin
+import postgresplugin
+
+
+class FailingInstaller(myriaplugin.MyriaInstaller):
+    """ Postgres configuration fails on one worker; nothing is launched """
+
+    def __init__(self, failing, **kwargs):
+        super(FailingInstaller, self).__init__(**kwargs)
+        self.failing = failing
+
+    def configure_postgres(self, node, batch=None):
+        if node.alias == self.failing:
+            raise clustersim.SimulatedCommandFailed(node.alias)
+        return super(FailingInstaller, self).configure_postgres(node, batch)
+
+    def launch(self, master, nodes):
+        self.launched = [node.alias for node in nodes]
+
+    def configure_web(self, node, appengine_url, repository_url):
+        pass
+
+
+class QuarantineTest(unittest.TestCase):
+    def run_cluster(self, **kwargs):
+        nodes, _ = clustersim.make_cluster(4)
+        installer = FailingInstaller('node002', **kwargs)
+        installer.run(nodes, nodes[0], 'root', 'bash', {})
+        return nodes[0], installer
+
+    def test_quarantined_worker_left_out_of_deployment(self):
+        master, installer = self.run_cluster(workers_per_node='auto')
+
+        self.assertEqual(list(installer.engine.quarantined), ['node002'])
+        workers = installer.deployment_section(master, 'workers')
+        self.assertTrue(workers)
+        self.assertFalse([line for line in workers if 'node002' in line])
+        self.assertTrue([line for line in workers if 'node003' in line])
+        self.assertNotIn('node002', installer.launched)
+
+    def test_quarantined_worker_not_passed_to_create_deployment(self):
+        master, installer = self.run_cluster()
+
+        command = [command for command in master.ssh.commands
+                   if 'create_deployment.py' in command][0]
+        self.assertNotIn('node002.simulated.internal', command)
+        self.assertIn('node003.simulated.internal', command)
+
+
+class FailingPostgres(postgresplugin.PostgresInstaller):
+    def __init__(self, failing, **kwargs):
+        super(FailingPostgres, self).__init__(**kwargs)
+        self.failing = failing
+
+    def _set_up_node(self, node):
+        if node.alias == self.failing:
+            raise clustersim.SimulatedCommandFailed(node.alias)
+        return super(FailingPostgres, self)._set_up_node(node)
+
+
+class PostgresQuarantineTest(unittest.TestCase):
+    def run_postgres(self, failing):
+        nodes, _ = clustersim.make_cluster(3)
+        installer = FailingPostgres(failing)
+        installer.run(nodes, nodes[0], 'root', 'bash', {})
+        return installer
+
+    def test_worker_failure_is_quarantined(self):
+        installer = self.run_postgres('node001')
+        self.assertEqual(list(installer.engine.quarantined), ['node001'])
+
+    def test_master_failure_is_fatal(self):
+        self.assertRaises(clustersim.SimulatedCommandFailed,
+                          self.run_postgres, 'master')
+
+
+if __name__ == '__main__':
+    unittest.main()
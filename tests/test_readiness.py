@@ -0,0 +1,44 @@
+import unittest
+import clustersim
+import readiness
+
+
+class BrokenProbe(readiness.Probe):
+    """ Raises as an SSH error would """
+
+    def check(self, node):
+        raise IOError('connection reset by {}'.format(node.alias))
+
+
+class WaitForAllTest(unittest.TestCase):
+    def setUp(self):
+        self.nodes, _ = clustersim.make_cluster(3)
+
+    def test_all_ready(self):
+        elapsed = readiness.wait_for_all(
+            self.nodes, lambda node: [readiness.TcpProbe(22)],
+            timeout=5)
+        self.assertEqual(sorted(elapsed), ['master', 'node001', 'node002'])
+
+    def test_raising_probe_fails_the_wait(self):
+        def probes_for(node):
+            if node.alias == 'node001':
+                return [BrokenProbe('broken')]
+            return [readiness.TcpProbe(22)]
+
+        with self.assertRaises(readiness.ProbeFailed) as context:
+            readiness.wait_for_all(self.nodes, probes_for, timeout=5)
+        self.assertEqual(list(context.exception.errors), ['node001'])
+
+    def test_raising_probes_for_fails_the_wait(self):
+        def probes_for(node):
+            raise KeyError(node.alias)
+
+        with self.assertRaises(readiness.ProbeFailed) as context:
+            readiness.wait_for_all(self.nodes, probes_for, timeout=5)
+        self.assertEqual(sorted(context.exception.errors),
+                         ['master', 'node001', 'node002'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import subprocess
+import unittest
+import clustersim
+from remotebatch import CommandBatch
+
+
+class CommandBatchTest(unittest.TestCase):
+    def run_script(self, batch):
+        process = subprocess.Popen(['bash', '-c', batch.script()],
+                                   stdout=subprocess.PIPE)
+        return batch.parse(process.communicate()[0].splitlines())
+
+    def test_step_reading_stdin_does_not_swallow_later_steps(self):
+        nodes, _ = clustersim.make_cluster(1)
+        batch = CommandBatch(nodes[0])
+        batch.add('Read stdin', 'cat')
+        batch.add('Report', 'echo second')
+
+        results = self.run_script(batch)
+        self.assertEqual([result.status for result in results], [0, 0])
+        self.assertEqual(results[0].output, [])
+        self.assertEqual(results[1].output, ['second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+import subprocess
+import SocketServer
+import BaseHTTPServer
+import staging
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves server.files (path -> body) honouring single byte ranges.
+    server.lengths and server.etags override the advertised headers.
+    """
+
+    def headers_for(self, body):
+        server = self.server
+        length = server.lengths.get(self.path, len(body))
+        etag = server.etags.get(self.path, hashlib.md5(body).hexdigest())
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"{}"'.format(etag))
+        return length
+
+    def do_HEAD(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(self.headers_for(body)))
+        self.end_headers()
+
+    def do_GET(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        match = re.match(r'bytes=(\d+)-(\d+)$',
+                         self.headers.getheader('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(body) - 1)
+            self.server.ranges.append((self.path, start, end))
+            self.send_response(206)
+            self.headers_for(body)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(body)))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+            self.headers_for(body)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StageCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeServer(('127.0.0.1', 0), RangeHandler)
+        self.server.files, self.server.lengths = {}, {}
+        self.server.etags, self.server.ranges = {}, []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.directory = tempfile.mkdtemp()
+        self.minimum = staging.MINIMUM_RANGE_BYTES
+
+    def tearDown(self):
+        staging.MINIMUM_RANGE_BYTES = self.minimum
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server.server_port, path)
+
+    def stage(self, files, ranges=4):
+        environment = dict(os.environ, no_proxy='*', NO_PROXY='*')
+        process = subprocess.Popen(
+            ['bash', '-c', staging.stage_command(self.directory, files,
+                                                 ranges=ranges)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+        output, _ = process.communicate()
+        return process.returncode, output.splitlines()
+
+    def serve(self, path, body):
+        self.server.files[path] = body
+        return self.url(path), os.path.join(self.directory, path.strip('/'))
+
+    def test_single_request(self):
+        body = os.urandom(50000)
+        url, path = self.serve('/small.csv', body)
+
+        status, lines = self.stage([(url, path)])
+        self.assertEqual(status, 0)
+        self.assertEqual(staging.parse_staged(lines), {path: len(body)})
+        with open(path, 'rb') as descriptor:
+            self.assertEqual(descriptor.read(), body)
+        self.assertEqual(self.server.ranges, [])
+
+    def test_ranged_requests(self):
+        staging.MINIMUM_RANGE_BYTES = 1024
+        body = os.urandom(100001)
+        url, path = self.serve('/large.csv', body)
+
+        status, lines = self.stage([(url, path)], ranges=4)
+        self.assertEqual(status, 0)
+        self.assertEqual(staging.parse_staged(lines), {path: len(body)})
+        with open(path, 'rb') as descriptor:
+            self.assertEqual(hashlib.md5(descriptor.read()).hexdigest(),
+                             hashlib.md5(body).hexdigest())
+        self.assertEqual(len(self.server.ranges), 4)
+        self.assertEqual(os.listdir(self.directory), ['large.csv'])
+
+    def test_size_mismatch_fails(self):
+        body = os.urandom(5000)
+        url, path = self.serve('/short.csv', body)
+        self.server.lengths['/short.csv'] = len(body) + 10
+
+        status, lines = self.stage([(url, path)])
+        self.assertNotEqual(status, 0)
+        self.assertEqual(staging.parse_staged(lines), {})
+        self.assertFalse(os.path.exists(path))
+
+    def test_etag_mismatch_fails(self):
+        good, bad = os.urandom(5000), os.urandom(5000)
+        good_url, good_path = self.serve('/good.csv', good)
+        bad_url, bad_path = self.serve('/bad.csv', bad)
+        self.server.etags['/bad.csv'] = hashlib.md5(good).hexdigest()
+
+        status, lines = self.stage([(good_url, good_path),
+                                    (bad_url, bad_path)])
+        self.assertNotEqual(status, 0)
+        self.assertEqual(staging.parse_staged(lines), {good_path: len(good)})
+        self.assertFalse(os.path.exists(bad_path))
+
+
+class ParseStagedTest(unittest.TestCase):
+    def test_parse_staged(self):
+        lines = ['staged 10 /mnt/a', 'noise', '  staged 5 /mnt/b  ',
+                 'staged x /mnt/c', 'size mismatch for http://host/d']
+        self.assertEqual(staging.parse_staged(lines),
+                         {'/mnt/a': 10, '/mnt/b': 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import storage
+
+DEVICES = [storage.Device('xvdb', 1 << 30), storage.Device('xvdc', 1 << 30),
+           storage.Device('xvdd', 1 << 30)]
+
+DISK_BYTES = 40256929792
+ROOT_MOUNTS = ['/dev/xvda1 / ext4 rw,relatime,discard,data=ordered 0 0',
+               'proc /proc proc rw,nosuid,nodev,noexec,relatime 0 0',
+               'tmpfs /run tmpfs rw,nosuid,noexec,relatime,size=767932k 0 0']
+
+
+def detection(ephemeral, mounts=()):
+    """ Captured DETECT_COMMAND output for a node with `ephemeral` disks """
+    section = storage.SECTION
+    lines = ['{} lsblk'.format(section), 'xvda 8589934592 disk']
+    lines += ['xv{} {} disk'.format(name[1:], DISK_BYTES)
+              for name in ephemeral]
+    lines += ['{} mapping'.format(section)] + list(ephemeral)
+    lines += ['{} mounts'.format(section)] + ROOT_MOUNTS + list(mounts)
+    return lines
+
+
+class ParseDevicesTest(unittest.TestCase):
+    def test_no_ephemeral_disks(self):
+        devices = storage.parse_devices(detection([]))
+        self.assertEqual(devices, [])
+        self.assertIsNone(storage.plan_storage(devices))
+
+    def test_one_disk(self):
+        devices = storage.parse_devices(detection(
+            ['sdb'], ['/dev/xvdb /mnt ext3 rw,relatime,data=ordered 0 0']))
+        self.assertEqual(devices, [storage.Device('xvdb', DISK_BYTES)])
+        self.assertIsNone(storage.plan_storage(devices))
+
+    def test_several_disks(self):
+        devices = storage.parse_devices(detection(
+            ['sdb', 'sdc', 'sdd', 'sde'],
+            ['/dev/xvdb /mnt ext3 rw,relatime,data=ordered 0 0']))
+        self.assertEqual([device.name for device in devices],
+                         ['xvdb', 'xvdc', 'xvdd', 'xvde'])
+
+        plan = storage.plan_storage(devices)
+        self.assertEqual(plan.data, devices)
+        self.assertIsNone(plan.wal)
+
+        plan = storage.plan_storage(devices, split_wal=True)
+        self.assertEqual(plan.data, devices[:3])
+        self.assertEqual(plan.wal, devices[3])
+        self.assertEqual(plan.wal_mount, storage.DEFAULT_WAL_MOUNT)
+
+    def test_already_mounted_disk(self):
+        devices = storage.parse_devices(detection(
+            ['sdb', 'sdc', 'sdd'],
+            ['/dev/xvdc /data ext4 rw,relatime,data=ordered 0 0']))
+        self.assertEqual([device.name for device in devices],
+                         ['xvdb', 'xvdd'])
+        self.assertEqual(storage.plan_storage(devices).data, devices)
+
+    def test_excluded_volume(self):
+        devices = storage.parse_devices(detection(['sdb', 'sdc']),
+                                        excluded=['/dev/sdc'])
+        self.assertEqual([device.name for device in devices], ['xvdb'])
+
+
+class RelocateWalTest(unittest.TestCase):
+    def test_pg_xlog_before_10(self):
+        command = storage.relocate_wal_command('/mnt/pg', '/mnt/wal', '9.5')
+        self.assertIn('mv /mnt/pg/pg_xlog /mnt/wal/pg_xlog', command)
+        self.assertNotIn('pg_wal', command)
+
+    def test_pg_wal_from_10(self):
+        command = storage.relocate_wal_command('/mnt/pg', '/mnt/wal', '10')
+        self.assertIn('mv /mnt/pg/pg_wal /mnt/wal/pg_wal', command)
+        self.assertNotIn('pg_xlog', command)
+
+
+class LayoutCommandsTest(unittest.TestCase):
+    def setUp(self):
+        self.array, self.wal = storage.layout_commands(
+            storage.plan_storage(DEVICES, split_wal=True))[1:]
+
+    def test_formats_are_forced(self):
+        self.assertIn('mkfs.ext4 -F ', self.array)
+        self.assertIn('mkfs.ext4 -F ', self.wal)
+
+    def test_formats_skipped_only_when_mounted_at_target(self):
+        self.assertTrue(self.array.startswith(
+            'grep -q "^/dev/md0 /mnt " /proc/mounts || ('))
+        self.assertTrue(self.wal.startswith(
+            'grep -q "^/dev/xvdd /mnt/postgreswal " /proc/mounts || ('))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+import clustersim
+import myriaplugin
+
+
+class WsgiTest(unittest.TestCase):
+    def test_threaded_workers_get_futures(self):
+        nodes, _ = clustersim.make_cluster(1)
+        master = nodes[0]
+        installer = myriaplugin.MyriaInstaller(web_server='wsgi',
+                                               web_threads=4)
+        installer.configure_wsgi(master)
+
+        service = [command for command in master.ssh.commands
+                   if '/etc/init/myria-web.conf' in command][0]
+        self.assertIn('--threads 4', service)
+        install = [command for command in master.ssh.commands
+                   if 'pip install' in command][0]
+        self.assertIn("'gunicorn>=19,<20'", install)
+        self.assertIn("'futures>=3,<4'", install)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+Phase and remote-command spans for cluster setup.
+
+Plugins record spans into the shared TRACER, so spans from the parallel
+per-node jobs of every plugin in one StarCluster run land in one trace.
+Nodes wrapped by `Tracer.node` record a span for each remote command,
+tagged with the node alias and the phase running on the calling thread.
+"""
+import json
+import time
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from starcluster.logger import log
+
+DEFAULT_SUMMARY_COUNT = 10
+COMMAND_NAME_LENGTH = 60
+REMOTE_CATEGORY = 'ssh'
+
+Span = namedtuple('Span', ['name', 'phase', 'node', 'start', 'end',
+                           'thread', 'args'])
+
+
+def command_name(command):
+    """ A short single-line name for a remote command """
+    first = command.strip().splitlines()[0] if command.strip() else ''
+    if len(first) > COMMAND_NAME_LENGTH:
+        first = first[:COMMAND_NAME_LENGTH - 3] + '...'
+    return first
+
+
+class TracedSSH(object):
+    def __init__(self, tracer, node, ssh):
+        self._tracer = tracer
+        self._node = node
+        self._ssh = ssh
+
+    def __getattr__(self, name):
+        return getattr(self._ssh, name)
+
+    def execute(self, command, *args, **kwargs):
+        with self._tracer.span(command_name(command),
+                               node=self._node.alias,
+                               category=REMOTE_CATEGORY,
+                               command=command):
+            return self._ssh.execute(command, *args, **kwargs)
+
+
+class TracedNode(object):
+    """ Delegates to a StarCluster node, tracing commands run over ssh """
+
+    def __init__(self, tracer, node):
+        self._tracer = tracer
+        self._node = node
+        self.ssh = TracedSSH(tracer, node, node.ssh)
+
+    def __getattr__(self, name):
+        return getattr(self._node, name)
+
+    def __eq__(self, other):
+        return self._node == getattr(other, '_node', other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._node)
+
+
+class Tracer(object):
+    def __init__(self):
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def current_phase(self):
+        return getattr(self._local, 'phase', None)
+
+    @contextmanager
+    def span(self, name, phase=None, node=None, category=None, **args):
+        """
+        Record the enclosed block.  A span given a `phase` becomes the
+        current phase of its thread, so nested spans inherit it.
+        """
+        previous = self.current_phase()
+        if phase is not None:
+            self._local.phase = phase
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            self._local.phase = previous
+            if category:
+                args['category'] = category
+            with self._lock:
+                self.spans.append(Span(name, phase or previous, node,
+                                       start, end,
+                                       threading.current_thread().name,
+                                       args))
+
+    def node(self, node):
+        if isinstance(node, TracedNode):
+            return node
+        return TracedNode(self, node)
+
+    def nodes(self, nodes):
+        return [self.node(node) for node in nodes]
+
+    def chrome_trace(self):
+        """ The spans as a Chrome trace (also read by Perfetto) """
+        threads = {}
+        events = []
+        with self._lock:
+            spans = list(self.spans)
+        for span in sorted(spans, key=lambda span: span.start):
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(span.args, node=span.node, phase=span.phase)
+            events.append({
+                'name': '{} {}'.format(span.name, span.node)
+                        if span.node and span.node not in span.name
+                        else span.name,
+                'cat': args.pop('category', None) or span.phase or 'setup',
+                'ph': 'X',
+                'ts': int((span.start - self.started) * 1e6),
+                'dur': int((span.end - span.start) * 1e6),
+                'pid': 1,
+                'tid': tid,
+                'args': args})
+        for name, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                           'tid': tid, 'args': {'name': name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        with open(path, 'w') as descriptor:
+            json.dump(self.chrome_trace(), descriptor)
+        log.info('Trace of {} spans written to {}'.format(len(self.spans),
+                                                          path))
+
+    def slowest(self, count=DEFAULT_SUMMARY_COUNT):
+        """ The longest phase spans, excluding individual remote commands """
+        with self._lock:
+            phases = [span for span in self.spans
+                      if span.args.get('category') != REMOTE_CATEGORY]
+        return sorted(phases, key=lambda span: span.start - span.end)[:count]
+
+    def summary(self, count=DEFAULT_SUMMARY_COUNT):
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                if span.args.get('category') == REMOTE_CATEGORY:
+                    totals.setdefault(span.phase, [0, 0.0])
+                    totals[span.phase][0] += 1
+                    totals[span.phase][1] += span.end - span.start
+
+        log.info('Slowest phases:')
+        for span in self.slowest(count):
+            log.info('  {:<40} {:>7.1f}s'.format(
+                span.name if not span.node or span.node in span.name
+                else '{} on {}'.format(span.name, span.node),
+                span.end - span.start))
+        log.info('Remote command time by phase:')
+        for phase, (commands, remote) in sorted(
+                totals.items(), key=lambda item: -item[1][1])[:count]:
+            log.info('  {:<40} {:>7.1f}s in {} remote commands'.format(
+                phase or 'unphased', remote, commands))
+
+
+class NullTracer(Tracer):
+    """ Tracer used when tracing is off; records nothing """
+
+    @contextmanager
+    def span(self, name, phase=None, node=None, category=None, **args):
+        yield
+
+    def node(self, node):
+        return node
+
+
+TRACER = Tracer()
+NULL_TRACER = NullTracer()
+
+
+def tracer(enabled):
+    return TRACER if enabled else NULL_TRACER
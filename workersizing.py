@@ -0,0 +1,80 @@
+"""
+Choose how many Myria workers to run on each node and how large their heaps
+should be, given each node's memory and core count.
+
+Myria deployments carry a single JVM heap size, so the heap is chosen once
+for the cluster and each node then runs as many workers as its memory and
+cores allow; mixed instance types simply get different worker counts.
+"""
+import re
+from collections import OrderedDict, namedtuple
+
+CORES_PER_WORKER = 2
+MINIMUM_HEAP_GB = 1
+PREFERRED_HEAP_GB = 4
+OPERATING_SYSTEM_GB = 0.5
+# Share of the remaining memory left to the JVMs when Postgres is co-located
+JVM_MEMORY_FRACTION = {'postgresql': 0.5}
+DEFAULT_JVM_MEMORY_FRACTION = 0.75
+
+Worker = namedtuple('Worker', ['host', 'port', 'database'])
+
+_heap = re.compile(r'(\d+(?:\.\d+)?)\s*([gGmM]?)')
+
+
+def heap_gb(heap, default):
+    """ Heap size in GB from a number or a JVM-style value such as -Xmx2g """
+    if not heap:
+        return default
+    match = _heap.search(str(heap))
+    if not match:
+        return default
+    value = float(match.group(1))
+    if match.group(2).lower() == 'm':
+        value /= 1024
+    return int(value) if value.is_integer() else value
+
+
+def jvm_memory_gb(hardware, dbms):
+    fraction = JVM_MEMORY_FRACTION.get(dbms, DEFAULT_JVM_MEMORY_FRACTION)
+    return max(hardware['memory_mb'] / 1024.0 - OPERATING_SYSTEM_GB, 0) \
+        * fraction
+
+
+def workers_for(hardware, dbms, heap):
+    by_cores = max(hardware['cores'] // CORES_PER_WORKER, 1)
+    by_memory = int(jvm_memory_gb(hardware, dbms) // heap)
+    return max(min(by_cores, by_memory), 1)
+
+
+def choose_heap(hardware_by_node, dbms):
+    """
+    The largest heap (up to PREFERRED_HEAP_GB) that still lets every node
+    run one worker per CORES_PER_WORKER cores.
+    """
+    heaps = []
+    for hardware in hardware_by_node.values():
+        workers = max(hardware['cores'] // CORES_PER_WORKER, 1)
+        heaps.append(jvm_memory_gb(hardware, dbms) / workers)
+    if not heaps:
+        return MINIMUM_HEAP_GB
+    return int(max(min(min(heaps), PREFERRED_HEAP_GB), MINIMUM_HEAP_GB))
+
+
+def plan_workers(hosts, hardware_by_node, dbms, base_port, database_name,
+                 heap=None):
+    """
+    Returns (heap in GB, OrderedDict of host -> [Worker]).  `hosts` maps
+    each node key in `hardware_by_node` to the hostname used in the
+    deployment.  Workers on a node take consecutive ports from `base_port`
+    and, beyond the first, their own database.
+    """
+    heap = heap or choose_heap(hardware_by_node, dbms)
+    plan = OrderedDict()
+    for key, hardware in hardware_by_node.items():
+        count = workers_for(hardware, dbms, heap)
+        plan[key] = [Worker(hosts[key], int(base_port) + index,
+                            database_name if index == 0
+                            else '{}_{}'.format(database_name, index))
+                     for index in range(count)]
+    return heap, plan